@@ -0,0 +1 @@
+"""Helpers shared by the answering methods, evaluation and preprocessing scripts."""
@@ -0,0 +1,23 @@
+import math
+from typing import Dict, Iterable, List
+
+
+def percentile(values: Iterable[float], q: float) -> float:
+    """Linear-interpolated percentile (*q* in 0-100) of *values*; NaN when empty."""
+    ordered = sorted(values)
+    if not ordered:
+        return math.nan
+    rank = (len(ordered) - 1) * q / 100.0
+    low = math.floor(rank)
+    high = math.ceil(rank)
+    if low == high:
+        return ordered[low]
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize_latencies(latencies: List[float], percentiles=(50, 95, 99)) -> Dict[str, float]:
+    """``{"count", "mean", "p50", "p95", ...}`` for a list of latencies in seconds."""
+    summary = {"count": len(latencies), "mean": sum(latencies) / len(latencies) if latencies else math.nan}
+    for q in percentiles:
+        summary[f"p{q}"] = percentile(latencies, q)
+    return summary
@@ -0,0 +1,316 @@
+"""Micro-batching bge-m3 embedding service for CPU nodes.
+
+Concurrent callers each ask for one or a few questions; a worker thread collects
+them into batches of up to *max_batch_size*, waiting at most *max_wait_ms* after
+the first request, and runs one forward pass per batch. Recently embedded strings
+are served from an LRU cache. Run it as a local HTTP service with
+
+    python -m common.embedding_service --backend int8 --port 8765
+
+and point callers at it with ``EmbeddingClient("http://127.0.0.1:8765")``, which
+is a drop-in ``embed_fn`` for :class:`~common.semantic_cache.SemanticCache` and
+:class:`~common.vector_index.VectorIndex`.
+"""
+import argparse
+import asyncio
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Sequence
+
+import numpy as np
+
+from common.semantic_cache import EMBEDDING_MODEL_NAME
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+QUEUE_LATENCY_BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 250, 500, 1000)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus layout (``le`` upper bounds plus ``+Inf``)."""
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                break
+        else:
+            i = len(self.bounds)
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self) -> dict:
+        cumulative, buckets = 0, {}
+        for bound, count in zip(self.bounds + ["+Inf"], self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {"buckets": buckets, "count": self.count, "sum": self.sum,
+                "mean": self.sum / self.count if self.count else 0.0}
+
+
+def load_bge_m3(backend: str = "torch", device: str = "cpu") -> Callable[[Sequence[str]], np.ndarray]:
+    """``encode(texts) -> (n, 1024) float32`` for bge-m3 on *backend*.
+
+    ``"torch"`` is the plain SentenceTransformer model as in the notebooks,
+    ``"int8"`` applies PyTorch dynamic int8 quantization to its Linear layers and
+    ``"onnx"`` uses the sentence-transformers ONNX Runtime backend (needs
+    ``optimum[onnxruntime]``).
+    """
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "onnx":
+        model = SentenceTransformer(EMBEDDING_MODEL_NAME, device=device, backend="onnx")
+    else:
+        model = SentenceTransformer(EMBEDDING_MODEL_NAME, device=device)
+        if backend == "int8":
+            import torch
+
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        elif backend != "torch":
+            raise ValueError(f"Unknown backend {backend!r}; expected 'torch', 'int8' or 'onnx'")
+
+    def encode(texts: Sequence[str]) -> np.ndarray:
+        return model.encode(list(texts), batch_size=max(1, len(texts)), normalize_embeddings=True,
+                            convert_to_numpy=True).astype(np.float32)
+
+    return encode
+
+
+class EmbeddingBatcher:
+    """Thread-safe ``embed(texts)`` that coalesces concurrent calls into batched forward passes.
+
+    :param encode_fn:      ``fn(texts) -> (n, d)`` embeddings, e.g. from :func:`load_bge_m3`.
+    :param max_batch_size: Texts per forward pass.
+    :param max_wait_ms:    How long the first text of a batch may wait for company.
+    :param cache_size:     Embeddings kept for recently seen strings (0 disables the cache).
+    """
+
+    def __init__(self, encode_fn: Callable[[Sequence[str]], np.ndarray], max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0, cache_size: int = 4096):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue" = queue.Queue()
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_latency_ms = Histogram(QUEUE_LATENCY_BUCKETS_MS)
+        self.stats = {"requests": 0, "texts": 0, "cache_hits": 0, "batches": 0, "encode_seconds": 0.0}
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._worker.start()
+
+    def __call__(self, texts: Sequence[str]) -> np.ndarray:
+        return self.embed(texts)
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """Embeddings for *texts*, blocking until their batch has run."""
+        return np.stack([future.result() for future in self._submit(texts)])
+
+    async def embed_async(self, texts: Sequence[str]) -> np.ndarray:
+        """Like :meth:`embed` without blocking the event loop."""
+        vectors = await asyncio.gather(*(asyncio.wrap_future(f) for f in self._submit(texts)))
+        return np.stack(vectors)
+
+    def _submit(self, texts: Sequence[str]) -> List[Future]:
+        futures = []
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["texts"] += len(texts)
+            for text in texts:
+                future: Future = Future()
+                cached = self._cache.get(text)
+                if cached is not None:
+                    self._cache.move_to_end(text)
+                    self.stats["cache_hits"] += 1
+                    future.set_result(cached)
+                else:
+                    self._queue.put((text, future, time.perf_counter()))
+                futures.append(future)
+        return futures
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        if batch[0] is None:
+            return None
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            started = time.perf_counter()
+            # Identical strings queued by different callers share one row of the batch
+            unique = list(dict.fromkeys(text for text, _, _ in batch))
+            try:
+                vectors = np.asarray(self.encode_fn(unique), dtype=np.float32)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+            rows = dict(zip(unique, vectors))
+
+            with self._lock:
+                self.stats["batches"] += 1
+                self.stats["encode_seconds"] += finished - started
+                self.batch_sizes.observe(len(unique))
+                for text, _, enqueued in batch:
+                    self.queue_latency_ms.observe((started - enqueued) * 1000.0)
+                if self.cache_size:
+                    for text, vector in rows.items():
+                        self._cache[text] = vector
+                        self._cache.move_to_end(text)
+                    while len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+            for text, future, _ in batch:
+                future.set_result(rows[text])
+
+    def metrics(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["cache_hit_rate"] = stats["cache_hits"] / stats["texts"] if stats["texts"] else 0.0
+            stats["cache_entries"] = len(self._cache)
+            stats["batch_size"] = self.batch_sizes.snapshot()
+            stats["queue_latency_ms"] = self.queue_latency_ms.snapshot()
+        return stats
+
+    def close(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._worker.join()
+
+
+class EmbeddingServer:
+    """``POST /embed {"texts": [...]}`` -> ``{"embeddings": [[...]]}`` and ``GET /metrics`` over HTTP."""
+
+    def __init__(self, batcher: EmbeddingBatcher, host: str = "127.0.0.1", port: int = 0):
+        self.batcher = batcher
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "EmbeddingServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, payload):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path.rstrip("/") == "/metrics":
+                    self._send_json(200, server.batcher.metrics())
+                else:
+                    self._send_json(404, {"error": self.path})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if self.path.rstrip("/") != "/embed" or not isinstance(body.get("texts"), list):
+                    self._send_json(400, {"error": "expected POST /embed with {\"texts\": [...]}"})
+                    return
+                try:
+                    vectors = server.batcher.embed(body["texts"])
+                except Exception as e:
+                    self._send_json(500, {"error": str(e)})
+                    return
+                self._send_json(200, {"embeddings": vectors.tolist()})
+
+        return Handler
+
+
+class EmbeddingClient:
+    """``embed_fn`` backed by a running :class:`EmbeddingServer`."""
+
+    def __init__(self, url: str, timeout: float = 30.0):
+        import requests
+
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self._session = requests.Session()
+
+    def __call__(self, texts: Sequence[str]) -> np.ndarray:
+        response = self._session.post(f"{self.url}/embed", json={"texts": list(texts)}, timeout=self.timeout)
+        response.raise_for_status()
+        return np.asarray(response.json()["embeddings"], dtype=np.float32)
+
+    def metrics(self) -> Dict:
+        response = self._session.get(f"{self.url}/metrics", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["torch", "int8", "onnx"], default="int8")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--cache-size", type=int, default=4096)
+    args = parser.parse_args()
+
+    batcher = EmbeddingBatcher(load_bge_m3(args.backend), max_batch_size=args.max_batch_size,
+                               max_wait_ms=args.max_wait_ms, cache_size=args.cache_size)
+    with EmbeddingServer(batcher, host=args.host, port=args.port) as server:
+        print(f"bge-m3 ({args.backend}) embedding service listening on {server.url} (Ctrl+C to stop)")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+    batcher.close()
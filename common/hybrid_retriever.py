@@ -0,0 +1,77 @@
+from typing import Dict, List, Sequence, Tuple
+
+from common.lexical_index import BM25Index
+from common.tracing import span
+from common.vector_index import VectorIndex
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence], k: int = 60) -> List[Tuple[object, float]]:
+    """Fuse ranked id lists: ``score(id) = sum(1 / (k + rank))``, best first."""
+    fused: Dict[object, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+class HybridRetriever:
+    """BM25 + dense retrieval fused with reciprocal-rank fusion, with a lexical fast path.
+
+    Questions that are mostly exact tax terms ("ลดหย่อน", "ภ.ง.ด.90") are usually
+    decided by BM25 alone. When the best BM25 score is at least *min_lexical_score*
+    and the runner-up scores at most *decisive_ratio* of it, the lexical ranking is
+    returned without embedding the question. Otherwise the top *candidates* of both
+    rankings are fused. Both indexes must be built from the same records.
+    """
+
+    def __init__(self, lexical: BM25Index, dense: VectorIndex, rrf_k: int = 60, candidates: int = 20,
+                 min_lexical_score: float = 2.0, decisive_ratio: float = 0.6, fast_path: bool = True):
+        self.lexical = lexical
+        self.dense = dense
+        self.rrf_k = rrf_k
+        self.candidates = candidates
+        self.min_lexical_score = min_lexical_score
+        self.decisive_ratio = decisive_ratio
+        self.fast_path = fast_path
+        self._rows = {doc_id: row for row, doc_id in enumerate(lexical.ids)}
+        self.stats = {"queries": 0, "lexical_only": 0, "hybrid": 0}
+
+    @classmethod
+    def open(cls, embed_fn=None, **kwargs) -> "HybridRetriever":
+        """Hybrid retriever over the persisted knowledge-base indexes (built on first use)."""
+        return cls(BM25Index.open(), VectorIndex.open(embed_fn=embed_fn), **kwargs)
+
+    def is_decisive(self, scores) -> bool:
+        if len(scores) == 0 or scores[0] < self.min_lexical_score:
+            return False
+        return len(scores) == 1 or scores[1] <= self.decisive_ratio * scores[0]
+
+    def query(self, question: str, top_k: int = 5) -> Dict[str, list]:
+        """Pinecone-style ``{"matches": [...], "retrieval": "lexical" | "hybrid"}``."""
+        with span("retrieval") as attributes:
+            result = self._query(question, top_k)
+            attributes["mode"] = result["retrieval"]
+        return result
+
+    def _query(self, question: str, top_k: int) -> Dict[str, list]:
+        self.stats["queries"] += 1
+        lexical_scores, lexical_rows = self.lexical.search(question, top_k=max(top_k, self.candidates))
+        if self.fast_path and self.is_decisive(lexical_scores):
+            self.stats["lexical_only"] += 1
+            matches = [
+                {"id": self.lexical.ids[row], "score": float(score), "metadata": self.lexical.metadata[row]}
+                for score, row in zip(lexical_scores[:top_k], lexical_rows[:top_k])
+            ]
+            return {"matches": matches, "retrieval": "lexical"}
+
+        self.stats["hybrid"] += 1
+        dense_matches = self.dense.query(question, top_k=self.candidates)["matches"]
+        fused = reciprocal_rank_fusion(
+            [[self.lexical.ids[row] for row in lexical_rows], [match["id"] for match in dense_matches]],
+            k=self.rrf_k,
+        )
+        matches = [
+            {"id": doc_id, "score": score, "metadata": self.lexical.metadata[self._rows[doc_id]]}
+            for doc_id, score in fused[:top_k]
+        ]
+        return {"matches": matches, "retrieval": "hybrid"}
@@ -0,0 +1,160 @@
+import json
+import os
+import re
+import tempfile
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from common.semantic_cache import SourceFingerprint
+from common.thai_text import normalize_question
+from common.vector_index import INDEX_DIR, KNOWLEDGE_BASE_PATH, load_records, record_text
+
+_WORD_RE = re.compile(r"\w")
+
+
+def thai_tokens(text: str) -> List[str]:
+    """pythainlp ``newmm`` tokens of the normalised text, without whitespace, punctuation and stopwords."""
+    from pythainlp.corpus import thai_stopwords
+    from pythainlp.tokenize import word_tokenize
+
+    stopwords = thai_stopwords()
+    return [token for token in word_tokenize(normalize_question(text), engine="newmm", keep_whitespace=False)
+            if _WORD_RE.search(token) and token not in stopwords]
+
+
+class BM25Index:
+    """Okapi BM25 over knowledge-base records, stored as a compact CSR inverted index.
+
+    Each posting keeps its precomputed BM25 weight (idf × saturated, length-normalised
+    term frequency) as float32, so a query is a vocabulary lookup plus one
+    ``np.bincount`` over the postings of its terms. The index is persisted as
+    ``<name>.bm25.npz`` (postings) and ``<name>.bm25.json`` (vocabulary, ids,
+    metadata, source hash, text format) next to the vector index. Records are
+    scored on the same ``question|answer`` text the vector index embeds.
+    """
+
+    def __init__(self, vocabulary: Dict[str, int], offsets: np.ndarray, doc_rows: np.ndarray,
+                 weights: np.ndarray, ids: Sequence, metadata: Sequence[dict], source_hash: Optional[str] = None,
+                 text_format: Optional[str] = None):
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.doc_rows = doc_rows
+        self.weights = weights
+        self.ids = list(ids)
+        self.metadata = list(metadata)
+        self.source_hash = source_hash
+        self.text_format = text_format
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    # ---------------------------------------------------------------- build / load
+
+    @classmethod
+    def build(cls, records: Sequence[dict], text_fn: Callable[[dict], str] = record_text, k1: float = 1.5,
+              b: float = 0.75, source_hash: Optional[str] = None) -> "BM25Index":
+        counts = [Counter(thai_tokens(text_fn(record))) for record in records]
+        lengths = np.array([sum(c.values()) for c in counts], dtype=np.float32)
+        average_length = float(lengths.mean()) if len(lengths) else 0.0
+
+        postings: Dict[str, list] = {}
+        for row, term_counts in enumerate(counts):
+            for term, tf in term_counts.items():
+                postings.setdefault(term, []).append((row, tf))
+
+        vocabulary, offsets, doc_rows, weights = {}, [0], [], []
+        for term in sorted(postings):
+            docs = postings[term]
+            idf = np.log(1.0 + (len(records) - len(docs) + 0.5) / (len(docs) + 0.5))
+            for row, tf in docs:
+                norm = k1 * (1.0 - b + b * lengths[row] / max(average_length, 1e-9))
+                doc_rows.append(row)
+                weights.append(idf * tf * (k1 + 1.0) / (tf + norm))
+            vocabulary[term] = len(vocabulary)
+            offsets.append(len(doc_rows))
+
+        return cls(
+            vocabulary,
+            np.asarray(offsets, dtype=np.int32),
+            np.asarray(doc_rows, dtype=np.int32),
+            np.asarray(weights, dtype=np.float32),
+            [record["id"] for record in records],
+            [{k: v for k, v in record.items() if k != "id"} for record in records],
+            source_hash=source_hash,
+            text_format=text_fn.__name__,
+        )
+
+    def save(self, index_dir: str = INDEX_DIR, name: str = "knowledge_base") -> None:
+        os.makedirs(index_dir, exist_ok=True)
+        postings_path, meta_path = self._paths(index_dir, name)
+        meta = {"vocabulary": self.vocabulary, "ids": self.ids, "metadata": self.metadata,
+                "source_hash": self.source_hash, "text_format": self.text_format}
+        fd, tmp_postings = tempfile.mkstemp(dir=index_dir, suffix=".npz")
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, offsets=self.offsets, doc_rows=self.doc_rows, weights=self.weights)
+        fd, tmp_meta = tempfile.mkstemp(dir=index_dir, suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_postings, postings_path)
+        os.replace(tmp_meta, meta_path)
+
+    @classmethod
+    def load(cls, index_dir: str = INDEX_DIR, name: str = "knowledge_base") -> "BM25Index":
+        postings_path, meta_path = cls._paths(index_dir, name)
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with np.load(postings_path) as postings:
+            return cls(meta["vocabulary"], postings["offsets"], postings["doc_rows"], postings["weights"],
+                       meta["ids"], meta["metadata"], source_hash=meta.get("source_hash"),
+                       text_format=meta.get("text_format"))
+
+    @classmethod
+    def open(cls, path: str = KNOWLEDGE_BASE_PATH, index_dir: str = INDEX_DIR, name: str = "knowledge_base",
+             text_fn: Callable[[dict], str] = record_text) -> "BM25Index":
+        """Load the index for the knowledge base at *path*, rebuilding it only if the file or *text_fn* changed."""
+        source_hash = SourceFingerprint([path]).current()
+        try:
+            index = cls.load(index_dir, name)
+            if index.source_hash == source_hash and index.text_format == text_fn.__name__:
+                return index
+        except FileNotFoundError:
+            pass
+        index = cls.build(load_records(path), text_fn=text_fn, source_hash=source_hash)
+        index.save(index_dir, name)
+        return index
+
+    @staticmethod
+    def _paths(index_dir: str, name: str):
+        base = os.path.join(index_dir, name)
+        return base + ".bm25.npz", base + ".bm25.json"
+
+    # ---------------------------------------------------------------- search
+
+    def scores(self, question: str) -> np.ndarray:
+        """BM25 score of every record for *question* (zeros when no term matches)."""
+        term_ids = [self.vocabulary[t] for t in thai_tokens(question) if t in self.vocabulary]
+        if not term_ids:
+            return np.zeros(len(self), dtype=np.float32)
+        spans = [np.arange(self.offsets[t], self.offsets[t + 1]) for t in term_ids]
+        postings = np.concatenate(spans)
+        return np.bincount(self.doc_rows[postings], weights=self.weights[postings],
+                           minlength=len(self)).astype(np.float32)
+
+    def search(self, question: str, top_k: int = 5):
+        """Top-k ``(scores, rows)`` by BM25, best first; records with no matching term are left out."""
+        scores = self.scores(question)
+        top_k = min(top_k, len(self))
+        rows = np.argpartition(-scores, top_k - 1)[:top_k] if len(self) > top_k else np.arange(len(self))
+        rows = rows[np.argsort(-scores[rows], kind="stable")]
+        rows = rows[scores[rows] > 0]
+        return scores[rows], rows
+
+    def query(self, question: str, top_k: int = 5) -> Dict[str, list]:
+        """Pinecone-style ``{"matches": [...]}`` for *question*."""
+        scores, rows = self.search(question, top_k=top_k)
+        return {"matches": [
+            {"id": self.ids[row], "score": float(score), "metadata": self.metadata[row]}
+            for score, row in zip(scores, rows)
+        ]}
@@ -0,0 +1,471 @@
+"""One async gateway for every LLM call: pooled clients, retries, hedged requests and failover.
+
+A route is an ordered list of :class:`Target` s (provider + model). A request
+goes to the first target; retryable errors (429, 5xx, timeouts, dropped
+connections) are retried with jittered exponential backoff, honouring
+``retry-after``, and once a target gives up, or fails with any other error, the
+next target of the route takes over. When the first target has not answered
+within its observed *hedge_percentile* latency, a backup request is sent to the
+second target and whichever answers first wins; the other is cancelled. If the
+first target fails meanwhile, failover waits for that backup request instead of
+sending the second target another one. A target that keeps failing is skipped
+for a cooldown (a circuit breaker), so an outage costs one failed call per
+target rather than every request's full retry budget.
+
+Requests use the Anthropic Messages shape (``system``, ``messages``,
+``max_tokens``); for OpenAI-compatible providers (OpenAI, OpenRouter) the
+messages are translated, including images in either format and PDF document
+blocks as ``file`` parts (URL sources are only accepted by OpenRouter). SDK clients are
+created once per provider endpoint and event loop and share a keep-alive
+connection pool. Synchronous scripts call :meth:`LLMGateway.complete_sync`,
+which runs on the gateway's own event loop thread.
+
+    from common.llm_gateway import Target, gateway
+    gateway.add_route("long_context", [Target("anthropic", "claude-3-7-sonnet-20250219"),
+                                       Target("anthropic", "claude-3-5-sonnet-20241022")])
+    completion = await gateway.complete({"messages": [...], "max_tokens": 1024}, route="long_context")
+"""
+import asyncio
+import os
+import random
+import sys
+import threading
+import time
+import weakref
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+
+import anthropic
+import httpx
+from prometheus_client import Counter
+
+from common.benchmark import percentile, summarize_latencies
+from common.rate_limiter import _retry_after
+
+# provider -> (API flavour, API key variable, default base URL)
+PROVIDERS = {
+    "anthropic": ("anthropic", "ANTHROPIC_API_KEY", None),
+    "openai": ("openai", "OPENAI_API_KEY", None),
+    "openrouter": ("openai", "OPENROUTER_API_KEY", "https://openrouter.ai/api/v1"),
+}
+
+# The Messages API requires max_tokens; OpenAI-compatible targets only get it when the request sets it
+DEFAULT_MAX_TOKENS = 1024
+RETRYABLE_STATUS = {408, 409, 429}
+
+CALLS = Counter("llm_gateway_calls_total", "LLM API calls made by the gateway", ["target", "status"])
+HEDGES = Counter("llm_gateway_hedges_total", "Backup requests fired after the hedge delay", ["route", "winner"])
+FAILOVERS = Counter("llm_gateway_failovers_total", "Requests moved to the next target of their route", ["route"])
+BREAKER_TRIPS = Counter("llm_gateway_breaker_trips_total", "Targets taken out of rotation after repeated failures",
+                        ["target"])
+
+
+@dataclass(frozen=True)
+class Target:
+    """One model at one provider endpoint; *api_key* defaults to the provider's environment variable."""
+    provider: str
+    model: str
+    base_url: Optional[str] = None
+    api_key: Optional[str] = field(default=None, repr=False)
+    headers: Tuple[Tuple[str, str], ...] = ()
+
+    @property
+    def name(self) -> str:
+        """``provider:model``, with the endpoint when it is not the provider's default."""
+        name = f"{self.provider}:{self.model}"
+        return f"{name}@{self.base_url}" if self.base_url else name
+
+    @property
+    def flavour(self) -> str:
+        return PROVIDERS[self.provider][0]
+
+    def connection(self) -> Tuple[str, Optional[str], Optional[str]]:
+        """What the SDK client depends on: flavour, base URL and API key."""
+        _, key_variable, default_url = PROVIDERS[self.provider]
+        return self.flavour, self.base_url or default_url, self.api_key or os.getenv(key_variable)
+
+
+@dataclass
+class Usage:
+    """Token usage with the attribute names of the Anthropic SDK (``usage_report`` accepts it)."""
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_creation_input_tokens: int = 0
+    cache_read_input_tokens: int = 0
+
+
+@dataclass
+class Completion:
+    text: str
+    target: str
+    usage: Usage
+    latency: float  # seconds for the whole request, retries and hedging included
+    attempts: int = 1
+    hedged: bool = False  # a backup request was fired
+    winner: str = "primary"  # "primary", "hedge" or "failover"
+    raw: Any = field(default=None, repr=False)
+
+
+class _TargetFailed(Exception):
+    """Every attempt on a target failed; carries the attempts made."""
+
+    def __init__(self, error: BaseException, attempts: int):
+        super().__init__(str(error))
+        self.error = error
+        self.attempts = attempts
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Rate limits, server errors, timeouts and dropped connections are worth retrying."""
+    if isinstance(error, (anthropic.APIConnectionError, httpx.TransportError)):
+        return True
+    # openai is only imported once an OpenAI-flavour target is used
+    openai = sys.modules.get("openai")
+    if openai is not None and isinstance(error, openai.APIConnectionError):
+        return True
+    status = getattr(error, "status_code", None)
+    return status is not None and (status in RETRYABLE_STATUS or status >= 500)
+
+
+def _data_url(source: dict) -> str:
+    return f"data:{source['media_type']};base64,{source['data']}"
+
+
+def _to_anthropic_block(block) -> dict:
+    if isinstance(block, str):
+        return {"type": "text", "text": block}
+    if block.get("type") == "image_url":
+        url = block["image_url"]["url"]
+        if url.startswith("data:"):
+            header, data = url.split(",", 1)
+            return {"type": "image", "source": {"type": "base64", "media_type": header[5:].split(";")[0], "data": data}}
+        return {"type": "image", "source": {"type": "url", "url": url}}
+    return block
+
+
+def _to_openai_block(block) -> dict:
+    if isinstance(block, str):
+        return {"type": "text", "text": block}
+    kind = block.get("type")
+    if kind == "text":
+        return {"type": "text", "text": block["text"]}
+    if kind == "image_url":
+        return block
+    if kind == "image":
+        source = block["source"]
+        url = source["url"] if source["type"] == "url" else _data_url(source)
+        return {"type": "image_url", "image_url": {"url": url}}
+    if kind == "document":
+        source = block["source"]
+        if source["type"] == "text":
+            return {"type": "text", "text": source["data"]}
+        url = source["url"] if source["type"] == "url" else _data_url(source)
+        filename = block.get("title") or os.path.basename(source.get("url", "")) or "document.pdf"
+        return {"type": "file", "file": {"filename": filename, "file_data": url}}
+    raise ValueError(f"{kind!r} content blocks need an Anthropic target")
+
+
+def _content(content, convert):
+    return content if isinstance(content, str) else [convert(block) for block in content]
+
+
+class LLMGateway:
+    """Routes requests to LLM providers with pooled clients, retries, hedging and failover.
+
+    :param routes:            ``{route name: [Target, ...]}`` in order of preference.
+    :param max_attempts:      Attempts per target for retryable errors.
+    :param base_delay:        First backoff delay in seconds, doubled per attempt (with jitter).
+    :param max_delay:         Upper bound for one backoff delay.
+    :param hedge_percentile:  Fire the backup once the first target is slower than this
+                              percentile of its recent latencies (``None`` disables hedging).
+    :param hedge_min_samples: Latencies needed before the percentile is trusted.
+    :param hedge_after:       Hedge delay in seconds until then (``None``: do not hedge yet).
+    :param max_connections:   Connection pool size per provider endpoint.
+    :param breaker_failures:  Consecutive retryable failures that take a target out of rotation.
+    :param breaker_cooldown:  Seconds a tripped target is skipped; one failure after that trips it again.
+    """
+
+    def __init__(self, routes: Optional[Dict[str, Sequence[Target]]] = None, max_attempts: int = 3,
+                 base_delay: float = 1.0, max_delay: float = 30.0, timeout: float = 600.0,
+                 hedge_percentile: Optional[float] = 95.0, hedge_min_samples: int = 20,
+                 hedge_after: Optional[float] = None, max_connections: int = 32, latency_window: int = 200,
+                 breaker_failures: int = 5, breaker_cooldown: float = 30.0):
+        self.routes: Dict[str, List[Target]] = {name: list(targets) for name, targets in (routes or {}).items()}
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_after = hedge_after
+        self.max_connections = max_connections
+        self.latency_window = latency_window
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+        self._failures: Dict[str, int] = {}
+        self._open_until: Dict[str, float] = {}
+        self._clients: Dict[tuple, Any] = {}  # made outside an event loop
+        self._loop_clients = weakref.WeakKeyDictionary()  # event loop -> {connection: client}
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stats = {"requests": 0, "calls": 0, "retries": 0, "errors": 0, "hedges": 0, "hedge_wins": 0,
+                      "failovers": 0, "breaker_trips": 0, "skipped": 0}
+
+    # ---------------------------------------------------------------- routes and clients
+
+    def add_route(self, name: str, targets: Sequence[Target]) -> None:
+        self.routes[name] = list(targets)
+
+    def client(self, target: Target):
+        """The pooled SDK client for *target* on the running event loop.
+
+        A client made outside an event loop (at import time) belongs to whichever
+        loop uses it first. Clients of event loops that have been closed (each
+        ``asyncio.run`` closes its own) are dropped.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        key = target.connection()
+        with self._lock:
+            if loop is None:
+                pool = self._clients
+            else:
+                for closed in [other for other in self._loop_clients if other.is_closed()]:
+                    del self._loop_clients[closed]
+                pool = self._loop_clients.setdefault(loop, {})
+            client = pool.get(key)
+            if client is None:
+                flavour, base_url, api_key = target.connection()
+                http_client = httpx.AsyncClient(
+                    limits=httpx.Limits(max_connections=self.max_connections,
+                                        max_keepalive_connections=self.max_connections),
+                    timeout=self.timeout,
+                )
+                if flavour == "anthropic":
+                    sdk = anthropic.AsyncAnthropic
+                else:
+                    from openai import AsyncOpenAI as sdk
+                # Retries are the gateway's job, not the SDK's
+                client = sdk(api_key=api_key or "unset", base_url=base_url, max_retries=0, http_client=http_client)
+                pool[key] = client
+        return client
+
+    def route_client(self, route: str):
+        """Pooled client of the first target of *route*, for calls the gateway does not wrap (streaming)."""
+        return self.client(self.routes[route][0])
+
+    # ---------------------------------------------------------------- hedging
+
+    def observe_latency(self, target: Target, seconds: float) -> None:
+        with self._lock:
+            window = self._latencies.setdefault(target.name, deque(maxlen=self.latency_window))
+            window.append(seconds)
+
+    def hedge_delay(self, target: Target) -> Optional[float]:
+        """Seconds to wait for *target* before firing a backup request, or ``None`` for no hedging."""
+        if self.hedge_percentile is None:
+            return None
+        with self._lock:
+            latencies = list(self._latencies.get(target.name, ()))
+        if len(latencies) < self.hedge_min_samples:
+            return self.hedge_after
+        return percentile(latencies, self.hedge_percentile)
+
+    # ---------------------------------------------------------------- circuit breaker
+
+    def available(self, target: Target) -> bool:
+        """False while *target* is cooling down after repeated failures."""
+        with self._lock:
+            return time.monotonic() >= self._open_until.get(target.name, 0.0)
+
+    def _record_outcome(self, target: Target, ok: bool) -> None:
+        with self._lock:
+            if ok:
+                self._failures.pop(target.name, None)
+                self._open_until.pop(target.name, None)
+                return
+            failures = self._failures[target.name] = self._failures.get(target.name, 0) + 1
+            if failures >= self.breaker_failures and time.monotonic() >= self._open_until.get(target.name, 0.0):
+                self._open_until[target.name] = time.monotonic() + self.breaker_cooldown
+                self.stats["breaker_trips"] += 1
+                BREAKER_TRIPS.labels(target.name).inc()
+
+    # ---------------------------------------------------------------- requests
+
+    async def complete(self, request: dict, route: str = "default") -> Completion:
+        """Send *request* along *route*: hedged on the first two targets, failing over down the list."""
+        targets = self.routes[route]
+        start = time.monotonic()
+        self.stats["requests"] += 1
+        # Skip targets whose breaker is open; if every one is, try them all anyway
+        candidates = [target for target in targets if self.available(target)] or list(targets)
+        self.stats["skipped"] += len(targets) - len(candidates)
+        hedges: Dict[Target, asyncio.Task] = {}
+        chain = asyncio.create_task(self._failover(request, route, candidates, targets[0], hedges))
+        delay = self.hedge_delay(candidates[0]) if len(candidates) > 1 else None
+        if delay is None:
+            try:
+                completion = await chain
+            except _TargetFailed as e:
+                raise e.error
+            completion.latency = time.monotonic() - start
+            return completion
+
+        tasks = {chain}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            hedged = not done
+            if hedged:
+                self.stats["hedges"] += 1
+                hedges[candidates[1]] = asyncio.create_task(self._call(candidates[1], request))
+                tasks.add(hedges[candidates[1]])
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                # The chain may have finished by awaiting the hedge; credit the hedge
+                for task in sorted(done, key=lambda task: task is chain):
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    completion = task.result()
+                    completion.hedged = hedged
+                    if task is not chain:
+                        completion.winner = "hedge"
+                        self.stats["hedge_wins"] += 1
+                    if hedged:
+                        HEDGES.labels(route, completion.winner).inc()
+                    completion.latency = time.monotonic() - start
+                    return completion
+            raise error.error if isinstance(error, _TargetFailed) else error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def complete_sync(self, request: dict, route: str = "default") -> Completion:
+        """Blocking :meth:`complete` for synchronous callers, run on the gateway's event loop thread."""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="llm-gateway", daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(self.complete(request, route), self._loop).result()
+
+    async def _failover(self, request: dict, route: str, targets: Sequence[Target], primary: Target,
+                        hedges: Optional[Dict[Target, asyncio.Task]] = None) -> Completion:
+        """Try *targets* in order; a target with a backup request in *hedges* is awaited, not called again."""
+        attempts = 0
+        for index, target in enumerate(targets):
+            hedge = (hedges or {}).get(target)
+            try:
+                completion = await (hedge if hedge is not None else self._call(target, request))
+            except _TargetFailed as e:
+                attempts += e.attempts
+                if index == len(targets) - 1:
+                    raise
+                self.stats["failovers"] += 1
+                FAILOVERS.labels(route).inc()
+                continue
+            completion.attempts += attempts
+            if target != primary:
+                completion.winner = "failover"
+            return completion
+
+    async def _call(self, target: Target, request: dict) -> Completion:
+        """*request* on one target with retries; raises :class:`_TargetFailed` when it gives up."""
+        for attempt in range(1, self.max_attempts + 1):
+            sent = time.monotonic()
+            self.stats["calls"] += 1
+            try:
+                completion = await self._send(target, request)
+            except asyncio.CancelledError:
+                CALLS.labels(target.name, "cancelled").inc()
+                raise
+            except Exception as e:
+                self.stats["errors"] += 1
+                CALLS.labels(target.name, "error").inc()
+                retryable = is_retryable(e)
+                if retryable:
+                    # Bad requests say nothing about the target's health
+                    self._record_outcome(target, ok=False)
+                if not retryable or attempt == self.max_attempts or not self.available(target):
+                    raise _TargetFailed(e, attempt) from e
+                self.stats["retries"] += 1
+                await asyncio.sleep(self._backoff(e, attempt))
+                continue
+            CALLS.labels(target.name, "ok").inc()
+            self._record_outcome(target, ok=True)
+            self.observe_latency(target, time.monotonic() - sent)
+            completion.attempts = attempt
+            return completion
+
+    def _backoff(self, error: BaseException, attempt: int) -> float:
+        """``retry-after`` when the server sent one, else jittered exponential backoff."""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+        response = getattr(error, "response", None)
+        if response is not None and "retry-after" in response.headers:
+            delay = min(self.max_delay, _retry_after(response.headers, delay))
+        return delay
+
+    async def _send(self, target: Target, request: dict) -> Completion:
+        client = self.client(target)
+        headers = dict(target.headers) or None
+        options = {key: request[key] for key in ("max_tokens", "temperature", "stop_sequences") if key in request}
+        if target.flavour == "anthropic":
+            options.setdefault("max_tokens", DEFAULT_MAX_TOKENS)
+            kwargs = {"model": target.model, "extra_headers": headers, **options,
+                      "messages": [dict(m, content=_content(m["content"], _to_anthropic_block))
+                                   for m in request["messages"]]}
+            if request.get("system"):
+                kwargs["system"] = request["system"]
+            message = await client.messages.create(**kwargs)
+            usage = message.usage
+            return Completion(
+                text="".join(block.text for block in message.content if block.type == "text"),
+                target=target.name,
+                usage=Usage(usage.input_tokens, usage.output_tokens,
+                            getattr(usage, "cache_creation_input_tokens", None) or 0,
+                            getattr(usage, "cache_read_input_tokens", None) or 0),
+                latency=0.0, raw=message,
+            )
+
+        system = request.get("system")
+        if isinstance(system, list):
+            system = "\n\n".join(block["text"] for block in system)
+        messages = ([{"role": "system", "content": system}] if system else []) + [
+            {"role": m["role"], "content": _content(m["content"], _to_openai_block)} for m in request["messages"]]
+        if "stop_sequences" in options:
+            options["stop"] = options.pop("stop_sequences")
+        completion = await client.chat.completions.create(model=target.model, messages=messages,
+                                                          extra_headers=headers, **options)
+        usage = completion.usage
+        details = getattr(usage, "prompt_tokens_details", None) if usage is not None else None
+        cached = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+        return Completion(
+            text=completion.choices[0].message.content or "",
+            target=target.name,
+            usage=Usage(usage.prompt_tokens - cached, usage.completion_tokens, 0, cached) if usage else Usage(),
+            latency=0.0, raw=completion,
+        )
+
+    # ---------------------------------------------------------------- reporting
+
+    def metrics(self) -> Dict[str, object]:
+        now = time.monotonic()
+        with self._lock:
+            latencies = {name: summarize_latencies(list(window)) for name, window in self._latencies.items()}
+            open_targets = sorted(name for name, until in self._open_until.items() if until > now)
+        return dict(self.stats, latency=latencies, breaker_open=open_targets)
+
+    async def aclose(self) -> None:
+        """Close the pooled clients created on the running event loop."""
+        with self._lock:
+            clients = list(self._loop_clients.pop(asyncio.get_running_loop(), {}).values())
+        for client in clients:
+            await client.close()
+
+
+# Shared instance; each caller registers its route (see inference.py)
+gateway = LLMGateway()
@@ -0,0 +1,181 @@
+import asyncio
+import email.utils
+import time
+from dataclasses import dataclass, field
+from typing import Mapping, Optional
+
+
+class TokenBucket:
+    """Continuously refilling bucket holding up to one minute of budget.
+
+    :param per_minute: Budget replenished every 60 seconds (requests or tokens).
+    """
+
+    def __init__(self, per_minute: float):
+        self.limit = float(per_minute)
+        self.scale = 1.0
+        self.level = self.limit
+        self._updated = time.monotonic()
+
+    @property
+    def rate(self) -> float:
+        """Refill rate per second after adaptive scaling."""
+        return self.limit * self.scale / 60.0
+
+    def _refill(self, now: float) -> None:
+        elapsed = max(0.0, now - self._updated)
+        self.level = min(self.limit, self.level + elapsed * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until *amount* can be taken (0 when it is available now)."""
+        self._refill(now)
+        amount = min(amount, self.limit)  # a single oversized request waits for a full bucket
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.level -= min(amount, self.limit)
+
+    def refund(self, amount: float) -> None:
+        self.level = min(self.limit, self.level + amount)
+
+    def clamp(self, remaining: float) -> None:
+        """Trust the server when it reports less budget than we think we have."""
+        self.level = min(self.level, remaining)
+
+    def drain(self) -> None:
+        self.level = 0.0
+
+
+@dataclass
+class RateLimiter:
+    """Requests/input-token/output-token budgets shared by concurrent workers.
+
+    Workers ``acquire`` an estimate before each call and ``reconcile`` it with the
+    real usage afterwards. Rate-limit responses halve the effective rate and pause
+    every worker until ``retry-after``; each success recovers a little of it.
+    """
+
+    requests_per_minute: float = 50
+    input_tokens_per_minute: float = 20_000
+    output_tokens_per_minute: float = 8_000
+    min_scale: float = 0.1
+    recovery_step: float = 0.05
+    input_estimate: float = 14_000
+    paused_until: float = 0.0
+    rate_limited: int = 0
+    buckets: dict = field(init=False)
+
+    def __post_init__(self):
+        self.buckets = {
+            "requests": TokenBucket(self.requests_per_minute),
+            "input_tokens": TokenBucket(self.input_tokens_per_minute),
+            "output_tokens": TokenBucket(self.output_tokens_per_minute),
+        }
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, input_tokens: int, output_tokens: int) -> float:
+        """Wait until one request with the given token estimate fits every budget.
+
+        Returns the number of seconds spent waiting.
+        """
+        wanted = {"requests": 1, "input_tokens": input_tokens, "output_tokens": output_tokens}
+        waited = 0.0
+        # The lock keeps waiters in FIFO order so large requests are not starved
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                delay = max(
+                    [self.paused_until - now]
+                    + [self.buckets[name].wait_time(amount, now) for name, amount in wanted.items()]
+                )
+                if delay <= 0:
+                    for name, amount in wanted.items():
+                        self.buckets[name].take(amount)
+                    return waited
+                await asyncio.sleep(delay)
+                waited += delay
+
+    def reconcile(self, reserved_input: int, reserved_output: int, input_tokens: int, output_tokens: int) -> None:
+        """Return the unused part of a reservation (or charge the overshoot)."""
+        self.buckets["input_tokens"].refund(reserved_input - input_tokens)
+        self.buckets["output_tokens"].refund(reserved_output - output_tokens)
+
+    def observe_input(self, tokens: int) -> None:
+        """Track uncached input per request (it drops sharply once the prefix is cached)."""
+        self.input_estimate = 0.5 * self.input_estimate + 0.5 * tokens
+
+    def on_success(self, headers: Optional[Mapping[str, str]] = None) -> None:
+        for bucket in self.buckets.values():
+            bucket.scale = min(1.0, bucket.scale + self.recovery_step)
+        if headers is not None:
+            self.update_from_headers(headers)
+
+    def on_rate_limited(self, headers: Optional[Mapping[str, str]] = None, default_delay: float = 10.0) -> float:
+        """Back off after a 429: pause everyone, drain the buckets and halve the rate.
+
+        Returns the pause in seconds.
+        """
+        self.rate_limited += 1
+        for bucket in self.buckets.values():
+            bucket.scale = max(self.min_scale, bucket.scale / 2)
+            bucket.drain()
+
+        delay = default_delay
+        if headers is not None:
+            self.update_from_headers(headers)
+            delay = _retry_after(headers, default_delay)
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        return delay
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """Adopt the limits and remaining budgets the API reports.
+
+        Understands Anthropic's ``anthropic-ratelimit-{requests,input-tokens,output-tokens}-{limit,remaining}``
+        and OpenAI-style ``x-ratelimit-{limit,remaining}-{requests,tokens}`` headers.
+        """
+        names = {
+            "requests": ("anthropic-ratelimit-requests", "x-ratelimit-%s-requests"),
+            "input_tokens": ("anthropic-ratelimit-input-tokens", "x-ratelimit-%s-tokens"),
+            "output_tokens": ("anthropic-ratelimit-output-tokens", None),
+        }
+        for name, (anthropic_prefix, openai_pattern) in names.items():
+            bucket = self.buckets[name]
+            limit = _header_number(headers, f"{anthropic_prefix}-limit")
+            remaining = _header_number(headers, f"{anthropic_prefix}-remaining")
+            if openai_pattern is not None:
+                limit = limit if limit is not None else _header_number(headers, openai_pattern % "limit")
+                remaining = remaining if remaining is not None else _header_number(headers, openai_pattern % "remaining")
+
+            if limit is not None and limit > 0:
+                bucket.limit = limit
+            if remaining is not None:
+                bucket.clamp(remaining)
+
+
+def _header_number(headers: Mapping[str, str], name: str) -> Optional[float]:
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _retry_after(headers: Mapping[str, str], default: float) -> float:
+    """Parse ``retry-after`` as seconds or an HTTP date."""
+    value = headers.get("retry-after")
+    if value is None:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    return max(0.0, when.timestamp() - time.time())
@@ -0,0 +1,142 @@
+import copy
+import json
+import os
+import tempfile
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+
+class ResultJournal:
+    """Append-only JSONL journal with one record per finished test case.
+
+    Each record is ``{"id", "status", "inference_result", "metrics", "error", "ts"}``
+    where *status* is ``"ok"`` or ``"error"``. The latest record for an id wins, so a
+    retried case simply appends a new line. Appends are flushed and fsynced; a torn
+    final line left by a crash is ignored on load and terminated before the next append.
+
+    :param path: JSONL file, created on first append.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def append(self, case_id, inference_result: Optional[str] = None, metrics: Optional[dict] = None,
+               error: Optional[str] = None) -> dict:
+        record = {
+            "id": case_id,
+            "status": "error" if error is not None else "ok",
+            "inference_result": inference_result,
+            "metrics": metrics or {},
+            "error": error,
+            "ts": time.time(),
+        }
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+
+        parent = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(parent, exist_ok=True)
+        with open(self.path, "a+b") as f:
+            # Terminate a partial line left by an interrupted write
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+            f.write(line.encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        return record
+
+    def records(self) -> Iterable[dict]:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # torn write from a crash
+
+    def load(self) -> Dict[object, dict]:
+        """Latest record per test-case id."""
+        latest = {}
+        for record in self.records():
+            latest[record["id"]] = record
+        return latest
+
+    def pending_ids(self, test_cases: List[dict]) -> List[object]:
+        """Ids in *test_cases* order that are missing from the journal or last failed."""
+        latest = self.load()
+        return [
+            case["id"] for case in test_cases
+            if latest.get(case["id"], {}).get("status") != "ok"
+        ]
+
+    def import_results(self, results: dict) -> int:
+        """Seed an empty journal from an existing results JSON (the legacy resume format).
+
+        Returns the number of records written.
+        """
+        if self.load():
+            return 0
+        written = 0
+        for case in results.get("test_cases", []):
+            if "inference_result" in case:
+                self.append(case["id"], case["inference_result"], case.get("metrics"))
+            elif "error" in case:
+                self.append(case["id"], metrics=case.get("metrics"), error=case["error"])
+            else:
+                continue
+            written += 1
+        return written
+
+    def compact(self, base: dict, output_path: Optional[str] = None,
+                overall_metrics: Optional[Callable[[List[dict]], dict]] = None, indent: int = 2) -> dict:
+        """Merge the journal into *base* (a test set) and return the results document.
+
+        Successful cases gain ``inference_result`` and ``metrics``; failed ones gain
+        ``error``. *overall_metrics*, when given, computes the ``overall_metrics`` block
+        from the merged test cases. With *output_path* the document is written
+        atomically as indented JSON.
+        """
+        latest = self.load()
+        results = copy.deepcopy(base)
+        for case in results["test_cases"]:
+            record = latest.get(case["id"])
+            if record is None:
+                continue
+            if record["status"] == "ok":
+                case.pop("error", None)
+                case["inference_result"] = record["inference_result"]
+                case["metrics"] = record["metrics"]
+            else:
+                case["error"] = record["error"]
+
+        if overall_metrics is not None:
+            results["overall_metrics"] = overall_metrics(results["test_cases"])
+
+        if output_path is not None:
+            write_json_atomic(output_path, results, indent=indent)
+        return results
+
+
+def write_json_atomic(path: str, data: dict, indent: int = 2) -> None:
+    """Write JSON to a temp file in the same directory and rename it over *path*."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def journal_path_for(output_path: str) -> str:
+    """``results.json`` -> ``results.journal.jsonl``"""
+    return os.path.splitext(output_path)[0] + ".journal.jsonl"
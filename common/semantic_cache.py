@@ -0,0 +1,311 @@
+import atexit
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from common.thai_text import normalize_question
+from common.tracing import span
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+CACHE_DIR = os.path.join(REPO_ROOT, ".cache", "semantic_answers")
+
+# Answers go stale when the knowledge base or the long-context PDFs change
+DEFAULT_SOURCES = [os.path.join(REPO_ROOT, "data", "knowledgeBase.json")] + sorted(
+    glob.glob(os.path.join(REPO_ROOT, "methods", "long_context_inference", "raw_data", "*.pdf"))
+)
+
+EMBEDDING_MODEL_NAME = "BAAI/bge-m3"
+
+
+def bge_m3_embedder(device: Optional[str] = None) -> Callable[[Sequence[str]], np.ndarray]:
+    """Return ``embed(texts) -> (n, 1024) float32`` using the same bge-m3 model as the RAG notebooks.
+
+    The model is loaded on first call, so building a cache that only sees exact
+    repeats never pays for it.
+    """
+    model = None
+
+    def embed(texts: Sequence[str]) -> np.ndarray:
+        nonlocal model
+        if model is None:
+            from sentence_transformers import SentenceTransformer
+            import torch
+
+            model = SentenceTransformer(EMBEDDING_MODEL_NAME, device=device or ("cuda" if torch.cuda.is_available() else "cpu"))
+        return model.encode(list(texts), normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+    return embed
+
+
+class SourceFingerprint:
+    """Content hash of the source files, re-hashing only files whose mtime/size changed."""
+
+    def __init__(self, paths: Sequence[str]):
+        self.paths = list(paths)
+        self._signatures: Dict[str, tuple] = {}
+        self._digests: Dict[str, str] = {}
+
+    def current(self) -> str:
+        hasher = hashlib.sha256()
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                hasher.update(f"{path}:missing".encode("utf-8"))
+                continue
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if self._signatures.get(path) != signature:
+                with open(path, "rb") as f:
+                    self._digests[path] = hashlib.sha256(f.read()).hexdigest()
+                self._signatures[path] = signature
+            hasher.update(f"{os.path.basename(path)}:{self._digests[path]}".encode("utf-8"))
+        return hasher.hexdigest()
+
+
+class SemanticCache:
+    """Answer cache keyed on normalised Thai questions and their bge-m3 embeddings.
+
+    A lookup first tries the exact normalised question (no embedding needed), then
+    the most similar cached question; cosine similarity at or above *threshold*
+    counts as a hit. Entries are evicted least-recently-used beyond *max_entries*
+    and after *ttl_seconds*. The cache is persisted to ``<CACHE_DIR>/<namespace>.json``
+    (+ ``.npy`` embeddings) at most every *autosave_seconds* and at exit, and is
+    cleared whenever the source files change.
+
+    :param namespace: One cache per answering method, e.g. ``"long_context"``.
+    :param embed_fn:  ``fn(texts) -> (n, d)`` L2-normalised embeddings; defaults to bge-m3.
+    """
+
+    def __init__(self, namespace: str, embed_fn: Optional[Callable[[Sequence[str]], np.ndarray]] = None,
+                 threshold: float = 0.95, max_entries: int = 2000, ttl_seconds: float = 7 * 24 * 3600,
+                 cache_dir: Optional[str] = CACHE_DIR, sources: Sequence[str] = DEFAULT_SOURCES,
+                 autosave_seconds: float = 30.0):
+        self.namespace = namespace
+        self.embed_fn = embed_fn or bge_m3_embedder()
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.cache_dir = cache_dir
+        self.autosave_seconds = autosave_seconds
+        self._last_save = 0.0
+        self.fingerprint = SourceFingerprint(sources)
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._embeddings: Dict[str, np.ndarray] = {}
+        self._matrix = None  # (keys, stacked embeddings), rebuilt lazily
+        self._lock = threading.RLock()
+        self._source_hash = self.fingerprint.current()
+        self.stats = {"lookups": 0, "exact_hits": 0, "semantic_hits": 0, "misses": 0,
+                      "evictions": 0, "invalidations": 0, "latency_saved_seconds": 0.0,
+                      "lookup_seconds": 0.0}
+        self._load()
+        atexit.register(self.save)
+
+    # ---------------------------------------------------------------- persistence
+
+    @property
+    def _paths(self):
+        base = os.path.join(self.cache_dir, self.namespace)
+        return base + ".json", base + ".npy"
+
+    def _load(self) -> None:
+        if self.cache_dir is None:
+            return
+        meta_path, vectors_path = self._paths
+        if not (os.path.exists(meta_path) and os.path.exists(vectors_path)):
+            return
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("source_hash") != self._source_hash:
+            self.stats["invalidations"] += 1
+            return
+        vectors = np.load(vectors_path)
+        for row, entry in enumerate(meta["entries"]):
+            self._entries[entry["key"]] = entry
+            self._embeddings[entry["key"]] = vectors[row]
+        self._expire(time.time())
+
+    def save(self) -> None:
+        """Write the cache atomically (metadata JSON + embedding matrix)."""
+        if self.cache_dir is None:
+            return
+        with self._lock:
+            self._last_save = time.monotonic()
+            os.makedirs(self.cache_dir, exist_ok=True)
+            keys = list(self._entries)
+            vectors = (np.stack([self._embeddings[k] for k in keys]) if keys
+                       else np.zeros((0, 0), dtype=np.float32))
+            meta = {"source_hash": self._source_hash, "entries": [self._entries[k] for k in keys]}
+            meta_path, vectors_path = self._paths
+
+            fd, tmp_vectors = tempfile.mkstemp(dir=self.cache_dir, suffix=".npy")
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, vectors)
+            fd, tmp_meta = tempfile.mkstemp(dir=self.cache_dir, suffix=".json")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(tmp_vectors, vectors_path)
+            os.replace(tmp_meta, meta_path)
+
+    # ---------------------------------------------------------------- maintenance
+
+    def _check_sources(self) -> None:
+        current = self.fingerprint.current()
+        if current != self._source_hash:
+            self._source_hash = current
+            self.clear()
+            self.stats["invalidations"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._embeddings.clear()
+            self._matrix = None
+
+    def _remove(self, key: str) -> None:
+        self._entries.pop(key, None)
+        self._embeddings.pop(key, None)
+        self._matrix = None
+
+    def _expire(self, now: float) -> None:
+        for key in [k for k, e in self._entries.items() if now - e["created"] > self.ttl_seconds]:
+            self._remove(key)
+            self.stats["evictions"] += 1
+
+    def _nearest(self, vector: np.ndarray):
+        if self._matrix is None:
+            keys = list(self._entries)
+            matrix = np.stack([self._embeddings[k] for k in keys]) if keys else None
+            self._matrix = (keys, matrix)
+        keys, matrix = self._matrix
+        if matrix is None:
+            return None, -1.0
+        scores = matrix @ vector
+        best = int(np.argmax(scores))
+        return keys[best], float(scores[best])
+
+    # ---------------------------------------------------------------- lookups
+
+    def lookup(self, question: str) -> Optional[dict]:
+        """Return ``{"answer", "metadata", "similarity", "matched_question", "match"}`` or None."""
+        return self.lookup_with_vector(question)[0]
+
+    def lookup_with_vector(self, question: str) -> Tuple[Optional[dict], Optional[np.ndarray]]:
+        """:meth:`lookup`, plus the question's embedding when one was computed (pass it to :meth:`store`)."""
+        start = time.perf_counter()
+        key = normalize_question(question)
+        with self._lock:
+            self.stats["lookups"] += 1
+            self._check_sources()
+            self._expire(time.time())
+            exact = key in self._entries
+
+        similarity, match, vector = 1.0, "exact", None
+        if not exact:
+            # Only paraphrases pay for an embedding, and not while holding the lock
+            vector = self._embed_one(key)
+            match = "semantic"
+
+        with self._lock:
+            if not exact:
+                key, similarity = self._nearest(vector)
+            if key is None or key not in self._entries or similarity < self.threshold:
+                self.stats["misses"] += 1
+                self.stats["lookup_seconds"] += time.perf_counter() - start
+                return None, vector
+
+            entry = self._entries[key]
+            entry["last_access"] = time.time()
+            entry["hits"] = entry.get("hits", 0) + 1
+            self._entries.move_to_end(key)
+            self.stats[f"{match}_hits"] += 1
+            lookup_seconds = time.perf_counter() - start
+            self.stats["lookup_seconds"] += lookup_seconds
+            self.stats["latency_saved_seconds"] += max(0.0, entry["latency_seconds"] - lookup_seconds)
+            return {
+                "answer": entry["answer"],
+                "metadata": entry["metadata"],
+                "similarity": similarity,
+                "matched_question": entry["question"],
+                "match": match,
+            }, vector
+
+    def store(self, question: str, answer: str, latency_seconds: float, metadata: Optional[dict] = None,
+              vector: Optional[np.ndarray] = None) -> None:
+        """Cache *answer*; *latency_seconds* is what a later hit saves.
+
+        *vector* is the question's embedding from :meth:`lookup_with_vector`, so a
+        miss is embedded once rather than again here.
+        """
+        key = normalize_question(question)
+        if vector is None:
+            vector = self._embed_one(key)
+        with self._lock:
+            self._check_sources()
+            now = time.time()
+            self._remove(key)
+            self._entries[key] = {
+                "key": key,
+                "question": question,
+                "answer": answer,
+                "metadata": metadata or {},
+                "latency_seconds": latency_seconds,
+                "created": now,
+                "last_access": now,
+                "hits": 0,
+            }
+            self._embeddings[key] = vector
+            while len(self._entries) > self.max_entries:
+                oldest, _ = self._entries.popitem(last=False)
+                self._embeddings.pop(oldest, None)
+                self.stats["evictions"] += 1
+            self._matrix = None
+            due = time.monotonic() - self._last_save >= self.autosave_seconds
+        if due:
+            self.save()
+
+    def get_or_compute(self, question: str, compute: Callable[[str], str]) -> str:
+        """Cached answer for *question*, calling ``compute(question)`` on a miss."""
+        hit, vector = self.lookup_with_vector(question)
+        if hit is not None:
+            return hit["answer"]
+        start = time.perf_counter()
+        answer = compute(question)
+        self.store(question, answer, time.perf_counter() - start, vector=vector)
+        return answer
+
+    def _embed_one(self, text: str) -> np.ndarray:
+        with span("embedding", texts=1):
+            return np.asarray(self.embed_fn([text])[0], dtype=np.float32)
+
+    def metrics(self) -> dict:
+        """Hit rate, latency saved and entry count for dashboards and logs."""
+        stats = dict(self.stats)
+        hits = stats["exact_hits"] + stats["semantic_hits"]
+        stats["hits"] = hits
+        stats["hit_rate"] = hits / stats["lookups"] if stats["lookups"] else 0.0
+        stats["entries"] = len(self._entries)
+        return stats
+
+
+def hashed_ngram_embedder(dim: int = 512, n: int = 3) -> Callable[[List[str]], np.ndarray]:
+    """Dependency-free character n-gram embedder for offline runs and benchmarks."""
+
+    def embed(texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            padded = f" {text} "
+            for i in range(max(1, len(padded) - n + 1)):
+                digest = hashlib.blake2b(padded[i:i + n].encode("utf-8"), digest_size=4).digest()
+                vectors[row, int.from_bytes(digest, "little") % dim] += 1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    return embed
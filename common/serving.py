@@ -0,0 +1,117 @@
+import asyncio
+from typing import AsyncIterator, Callable, Dict, Optional
+
+from common.thai_text import normalize_question
+
+
+class ServerBusy(RuntimeError):
+    """Raised when the generation queue is full; the caller should retry later."""
+
+
+class _Generation:
+    """One in-flight generation shared by every request for the same question."""
+
+    def __init__(self):
+        self.latest = None
+        self.version = 0
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.changed = asyncio.Condition()
+        self.task: Optional[asyncio.Task] = None
+
+
+class QueryServer:
+    """Async front for an answering method with bounded concurrency and request coalescing.
+
+    *producer* is ``fn(question) -> async iterator of updates``; a non-streaming
+    method simply yields its final result once. At most *max_concurrency*
+    generations run at a time and at most *max_queue* more may wait for a slot;
+    beyond that new questions are rejected with :class:`ServerBusy`. Requests whose
+    normalised question matches an in-flight generation attach to it and receive
+    the same updates and final result instead of starting another LLM call.
+    """
+
+    def __init__(self, producer: Callable[[str], AsyncIterator], max_concurrency: int = 4,
+                 max_queue: int = 16, coalesce: bool = True, key_fn: Callable[[str], str] = normalize_question):
+        self.producer = producer
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.coalesce = coalesce
+        self.key_fn = key_fn
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._inflight: Dict[object, _Generation] = {}
+        self._generations = 0  # running + queued
+        self.running = 0
+        self.stats = {"requests": 0, "generations": 0, "coalesced": 0, "rejected": 0, "errors": 0}
+
+    @property
+    def queued(self) -> int:
+        return self._generations - self.running
+
+    def _attach(self, question: str) -> _Generation:
+        self.stats["requests"] += 1
+        key = self.key_fn(question) if self.coalesce else object()
+        generation = self._inflight.get(key)
+        if generation is not None:
+            self.stats["coalesced"] += 1
+        else:
+            if self._generations >= self.max_concurrency + self.max_queue:
+                self.stats["rejected"] += 1
+                raise ServerBusy(f"{self._generations} generations in flight or queued")
+            generation = _Generation()
+            self._inflight[key] = generation
+            self._generations += 1
+            self.stats["generations"] += 1
+            generation.task = asyncio.create_task(self._run(key, generation, question))
+        generation.subscribers += 1
+        return generation
+
+    async def _run(self, key, generation: _Generation, question: str) -> None:
+        try:
+            async with self._semaphore:
+                self.running += 1
+                try:
+                    async for update in self.producer(question):
+                        async with generation.changed:
+                            generation.latest = update
+                            generation.version += 1
+                            generation.changed.notify_all()
+                finally:
+                    self.running -= 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            generation.error = e
+        finally:
+            self._inflight.pop(key, None)
+            self._generations -= 1
+            async with generation.changed:
+                generation.done = True
+                generation.changed.notify_all()
+
+    async def stream(self, question: str) -> AsyncIterator:
+        """Yield the updates of the (possibly shared) generation for *question*.
+
+        A request that attaches late starts from the latest partial update. If the
+        caller stops iterating, the generation keeps running for the others.
+        """
+        generation = self._attach(question)
+        seen = 0
+        while True:
+            async with generation.changed:
+                await generation.changed.wait_for(lambda: generation.version > seen or generation.done)
+                latest, version, done = generation.latest, generation.version, generation.done
+            if version > seen:
+                seen = version
+                yield latest
+            elif done:
+                if generation.error is not None:
+                    raise generation.error
+                return
+
+    async def submit(self, question: str):
+        """Return the final update of the generation for *question*."""
+        result = None
+        async for update in self.stream(question):
+            result = update
+        return result
@@ -0,0 +1,401 @@
+"""BLEU, ROUGE and BERTScore for several result files in one pass.
+
+Computes the same per-case numbers as ``evaluate_metrics`` in the
+``inference_analysis.ipynb`` notebooks (newmm tokens, NLTK ``sentence_bleu``
+with ``method1`` smoothing, ``rouge_score`` with a newmm tokenizer, BERTScore
+with ``xlm-roberta-base``) without their per-row overhead: every distinct text
+is tokenized once, in a process pool, and encoded once, in length-sorted CPU
+batches. Tokens and BERTScore embeddings are kept under ``.cache/text_metrics``,
+so the golden answers shared by all methods are never re-encoded.
+
+    python -m common.text_metrics                                  # the four methods' result files
+    python -m common.text_metrics --out-dir evaluation_metrics \\
+        --reference methods/long_context_inference/evaluation_result/evaluation_results.csv
+"""
+import argparse
+import csv
+import hashlib
+import json
+import math
+import os
+import re
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from common.semantic_cache import REPO_ROOT
+
+CACHE_DIR = os.path.join(REPO_ROOT, ".cache", "text_metrics")
+BERT_MODEL = "xlm-roberta-base"
+# Layer BERTScore takes its embeddings from (bert_score.utils.model2layers)
+BERT_LAYERS = {"xlm-roberta-base": 9, "xlm-roberta-large": 17, "bert-base-multilingual-cased": 9}
+
+RESULT_FILES = {
+    "long_context": os.path.join(REPO_ROOT, "methods", "long_context_inference", "tax-test-results.json"),
+    "agentic_rag": os.path.join(REPO_ROOT, "methods", "rag", "evaluation_results.json"),
+    "naive_rag": os.path.join(REPO_ROOT, "methods", "rag", "evaluation_results_naive_rag.json"),
+    "vanilla": os.path.join(REPO_ROOT, "methods", "naive", "evaluation_results_naive.json"),
+}
+
+BLEU_WEIGHTS = {
+    "bleu1": (1, 0, 0, 0),
+    "bleu2": (0.5, 0.5, 0, 0),
+    "bleu3": (0.33, 0.33, 0.33, 0),
+    "bleu4": (0.25, 0.25, 0.25, 0.25),
+}
+COLUMNS = ["id", "question", *BLEU_WEIGHTS,
+           *(f"{name}_{part}" for name in ("rouge1", "rouge2", "rougeL") for part in ("precision", "recall", "f1")),
+           "bert_precision", "bert_recall", "bert_f1"]
+
+
+def preprocess_text(text: str) -> str:
+    """Markdown headings and runs of whitespace removed, as before BLEU in the notebooks."""
+    text = re.sub(r"#+ ", "", text)
+    text = re.sub(r"\n+", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def tokenize_for_metrics(text: str) -> Dict[str, List[str]]:
+    """newmm tokens of the preprocessed text (BLEU) and of the raw text (ROUGE)."""
+    from pythainlp.tokenize import word_tokenize
+
+    return {"bleu": word_tokenize(preprocess_text(text), engine="newmm"),
+            "rouge": word_tokenize(text, engine="newmm")}
+
+
+def _ngrams(tokens: Sequence[str], n: int) -> Counter:
+    return Counter(tuple(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+
+
+def bleu_scores(reference: Sequence[str], candidate: Sequence[str]) -> Dict[str, float]:
+    """``sentence_bleu([reference], candidate, weights, SmoothingFunction().method1)`` for BLEU-1..4."""
+    numerators, denominators = [], []
+    for n in range(1, 5):
+        counts, reference_counts = _ngrams(candidate, n), _ngrams(reference, n)
+        numerators.append(sum(min(count, reference_counts[gram]) for gram, count in counts.items()))
+        denominators.append(max(1, sum(counts.values())))
+    if numerators[0] == 0:
+        return {name: 0 for name in BLEU_WEIGHTS}
+
+    # method1: add epsilon to the numerator of zero precisions
+    precisions = [num / den if num else 0.1 / den for num, den in zip(numerators, denominators)]
+    hyp_len, ref_len = len(candidate), len(reference)
+    brevity = 1.0 if hyp_len > ref_len else math.exp(1 - ref_len / hyp_len)
+    return {name: brevity * math.exp(math.fsum(w * math.log(p) for w, p in zip(weights, precisions)))
+            for name, weights in BLEU_WEIGHTS.items()}
+
+
+def _fmeasure(precision: float, recall: float) -> float:
+    return 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+
+
+def _lcs_length(a: Sequence[str], b: Sequence[str]) -> int:
+    """Bit-parallel LCS length (Allison-Dix), one big-int step per token of *b*."""
+    masks: Dict[str, int] = {}
+    for i, token in enumerate(a):
+        masks[token] = masks.get(token, 0) | (1 << i)
+    full = (1 << len(a)) - 1
+    v = full
+    for token in b:
+        u = v & masks.get(token, 0)
+        v = ((v + u) | (v - u)) & full
+    return len(a) - bin(v).count("1")
+
+
+def rouge_scores(reference: Sequence[str], candidate: Sequence[str]) -> Dict[str, float]:
+    """ROUGE-1/2/L precision, recall and F1 as ``rouge_score.RougeScorer`` computes them."""
+    scores = {}
+    for n in (1, 2):
+        target, prediction = _ngrams(reference, n), _ngrams(candidate, n)
+        overlap = sum(min(count, prediction[gram]) for gram, count in target.items())
+        precision = overlap / max(sum(prediction.values()), 1)
+        recall = overlap / max(sum(target.values()), 1)
+        scores.update({f"rouge{n}_precision": precision, f"rouge{n}_recall": recall,
+                       f"rouge{n}_f1": _fmeasure(precision, recall)})
+    if reference and candidate:
+        lcs = _lcs_length(reference, candidate)
+        precision, recall = lcs / len(candidate), lcs / len(reference)
+    else:
+        precision = recall = 0.0
+    scores.update({"rougeL_precision": precision, "rougeL_recall": recall, "rougeL_f1": _fmeasure(precision, recall)})
+    return scores
+
+
+def _text_key(*parts: str) -> str:
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def _atomic_write(path: str, write) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+class TokenCache:
+    """newmm tokens per text, persisted as one JSON file."""
+
+    def __init__(self, cache_dir: Optional[str] = CACHE_DIR):
+        self.path = os.path.join(cache_dir, "tokens.json") if cache_dir else None
+        self._tokens: Dict[str, Dict[str, List[str]]] = {}
+        self._dirty = False
+        if self.path and os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._tokens = json.load(f)
+
+    def tokenize(self, texts: Sequence[str], workers: Optional[int] = None) -> Dict[str, Dict[str, List[str]]]:
+        """Tokens for each distinct text, tokenizing cache misses across *workers* processes."""
+        missing = sorted({text for text in texts if _text_key(text) not in self._tokens}, key=len, reverse=True)
+        if missing:
+            if (workers or os.cpu_count() or 1) > 1 and len(missing) > 1:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    tokenized = list(pool.map(tokenize_for_metrics, missing, chunksize=4))
+            else:
+                tokenized = [tokenize_for_metrics(text) for text in missing]
+            for text, tokens in zip(missing, tokenized):
+                self._tokens[_text_key(text)] = tokens
+            self._dirty = True
+        return {text: self._tokens[_text_key(text)] for text in texts}
+
+    def save(self) -> None:
+        if self.path and self._dirty:
+            payload = json.dumps(self._tokens, ensure_ascii=False).encode("utf-8")
+            _atomic_write(self.path, lambda f: f.write(payload))
+            self._dirty = False
+
+
+class BertScorer:
+    """BERTScore (no idf, no baseline rescaling) with cached, batch-encoded token embeddings.
+
+    Matches ``bert_score.score(cands, refs, lang="th", model_type=...)``: the
+    model is cut after :data:`BERT_LAYERS` layers, similarities are greedy
+    cosine matches over all tokens, and the ``<s>``/``</s>`` tokens get zero
+    weight in the averages.
+    """
+
+    def __init__(self, model_name: str = BERT_MODEL, num_layers: Optional[int] = None, batch_size: int = 16,
+                 cache_dir: Optional[str] = CACHE_DIR, device: str = "cpu"):
+        self.model_name = model_name
+        self.num_layers = num_layers or BERT_LAYERS[model_name]
+        self.batch_size = batch_size
+        self.cache_dir = os.path.join(cache_dir, "bert", model_name.replace("/", "__")) if cache_dir else None
+        self.device = device
+        self._model = None
+        self._tokenizer = None
+        self._memory: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self.stats = {"encoded": 0, "cached": 0}
+
+    def _load(self):
+        if self._model is None:
+            import torch
+            from transformers import AutoModel, AutoTokenizer
+
+            self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            model = AutoModel.from_pretrained(self.model_name)
+            model.encoder.layer = torch.nn.ModuleList(list(model.encoder.layer[:self.num_layers]))
+            self._model = model.eval().to(self.device)
+        return self._model, self._tokenizer
+
+    def _path(self, key: str) -> Optional[str]:
+        return os.path.join(self.cache_dir, key + ".npz") if self.cache_dir else None
+
+    def _encode_ids(self, text: str) -> List[int]:
+        text = text.strip()
+        if not text:
+            return self._tokenizer.build_inputs_with_special_tokens([])
+        return self._tokenizer.encode(text, add_special_tokens=True, max_length=self._tokenizer.model_max_length,
+                                      truncation=True)
+
+    def embed(self, texts: Sequence[str]) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """``{text: (unit-norm token embeddings, token weights)}`` for each distinct text."""
+        keys = {text: _text_key(self.model_name, str(self.num_layers), text.strip()) for text in texts}
+        missing = []
+        for text, key in keys.items():
+            if key in self._memory:
+                continue
+            path = self._path(key)
+            if path and os.path.exists(path):
+                with np.load(path) as cached:
+                    self._memory[key] = (cached["embedding"], cached["weights"])
+                self.stats["cached"] += 1
+            else:
+                missing.append(text)
+
+        if missing:
+            import torch
+
+            model, tokenizer = self._load()
+            special = {tokenizer.cls_token_id, tokenizer.sep_token_id}
+            encoded = sorted(((text, self._encode_ids(text)) for text in missing), key=lambda item: -len(item[1]))
+            for first in range(0, len(encoded), self.batch_size):
+                batch = encoded[first:first + self.batch_size]
+                width = max(len(ids) for _, ids in batch)
+                input_ids = torch.full((len(batch), width), tokenizer.pad_token_id, dtype=torch.long)
+                attention = torch.zeros((len(batch), width), dtype=torch.long)
+                for row, (_, ids) in enumerate(batch):
+                    input_ids[row, :len(ids)] = torch.tensor(ids)
+                    attention[row, :len(ids)] = 1
+                with torch.no_grad():
+                    hidden = model(input_ids.to(self.device), attention_mask=attention.to(self.device))[0]
+                hidden = hidden.cpu().numpy().astype(np.float32)
+                for row, (text, ids) in enumerate(batch):
+                    embedding = hidden[row, :len(ids)]
+                    embedding = embedding / np.linalg.norm(embedding, axis=-1, keepdims=True)
+                    weights = np.array([0.0 if token in special else 1.0 for token in ids], dtype=np.float32)
+                    self._memory[keys[text]] = (embedding, weights)
+                    path = self._path(keys[text])
+                    if path:
+                        _atomic_write(path, lambda f: np.savez(f, embedding=embedding, weights=weights))
+            self.stats["encoded"] += len(missing)
+        return {text: self._memory[keys[text]] for text in texts}
+
+    def score(self, candidates: Sequence[str], references: Sequence[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Per-pair precision, recall and F1 as float32 arrays."""
+        embedded = self.embed(list(candidates) + list(references))
+        precision, recall = [], []
+        for candidate, reference in zip(candidates, references):
+            (cand_emb, cand_w), (ref_emb, ref_w) = embedded[candidate], embedded[reference]
+            sim = cand_emb @ ref_emb.T
+            precision.append(float(sim.max(axis=1) @ (cand_w / cand_w.sum())))
+            recall.append(float(sim.max(axis=0) @ (ref_w / ref_w.sum())))
+        p, r = np.array(precision, dtype=np.float32), np.array(recall, dtype=np.float32)
+        return p, r, 2 * p * r / (p + r)
+
+
+def load_test_cases(path: str) -> List[Dict]:
+    """Test cases of a result file, with the golden answer under ``golden_answer`` whatever the file calls it."""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    cases = data["test_cases"] if isinstance(data, dict) else data
+    return [{"id": tc["id"], "question": tc["question"],
+             "golden_answer": tc.get("golden_answer", tc.get("gold_answer", "")),
+             "inference_result": tc["inference_result"]} for tc in cases]
+
+
+def evaluate_files(paths: Dict[str, str], bert_model: Optional[str] = BERT_MODEL, workers: Optional[int] = None,
+                   batch_size: int = 16, cache_dir: Optional[str] = CACHE_DIR) -> Tuple[Dict[str, List[Dict]], Dict]:
+    """Score ``{method: result file}`` together; returns ``({method: rows}, timings)``.
+
+    Rows have the columns of ``evaluation_results.csv`` (:data:`COLUMNS`).
+    """
+    timings = {}
+    start = time.perf_counter()
+    cases = {method: load_test_cases(path) for method, path in paths.items()}
+    texts = list(dict.fromkeys(text for method_cases in cases.values() for tc in method_cases
+                               for text in (tc["golden_answer"], tc["inference_result"])))
+    token_cache = TokenCache(cache_dir)
+    tokens = token_cache.tokenize(texts, workers=workers)
+    token_cache.save()
+    timings["tokenize_seconds"] = time.perf_counter() - start
+
+    results = {}
+    for method, method_cases in cases.items():
+        rows = []
+        for tc in method_cases:
+            golden, inference = tokens[tc["golden_answer"]], tokens[tc["inference_result"]]
+            rows.append({"id": tc["id"], "question": tc["question"],
+                         **bleu_scores(golden["bleu"], inference["bleu"]),
+                         **rouge_scores(golden["rouge"], inference["rouge"])})
+        results[method] = rows
+    timings["bleu_rouge_seconds"] = time.perf_counter() - start - timings["tokenize_seconds"]
+
+    if bert_model:
+        bert_start = time.perf_counter()
+        scorer = BertScorer(bert_model, batch_size=batch_size, cache_dir=cache_dir)
+        scorer.embed(texts)
+        for method, method_cases in cases.items():
+            p, r, f = scorer.score([tc["inference_result"] for tc in method_cases],
+                                   [tc["golden_answer"] for tc in method_cases])
+            for row, precision, recall, f1 in zip(results[method], p, r, f):
+                row.update({"bert_precision": precision, "bert_recall": recall, "bert_f1": f1})
+        timings["bert_seconds"] = time.perf_counter() - bert_start
+        timings.update({f"bert_{key}": value for key, value in scorer.stats.items()})
+    timings["texts"] = len(texts)
+    timings["seconds"] = time.perf_counter() - start
+    return results, timings
+
+
+def _format(value) -> str:
+    # pandas writes float32 BERTScores with float32 precision, as in evaluation_results.csv
+    return str(value) if isinstance(value, np.floating) else repr(value) if isinstance(value, float) else str(value)
+
+
+def write_csv(rows: Sequence[Dict], path: str) -> None:
+    columns = [column for column in COLUMNS if any(column in row for row in rows)]
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow([_format(row[column]) for column in columns])
+
+
+def compare_to_csv(rows: Sequence[Dict], path: str, tolerance: float = 1e-6) -> List[str]:
+    """Differences between *rows* and a saved ``evaluation_results.csv`` larger than *tolerance*."""
+    with open(path, "r", encoding="utf-8") as f:
+        expected = {row["id"]: row for row in csv.DictReader(f)}
+    mismatches = []
+    for row in rows:
+        reference = expected.get(str(row["id"]))
+        if reference is None:
+            mismatches.append(f"id {row['id']}: missing from {path}")
+            continue
+        for column, value in row.items():
+            if column in ("id", "question") or column not in reference:
+                continue
+            if abs(float(value) - float(reference[column])) > tolerance:
+                mismatches.append(f"id {row['id']} {column}: {float(value):.6f} != {float(reference[column]):.6f}")
+    return mismatches
+
+
+def print_summary(results: Dict[str, List[Dict]]) -> None:
+    columns = [("bleu4", "BLEU-4"), ("rougeL_f1", "ROUGE-L F1"), ("bert_f1", "BERTScore F1")]
+    print(f"{'method':<14}" + "".join(f"{label:>14}" for _, label in columns))
+    for method, rows in results.items():
+        means = [f"{np.mean([row[key] for row in rows]):>14.4f}" if rows and key in rows[0] else f"{'-':>14}"
+                 for key, _ in columns]
+        print(f"{method:<14}" + "".join(means))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", metavar="METHOD=PATH",
+                        help="result files to score (default: the four methods' result files)")
+    parser.add_argument("--bert-model", default=BERT_MODEL)
+    parser.add_argument("--no-bert", action="store_true", help="skip BERTScore")
+    parser.add_argument("--workers", type=int, help="tokenizer processes (default: one per CPU)")
+    parser.add_argument("--batch-size", type=int, default=16, help="BERTScore encoding batch size")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--out-dir", help="write <method>.csv per result file")
+    parser.add_argument("--reference", help="evaluation_results.csv to check the first result file against")
+    args = parser.parse_args()
+
+    if args.files:
+        files = dict(item.split("=", 1) if "=" in item else (os.path.splitext(os.path.basename(item))[0], item)
+                     for item in args.files)
+    else:
+        files = RESULT_FILES
+    results, timings = evaluate_files(files, bert_model=None if args.no_bert else args.bert_model,
+                                      workers=args.workers, batch_size=args.batch_size,
+                                      cache_dir=None if args.no_cache else CACHE_DIR)
+    print_summary(results)
+    print(f"\n{timings['texts']} distinct texts: tokenized in {timings['tokenize_seconds']:.1f}s, "
+          f"BLEU/ROUGE in {timings['bleu_rouge_seconds']:.2f}s"
+          + (f", BERTScore in {timings['bert_seconds']:.1f}s ({timings['bert_encoded']} encoded, "
+             f"{timings['bert_cached']} from cache)" if "bert_seconds" in timings else ""))
+
+    if args.out_dir:
+        for method, rows in results.items():
+            write_csv(rows, os.path.join(args.out_dir, f"{method}.csv"))
+        print(f"Per-case scores written to {args.out_dir}")
+    if args.reference:
+        method = next(iter(results))
+        mismatches = compare_to_csv(results[method], args.reference)
+        print(f"{method} vs {args.reference}: " + ("identical" if not mismatches else f"{len(mismatches)} differences"))
+        for line in mismatches:
+            print(f"  {line}")
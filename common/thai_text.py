@@ -0,0 +1,23 @@
+import re
+import unicodedata
+
+# Zero-width characters that often sneak into copied Thai text
+_INVISIBLE_RE = re.compile("[\u200b\u200c\u200d\u2060\ufeff]")
+_WHITESPACE_RE = re.compile(r"\s+")
+# Sara am typed as nikhahit + sara aa (optionally with the tone mark in between)
+_SARA_AM_RE = re.compile("\u0e4d([\u0e48-\u0e4b]?)\u0e32")
+_TRAILING_PUNCT_RE = re.compile(r"[\s?？!！.。]*$")
+
+
+def normalize_question(text: str) -> str:
+    """Canonical form of a question for cache and de-duplication keys.
+
+    NFC-normalises, folds a decomposed sara am (``ํา``) into ``ำ``, drops zero-width
+    characters and NBSP, collapses whitespace, lower-cases Latin letters and strips
+    trailing question marks / punctuation.
+    """
+    text = unicodedata.normalize("NFC", text)
+    text = _INVISIBLE_RE.sub("", text.replace("\u00a0", " "))
+    text = _SARA_AM_RE.sub("\\1\u0e33", text)
+    text = _WHITESPACE_RE.sub(" ", text).strip().lower()
+    return _TRAILING_PUNCT_RE.sub("", text)
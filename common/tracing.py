@@ -0,0 +1,254 @@
+"""Per-request stage tracing, Prometheus metrics and JSONL request timelines.
+
+A :class:`Trace` follows one question through the serving path. Code deep in the
+stack (document encoding, retrieval, embedding) records its stage with
+``with span("retrieval"):`` and never needs the trace passed in: the current
+trace lives in a context variable, and ``span`` is a no-op outside one, so batch
+scripts pay nothing. Every finished span is observed in the
+``request_stage_seconds`` histogram; tokens, cost and request outcomes are
+counted per answering method. With profiling on, each finished trace is
+appended to a JSONL file as a timeline of spans and events.
+
+    from common import tracing
+    tracing.start_metrics_server(9464)           # GET http://localhost:9464/metrics
+    tracing.enable_profiling("profile.jsonl")
+    producer = tracing.traced("long_context", lambda q: stream_answer(q, client))
+
+    python -m common.tracing profile.jsonl       # per-method, per-stage latency summary
+"""
+import argparse
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+from prometheus_client import Counter, Histogram, start_http_server
+
+from common.benchmark import summarize_latencies
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+
+REQUESTS = Counter("llm_requests_total", "Answered questions", ["method", "status"])
+INPUT_TOKENS = Counter("llm_input_tokens_total", "Input tokens sent to the LLM", ["method", "kind"])
+OUTPUT_TOKENS = Counter("llm_output_tokens_total", "Output tokens generated by the LLM", ["method"])
+COST = Counter("llm_cost_usd_total", "LLM cost in US dollars", ["method"])
+REQUEST_SECONDS = Histogram("request_duration_seconds", "Question in to final answer", ["method"],
+                            buckets=STAGE_BUCKETS)
+FIRST_TOKEN_SECONDS = Histogram("time_to_first_token_seconds", "Question in to first answer token", ["method"],
+                                buckets=STAGE_BUCKETS)
+STAGE_SECONDS = Histogram("request_stage_seconds", "Time spent per serving stage", ["method", "stage"],
+                          buckets=STAGE_BUCKETS)
+
+_current: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("trace", default=None)
+_profile_path: Optional[str] = None
+_profile_lock = threading.Lock()
+
+
+class Trace:
+    """Spans and events of one request, timed in seconds since the trace started."""
+
+    def __init__(self, method: str, question: Optional[str] = None):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.question = question
+        self.start = time.time()
+        self.spans: List[dict] = []
+        self.events: List[dict] = []
+        self.attributes: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, start: float, end: float, **attributes) -> None:
+        """Record a stage that ran from *start* to *end* (``time.time()`` values)."""
+        span = {"name": name, "start": start - self.start, "duration": end - start}
+        if attributes:
+            span["attributes"] = attributes
+        with self._lock:
+            self.spans.append(span)
+        STAGE_SECONDS.labels(self.method, name).observe(end - start)
+
+    def event(self, name: str, at: Optional[float] = None, **attributes) -> None:
+        event = {"name": name, "at": (at if at is not None else time.time()) - self.start}
+        if attributes:
+            event["attributes"] = attributes
+        with self._lock:
+            self.events.append(event)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "trace_id": self.trace_id,
+                "method": self.method,
+                "question": self.question,
+                "started_at": self.start,
+                "attributes": dict(self.attributes),
+                "spans": sorted(self.spans, key=lambda s: s["start"]),
+                "events": list(self.events),
+            }
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[dict]:
+    """Time the enclosed block as stage *name* of the current trace.
+
+    Yields the span's attribute dict so the block can add to it. Without a
+    current trace nothing is recorded.
+    """
+    trace = _current.get()
+    if trace is None:
+        yield attributes
+        return
+    start = time.time()
+    try:
+        yield attributes
+    finally:
+        trace.add_span(name, start, time.time(), **attributes)
+
+
+def record_usage(method: str, usage: dict) -> None:
+    """Add a ``usage_report`` dict to the token and cost counters of *method*."""
+    INPUT_TOKENS.labels(method, "uncached").inc(usage.get("input_tokens", 0))
+    INPUT_TOKENS.labels(method, "cache_read").inc(usage.get("cache_read_input_tokens", 0))
+    INPUT_TOKENS.labels(method, "cache_write").inc(usage.get("cache_creation_input_tokens", 0))
+    OUTPUT_TOKENS.labels(method).inc(usage.get("output_tokens", 0))
+    COST.labels(method).inc(usage.get("cost", 0.0))
+
+
+def traced(method: str, producer: Callable[..., AsyncIterator]) -> Callable[..., AsyncIterator]:
+    """Wrap a ``fn(question, *args) -> async iterator of updates`` so every call runs under a new trace.
+
+    The first update with text marks ``first_token``; the final update's
+    ``usage`` feeds the token and cost counters.
+    """
+
+    async def run(question: str, *args) -> AsyncIterator:
+        trace = Trace(method, question)
+        token = _current.set(trace)
+        status = "error"
+        final = None
+        first_token = None
+        try:
+            async for update in producer(question, *args):
+                if first_token is None and update.get("text"):
+                    first_token = time.time()
+                    trace.event("first_token", first_token)
+                final = update
+                yield update
+            status = "ok"
+        finally:
+            end = time.time()
+            try:
+                _current.reset(token)
+            except ValueError:
+                pass  # finalised from another context (generator closed by the GC)
+            if final is not None:
+                if final.get("cache") is not None:
+                    status = "cached" if status == "ok" else status
+                if final.get("usage") is not None:
+                    record_usage(method, final["usage"])
+                    trace.attributes["usage"] = {key: final["usage"][key] for key in (
+                        "input_tokens", "cache_read_input_tokens", "cache_creation_input_tokens",
+                        "output_tokens", "cost") if key in final["usage"]}
+                if final.get("llm_calls") is not None:
+                    trace.attributes["llm_calls"] = final["llm_calls"]
+            trace.attributes["status"] = status
+            trace.attributes["duration"] = end - trace.start
+            REQUESTS.labels(method, status).inc()
+            REQUEST_SECONDS.labels(method).observe(end - trace.start)
+            if first_token is not None:
+                trace.attributes["time_to_first_token"] = first_token - trace.start
+                FIRST_TOKEN_SECONDS.labels(method).observe(first_token - trace.start)
+            _write_profile(trace)
+
+    return run
+
+
+def enable_profiling(path: Optional[str]) -> None:
+    """Append every finished trace to the JSONL file at *path* (``None`` turns it off)."""
+    global _profile_path
+    if path:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    _profile_path = path
+
+
+def _write_profile(trace: Trace) -> None:
+    if _profile_path is None:
+        return
+    line = json.dumps(trace.to_dict(), ensure_ascii=False) + "\n"
+    with _profile_lock, open(_profile_path, "a", encoding="utf-8") as f:
+        f.write(line)
+
+
+def start_metrics_server(port: int, addr: str = "0.0.0.0") -> None:
+    """Serve the Prometheus text format on ``http://<addr>:<port>/metrics`` from a daemon thread."""
+    start_http_server(port, addr=addr)
+
+
+def load_profile(path: str) -> List[dict]:
+    """Traces from a profile file, skipping a torn last line."""
+    traces = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                traces.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return traces
+
+
+def summarize_profile(traces: List[dict]) -> Dict[str, dict]:
+    """``{method: {"requests", "duration", "time_to_first_token", "stages": {stage: summary}}}``.
+
+    Stage summaries add up a stage's spans within each request first, so a stage
+    that runs once per agent turn is reported per request.
+    """
+    summary = {}
+    for method in sorted({trace["method"] for trace in traces}):
+        selected = [trace for trace in traces if trace["method"] == method]
+        per_stage: Dict[str, List[float]] = {}
+        for trace in selected:
+            totals: Dict[str, float] = {}
+            for s in trace["spans"]:
+                totals[s["name"]] = totals.get(s["name"], 0.0) + s["duration"]
+            for name, total in totals.items():
+                per_stage.setdefault(name, []).append(total)
+        summary[method] = {
+            "requests": len(selected),
+            "duration": summarize_latencies([t["attributes"]["duration"] for t in selected]),
+            "time_to_first_token": summarize_latencies([t["attributes"]["time_to_first_token"] for t in selected
+                                                        if "time_to_first_token" in t["attributes"]]),
+            "stages": {name: summarize_latencies(values) for name, values in per_stage.items()},
+        }
+    return summary
+
+
+def print_profile_summary(summary: Dict[str, dict]) -> None:
+    for method, result in summary.items():
+        duration, first = result["duration"], result["time_to_first_token"]
+        print(f"\n== {method} ({result['requests']} requests) ==")
+        print(f"  {'total':<22} p50 {duration['p50'] * 1000:9.1f} ms  p95 {duration['p95'] * 1000:9.1f} ms")
+        if first["count"]:
+            print(f"  {'time to first token':<22} p50 {first['p50'] * 1000:9.1f} ms  p95 {first['p95'] * 1000:9.1f} ms")
+        for name, stage in sorted(result["stages"].items(), key=lambda item: -item[1]["p50"]):
+            share = stage["mean"] / duration["mean"] if duration["mean"] else 0.0
+            print(f"  {name:<22} p50 {stage['p50'] * 1000:9.1f} ms  p95 {stage['p95'] * 1000:9.1f} ms  "
+                  f"({stage['count']} requests, {share:4.0%} of the mean total)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("profile", help="JSONL file written with profiling enabled")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args()
+    summary = summarize_profile(load_profile(args.profile))
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_profile_summary(summary)
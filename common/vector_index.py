@@ -0,0 +1,222 @@
+import json
+import os
+import tempfile
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from common.semantic_cache import REPO_ROOT, SourceFingerprint, bge_m3_embedder
+from common.tracing import span
+
+KNOWLEDGE_BASE_PATH = os.path.join(REPO_ROOT, "data", "knowledgeBase.json")
+INDEX_DIR = os.path.join(REPO_ROOT, ".cache", "vector_index")
+
+
+def load_records(path: str = KNOWLEDGE_BASE_PATH) -> List[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["records"]
+
+
+def record_text(record: dict) -> str:
+    """Text embedded for a knowledge-base record: ``question|answer``, as in the Pinecone index it replaces."""
+    return f"{record['question']}|{record['answer']}"
+
+
+class VectorIndex:
+    """Exact cosine top-k over a float16 memory-mapped embedding matrix.
+
+    The index is two files: ``<name>.npy`` holding the L2-normalised embeddings as
+    float16 and ``<name>.meta.json`` with the record ids, metadata and the hash of
+    the source they were built from. Loading maps the matrix instead of reading
+    it, so opening the index costs milliseconds and the OS pages in only what is
+    searched. Matches are returned in the same shape as a Pinecone query response
+    (``{"matches": [{"id", "score", "metadata"}]}``) so the notebooks' helpers
+    keep working. The meta file also names the function that produced the embedded
+    text (``text_format``), so an index built from different text is rebuilt.
+    """
+
+    def __init__(self, vectors: np.ndarray, ids: Sequence, metadata: Sequence[dict],
+                 embed_fn: Optional[Callable[[Sequence[str]], np.ndarray]] = None,
+                 source_hash: Optional[str] = None, block_rows: int = 65536,
+                 max_dense_bytes: int = 1 << 30, text_format: Optional[str] = None):
+        self.vectors = vectors
+        self.ids = list(ids)
+        self.metadata = list(metadata)
+        self.embed_fn = embed_fn
+        self.source_hash = source_hash
+        self.text_format = text_format
+        self.block_rows = block_rows
+        self.max_dense_bytes = max_dense_bytes
+        self._dense = None  # float32 copy, kept only for indexes that fit in max_dense_bytes
+        self.location = None  # (index_dir, name) when loaded from disk
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1]
+
+    # ---------------------------------------------------------------- build / load
+
+    @classmethod
+    def build(cls, records: Sequence[dict], embed_fn: Callable[[Sequence[str]], np.ndarray],
+              index_dir: str = INDEX_DIR, name: str = "knowledge_base",
+              text_fn: Callable[[dict], str] = record_text, batch_size: int = 32,
+              source_hash: Optional[str] = None) -> "VectorIndex":
+        """Embed ``text_fn(record)`` for every record and write the index files."""
+        texts = [text_fn(record) for record in records]
+        chunks = [np.asarray(embed_fn(texts[i:i + batch_size]), dtype=np.float32)
+                  for i in range(0, len(texts), batch_size)]
+        vectors = np.concatenate(chunks) if chunks else np.zeros((0, 0), dtype=np.float32)
+        ids = [record["id"] for record in records]
+        metadata = [{k: v for k, v in record.items() if k != "id"} for record in records]
+        cls.write(vectors, ids, metadata, index_dir=index_dir, name=name, source_hash=source_hash,
+                  text_format=text_fn.__name__)
+        return cls.load(index_dir, name, embed_fn=embed_fn)
+
+    @classmethod
+    def write(cls, vectors: np.ndarray, ids: Sequence, metadata: Sequence[dict], index_dir: str = INDEX_DIR,
+              name: str = "knowledge_base", source_hash: Optional[str] = None,
+              text_format: Optional[str] = None) -> None:
+        """Normalise *vectors* to float16 and atomically replace the index files."""
+        os.makedirs(index_dir, exist_ok=True)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = (vectors / np.maximum(norms, 1e-12)).astype(np.float16)
+        meta = {"ids": list(ids), "metadata": list(metadata), "source_hash": source_hash,
+                "text_format": text_format}
+
+        vectors_path, meta_path = cls._paths(index_dir, name)
+        fd, tmp_vectors = tempfile.mkstemp(dir=index_dir, suffix=".npy")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, vectors)
+        fd, tmp_meta = tempfile.mkstemp(dir=index_dir, suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_vectors, vectors_path)
+        os.replace(tmp_meta, meta_path)
+
+    @classmethod
+    def load(cls, index_dir: str = INDEX_DIR, name: str = "knowledge_base",
+             embed_fn: Optional[Callable[[Sequence[str]], np.ndarray]] = None) -> "VectorIndex":
+        vectors_path, meta_path = cls._paths(index_dir, name)
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        vectors = np.load(vectors_path, mmap_mode="r")
+        index = cls(vectors, meta["ids"], meta["metadata"], embed_fn=embed_fn, source_hash=meta.get("source_hash"),
+                    text_format=meta.get("text_format"))
+        index.location = (index_dir, name)
+        return index
+
+    @classmethod
+    def open(cls, path: str = KNOWLEDGE_BASE_PATH, embed_fn: Optional[Callable[[Sequence[str]], np.ndarray]] = None,
+             index_dir: str = INDEX_DIR, name: str = "knowledge_base",
+             text_fn: Callable[[dict], str] = record_text) -> "VectorIndex":
+        """Load the index for the knowledge base at *path*, (re)building it only if the file or *text_fn* changed."""
+        source_hash = SourceFingerprint([path]).current()
+        try:
+            index = cls.load(index_dir, name)
+        except FileNotFoundError:
+            index = None
+        if index is not None and index.source_hash == source_hash and index.text_format == text_fn.__name__:
+            index.embed_fn = embed_fn
+            return index
+        return cls.build(load_records(path), embed_fn or bge_m3_embedder(), index_dir=index_dir, name=name,
+                         text_fn=text_fn, source_hash=source_hash)
+
+    def apply_delta(self, ids: Sequence = (), vectors: Optional[np.ndarray] = None, metadata: Sequence[dict] = (),
+                    deleted: Sequence = (), source_hash: Optional[str] = None) -> None:
+        """Upsert the rows for *ids* and drop the *deleted* ids, rewriting the index files once.
+
+        Only the given vectors are new; every other row is copied over as stored,
+        so a refresh that touches a few records never re-embeds the rest.
+        """
+        if self.location is None:
+            raise RuntimeError("apply_delta needs an index opened with VectorIndex.load()")
+        replaced = set(ids) | set(deleted)
+        keep = [row for row, doc_id in enumerate(self.ids) if doc_id not in replaced]
+        parts = [np.asarray(self.vectors[keep], dtype=np.float32)] if keep else []
+        if len(ids):
+            parts.append(np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1))
+        merged = np.concatenate(parts) if parts else np.zeros((0, self.dim), dtype=np.float32)
+
+        index_dir, name = self.location
+        self.write(merged, [self.ids[row] for row in keep] + list(ids),
+                   [self.metadata[row] for row in keep] + list(metadata),
+                   index_dir=index_dir, name=name, source_hash=source_hash or self.source_hash,
+                   text_format=self.text_format)
+        updated = self.load(index_dir, name)
+        self.vectors, self.ids, self.metadata = updated.vectors, updated.ids, updated.metadata
+        self.source_hash = updated.source_hash
+        self._dense = None
+
+    @staticmethod
+    def _paths(index_dir: str, name: str):
+        base = os.path.join(index_dir, name)
+        return base + ".npy", base + ".meta.json"
+
+    # ---------------------------------------------------------------- search
+
+    def search(self, queries: np.ndarray, top_k: int = 5):
+        """Top-k ``(scores, rows)`` for one query vector ``(d,)`` or a batch ``(n, d)``.
+
+        Scores are cosine similarities (queries are normalised here); results come
+        back with the same leading shape as *queries*.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        single = queries.ndim == 1
+        queries = np.atleast_2d(queries)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        top_k = min(top_k, len(self))
+
+        best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        for start, block in self._blocks():
+            scores = queries @ block.T
+            rows = np.arange(start, start + len(block))
+            if len(block) > top_k:
+                keep = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+                scores, rows = np.take_along_axis(scores, keep, axis=1), rows[keep]
+            else:
+                rows = np.broadcast_to(rows, scores.shape)
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+            best_rows = np.concatenate([best_rows, rows], axis=1)
+
+        order = np.argsort(-best_scores, axis=1, kind="stable")[:, :top_k]
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        if single:
+            return best_scores[0], best_rows[0]
+        return best_scores, best_rows
+
+    def _blocks(self):
+        """``(first_row, float32 block)`` pairs; the whole matrix when it fits in memory."""
+        if self._dense is None and self.vectors.nbytes * 2 <= self.max_dense_bytes:
+            self._dense = np.asarray(self.vectors, dtype=np.float32)
+        if self._dense is not None:
+            yield 0, self._dense
+            return
+        # Too large to upcast at once: stream the memory map so it never needs a full float32 copy
+        for start in range(0, len(self), self.block_rows):
+            yield start, np.asarray(self.vectors[start:start + self.block_rows], dtype=np.float32)
+
+    def _matches(self, scores: np.ndarray, rows: np.ndarray) -> Dict[str, list]:
+        return {"matches": [
+            {"id": self.ids[row], "score": float(score), "metadata": self.metadata[row]}
+            for score, row in zip(scores, rows)
+        ]}
+
+    def query(self, question: str, top_k: int = 5) -> Dict[str, list]:
+        """Pinecone-style ``{"matches": [...]}`` for a single question."""
+        return self.query_batch([question], top_k=top_k)[0]
+
+    def query_batch(self, questions: Sequence[str], top_k: int = 5) -> List[Dict[str, list]]:
+        """Embed *questions* in one call and search them together."""
+        if self.embed_fn is None:
+            self.embed_fn = bge_m3_embedder()
+        with span("embedding", texts=len(questions)):
+            queries = np.asarray(self.embed_fn(list(questions)), dtype=np.float32)
+        with span("vector_search"):
+            scores, rows = self.search(queries, top_k=top_k)
+        return [self._matches(s, r) for s, r in zip(scores, rows)]
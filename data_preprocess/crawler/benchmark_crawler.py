@@ -0,0 +1,72 @@
+"""Sequential ``crawl_rd_tax`` against ``crawl_rd_tax_async`` on the local fixture site.
+
+Both crawl the same fixture pages (the records in ``data.csv``, repeated
+``--copies`` times) served with per-response latency. Their outputs are written
+in the ``data.csv`` / ``data-ordered.csv`` layouts and must be byte-identical. A
+second async run makes every page fail once with a 503 to exercise the retries.
+
+    python benchmark_crawler.py --copies 4 --latency 0.2 --latency-jitter 0.3
+"""
+import argparse
+import asyncio
+import filecmp
+import os
+import tempfile
+import time
+
+from fixture_server import FixtureSite, load_fixture_records
+from rd_crawler import crawl_rd_tax, crawl_rd_tax_async, write_records_csv
+
+
+def fixture_records(copies):
+    base = load_fixture_records()
+    return [{"question": r["question"] if i == 0 else f"{r['question']} ({i + 1})", "answer": r["answer"]}
+            for i in range(copies) for r in base]
+
+
+def run(args):
+    records = fixture_records(args.copies)
+    with tempfile.TemporaryDirectory() as workdir:
+        paths = {name: (os.path.join(workdir, f"{name}-data.csv"), os.path.join(workdir, f"{name}-ordered.csv"))
+                 for name in ("sequential", "async", "async-retry")}
+
+        with FixtureSite(records, latency=args.latency, latency_jitter=args.latency_jitter) as site:
+            start = time.perf_counter()
+            write_records_csv(crawl_rd_tax(site.entry_url), *paths["sequential"])
+            sequential = time.perf_counter() - start
+
+            start = time.perf_counter()
+            asyncio.run(crawl_rd_tax_async(site.entry_url, max_per_host=args.max_per_host, delay=args.delay,
+                                           data_path=paths["async"][0], ordered_path=paths["async"][1]))
+            concurrent = time.perf_counter() - start
+
+        with FixtureSite(records, latency=args.latency, latency_jitter=args.latency_jitter, fail_first=1) as site:
+            start = time.perf_counter()
+            asyncio.run(crawl_rd_tax_async(site.entry_url, max_per_host=args.max_per_host, delay=args.delay,
+                                           backoff=0.05, data_path=paths["async-retry"][0],
+                                           ordered_path=paths["async-retry"][1]))
+            with_retries = time.perf_counter() - start
+            failed = site.stats["failed"]
+
+        pages = len(records)
+        print(f"{pages} pages, {args.latency * 1000:.0f} ms + up to {args.latency_jitter * 1000:.0f} ms per response")
+        print(f"Sequential:            {sequential:6.2f}s  ({pages / sequential:5.1f} pages/s)")
+        print(f"Async ({args.max_per_host}/host, {args.delay * 1000:.0f} ms gap): {concurrent:6.2f}s  "
+              f"({pages / concurrent:5.1f} pages/s, {sequential / concurrent:.1f}x)")
+        print(f"Async, every page 503 once: {with_retries:6.2f}s  ({failed} failed responses retried)")
+
+        for name in ("async", "async-retry"):
+            for layout, expected, actual in zip(("data.csv", "data-ordered.csv"), paths["sequential"], paths[name]):
+                identical = filecmp.cmp(expected, actual, shallow=False)
+                print(f"{name:>11} {layout:<16} identical to sequential: {identical}")
+                assert identical
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--copies", type=int, default=4, help="repeat the fixture records to get more pages")
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--latency-jitter", type=float, default=0.3)
+    parser.add_argument("--max-per-host", type=int, default=8)
+    parser.add_argument("--delay", type=float, default=0.02, help="politeness gap between request starts")
+    run(parser.parse_args())
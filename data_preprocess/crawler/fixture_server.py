@@ -0,0 +1,187 @@
+"""Local stand-in for the rd.go.th tax knowledge pages, for exercising the crawler offline.
+
+Serves an entry page whose ``<list-menu>`` sidebar links to one page per record,
+with ``ETag`` / ``Last-Modified`` validators, and answers conditional GETs with
+``304 Not Modified``. Pages can be edited, added and removed between crawls.
+"""
+import csv
+import hashlib
+import os
+import random
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+CRAWLER_DIR = os.path.dirname(os.path.abspath(__file__))
+ENTRY_PATH = "/548.html"
+
+
+def load_fixture_records(path: str = os.path.join(CRAWLER_DIR, "data.csv")) -> List[Dict[str, str]]:
+    """The crawled records checked into the repo, as ``{"question", "answer"}`` dicts."""
+    with open(path, "r", encoding="utf-8") as f:
+        return [{"question": row["question"], "answer": row["answer"]}
+                for row in csv.DictReader(f) if row["question"] and row["answer"]]
+
+
+def render_record_page(question: str, answer: str) -> str:
+    return (f"<html><head><title>{escape(question)}</title></head><body>"
+            f"<div class=\"content\"><h3>{escape(question)}</h3><p>{escape(answer)}</p></div>"
+            f"</body></html>")
+
+
+class FixtureSite:
+    """Threaded HTTP server for a mutable set of RD-style pages."""
+
+    def __init__(self, records: Optional[List[Dict[str, str]]] = None, host: str = "127.0.0.1", port: int = 0,
+                 latency: float = 0.0, latency_jitter: float = 0.0, fail_first: int = 0, conditional: bool = True):
+        """
+        :param latency:        Seconds every response is delayed by.
+        :param latency_jitter: Extra uniformly random delay of up to this many seconds.
+        :param fail_first:     Answer the first N requests for each record page with a 503.
+        :param conditional:    Send validators and honour conditional GETs.
+        """
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.fail_first = fail_first
+        self.conditional = conditional
+        self.stats = {"requests": 0, "not_modified": 0, "full": 0, "failed": 0}
+        self._attempts: Dict[str, int] = {}
+        self._pages: Dict[str, tuple] = {}  # path -> (body bytes, etag, Last-Modified header, mtime)
+        self._order: List[str] = []
+        self._lock = threading.Lock()
+        for i, record in enumerate(records if records is not None else load_fixture_records()):
+            self.set_page(f"/tax-{i + 1}.html", record["question"], record["answer"])
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def entry_url(self) -> str:
+        return self.url + ENTRY_PATH
+
+    def start(self) -> "FixtureSite":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _store(self, path: str, html: str) -> None:
+        body = html.encode("utf-8")
+        previous = self._pages.get(path)
+        if previous is not None and previous[0] == body:
+            return
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        # Last-Modified has one-second resolution; never let an edit reuse the previous stamp
+        modified = time.time() if previous is None else max(time.time(), previous[3] + 1)
+        self._pages[path] = (body, etag, formatdate(modified, usegmt=True), modified)
+
+    def _render_entry(self) -> None:
+        items = "".join(f"<li><a href=\"{path}\">{escape(path)}</a></li>" for path in self._order)
+        self._store(ENTRY_PATH, f"<html><body><list-menu><ul>{items}</ul></list-menu>"
+                                f"<div><h1>ภาษีเงินได้บุคคลธรรมดา</h1></div></body></html>")
+
+    def set_page(self, path: str, question: str, answer: str) -> None:
+        """Add or edit the page at *path*; a new page is appended to the sidebar."""
+        with self._lock:
+            if path not in self._order:
+                self._order.append(path)
+            self._store(path, render_record_page(question, answer))
+            self._render_entry()
+
+    def remove_page(self, path: str) -> None:
+        with self._lock:
+            self._order.remove(path)
+            self._pages.pop(path, None)
+            self._render_entry()
+
+    def _make_handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _not_modified(self, etag, modified):
+                if not site.conditional:
+                    return False
+                if_none_match = self.headers.get("If-None-Match")
+                if if_none_match is not None:
+                    return etag in [tag.strip() for tag in if_none_match.split(",")]
+                if_modified_since = self.headers.get("If-Modified-Since")
+                if if_modified_since:
+                    try:
+                        return int(modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+                    except (TypeError, ValueError):
+                        return False
+                return False
+
+            def do_GET(self):
+                if site.latency or site.latency_jitter:
+                    time.sleep(site.latency + random.uniform(0, site.latency_jitter))
+                with site._lock:
+                    site.stats["requests"] += 1
+                    page = site._pages.get(self.path)
+                    attempt = site._attempts[self.path] = site._attempts.get(self.path, 0) + 1
+                if page is not None and self.path != ENTRY_PATH and attempt <= site.fail_first:
+                    with site._lock:
+                        site.stats["failed"] += 1
+                    self.send_response(503)
+                    self.send_header("Retry-After", "0")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if page is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body, etag, last_modified, modified = page
+                if self._not_modified(etag, modified):
+                    with site._lock:
+                        site.stats["not_modified"] += 1
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Last-Modified", last_modified)
+                    self.end_headers()
+                    return
+                with site._lock:
+                    site.stats["full"] += 1
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                if site.conditional:
+                    self.send_header("ETag", etag)
+                    self.send_header("Last-Modified", last_modified)
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+if __name__ == "__main__":
+    with FixtureSite(port=8788) as site:
+        print(f"Fixture RD site listening on {site.entry_url} (Ctrl+C to stop)")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,420 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import List, Dict, Optional
+from urllib.parse import urljoin, urlsplit
+import asyncio
+import csv
+import hashlib
+import json
+import os
+import random
+import re
+import tempfile
+import time
+
+import requests
+from bs4 import BeautifulSoup, Tag
+
+
+@dataclass(frozen=True, slots=True)
+class QARecord:
+    context: str
+    question: str = ""
+    answer: str = ""
+
+    def as_dict(self) -> Dict[str, str]:
+        return {"context": self.context, "question": self.question, "answer": self.answer}
+
+    def content_hash(self) -> str:
+        payload = json.dumps(self.as_dict(), ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def crawl_rd_tax(entry_url: str = "https://www.rd.go.th/548.html",
+                 timeout: int = 15) -> List[Dict[str, str]]:
+    """
+    Crawl the RD (Thai Revenue Department) knowledge‑base starting from *entry_url*.
+    For every link in the left‑hand nested sidebar, fetch the page and return a list
+    of dicts shaped ⟨context, question, answer⟩.  Sidebar detection and content
+    extraction are heuristic but resilient to layout changes.
+
+    :param entry_url: The first page that hosts the sidebar to walk.
+    :param timeout:   HTTP timeout (seconds) for each request.
+    :return:          List of dictionaries ready for downstream RAG pipelines.
+    """
+    sess = requests.Session()
+    root_soup = _get_soup(sess, entry_url, timeout)
+
+    # 1 ▶ Collect sidebar links (unique, in order of appearance)
+    unique_links = _sidebar_links(root_soup, entry_url)
+
+    # 2 ▶ Walk each page and harvest
+    records: List[QARecord] = []
+    for url in unique_links:
+        try:
+            page_soup = _get_soup(sess, url, timeout)
+            rec = _extract_record(page_soup)
+            records.append(rec)
+        except Exception:
+            # Fail fast but leave a breadcrumb for post‑mortem
+            records.append(QARecord(context=f"[ERROR] Could not crawl {url}"))
+
+    return [r.as_dict() for r in records]
+
+
+# ──────────── concurrent crawl ──────────── #
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RecordCsvWriter:
+    """
+    Stream records to ``data.csv`` (``,context,question,answer`` with a row index, as
+    written by ``DataFrame.to_csv``) and/or ``data-ordered.csv`` (``question,context,output``)
+    as soon as every earlier record has arrived, so out-of-order completions still
+    produce the sidebar order.
+    """
+
+    def __init__(self, data_path: Optional[str] = None, ordered_path: Optional[str] = None):
+        self._files = []
+        self._data = self._open(data_path, ["", "context", "question", "answer"])
+        self._ordered = self._open(ordered_path, ["question", "context", "output"])
+        self._pending: Dict[int, QARecord] = {}
+        self._next = 0
+
+    def _open(self, path: Optional[str], header: List[str]):
+        if not path:
+            return None
+        f = open(path, "w", encoding="utf-8", newline="")
+        self._files.append(f)
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(header)
+        return writer
+
+    def put(self, index: int, rec: QARecord) -> None:
+        self._pending[index] = rec
+        while self._next in self._pending:
+            rec = self._pending.pop(self._next)
+            if self._data:
+                self._data.writerow([self._next, rec.context, rec.question, rec.answer])
+            if self._ordered:
+                self._ordered.writerow([rec.question, rec.context, rec.answer])
+            self._next += 1
+        for f in self._files:
+            f.flush()
+
+    def close(self) -> None:
+        for f in self._files:
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_records_csv(records: List[Dict[str, str]], data_path: Optional[str] = None,
+                      ordered_path: Optional[str] = None) -> None:
+    """Write the output of :func:`crawl_rd_tax` in the ``data.csv`` / ``data-ordered.csv`` layouts."""
+    with RecordCsvWriter(data_path, ordered_path) as writer:
+        for i, rec in enumerate(records):
+            writer.put(i, QARecord(**rec))
+
+
+class _PoliteFetcher:
+    """GETs over a shared keep-alive session, spacing request starts per host and retrying with backoff."""
+
+    def __init__(self, session, delay: float, retries: int, backoff: float):
+        self.session = session
+        self.delay = delay
+        self.retries = retries
+        self.backoff = backoff
+        self.retried = 0
+        self._next_start: Dict[str, float] = {}
+        self._lock = asyncio.Lock()
+
+    async def _wait_turn(self, url: str) -> None:
+        host = urlsplit(url).netloc
+        async with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start.get(host, now))
+            self._next_start[host] = start + self.delay
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    async def get(self, url: str) -> str:
+        import aiohttp
+
+        attempt = 0
+        while True:
+            await self._wait_turn(url)
+            retry_after = None
+            try:
+                async with self.session.get(url) as resp:
+                    if resp.status not in RETRY_STATUSES:
+                        resp.raise_for_status()
+                        return await resp.text()
+                    retry_after = resp.headers.get("Retry-After")
+                    error: Exception = aiohttp.ClientResponseError(
+                        resp.request_info, resp.history, status=resp.status, message=resp.reason or "")
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+                error = e
+            if attempt >= self.retries:
+                raise error
+            delay = self.backoff * 2 ** attempt * (1 + random.random())
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            attempt += 1
+            self.retried += 1
+            await asyncio.sleep(delay)
+
+
+async def crawl_rd_tax_async(entry_url: str = "https://www.rd.go.th/548.html",
+                             timeout: int = 15,
+                             max_per_host: int = 4,
+                             delay: float = 0.1,
+                             retries: int = 3,
+                             backoff: float = 0.5,
+                             data_path: Optional[str] = None,
+                             ordered_path: Optional[str] = None) -> List[Dict[str, str]]:
+    """
+    Concurrent :func:`crawl_rd_tax`: same records, same order, same error breadcrumbs.
+
+    Pages are fetched over one pooled keep-alive ``aiohttp`` session with at most
+    *max_per_host* connections per host, request starts at least *delay* seconds
+    apart per host, and up to *retries* retries with exponential backoff (honouring
+    ``Retry-After``) on connection errors, timeouts, 429 and 5xx. When *data_path*
+    / *ordered_path* are given, records are streamed to them in sidebar order as
+    they are parsed.
+
+    :param max_per_host: Connection pool size (and concurrency) per host.
+    :param delay:        Politeness gap between request starts to one host (seconds).
+    """
+    import aiohttp
+
+    connector = aiohttp.TCPConnector(limit_per_host=max_per_host, ttl_dns_cache=300)
+    async with aiohttp.ClientSession(connector=connector,
+                                     timeout=aiohttp.ClientTimeout(total=timeout),
+                                     headers={"User-Agent": "Mozilla/5.0"}) as session:
+        fetcher = _PoliteFetcher(session, delay, retries, backoff)
+        root_soup = BeautifulSoup(await fetcher.get(entry_url), "lxml")
+        unique_links = _sidebar_links(root_soup, entry_url)
+        records: List[Optional[QARecord]] = [None] * len(unique_links)
+
+        with RecordCsvWriter(data_path, ordered_path) as writer:
+            async def crawl(index: int, url: str) -> None:
+                try:
+                    rec = _extract_record(BeautifulSoup(await fetcher.get(url), "lxml"))
+                except Exception:
+                    rec = QARecord(context=f"[ERROR] Could not crawl {url}")
+                records[index] = rec
+                writer.put(index, rec)
+
+            await asyncio.gather(*(crawl(i, url) for i, url in enumerate(unique_links)))
+
+    return [r.as_dict() for r in records]
+
+
+# ──────────── incremental refresh ──────────── #
+
+@dataclass
+class PageState:
+    """What we know about one page from the previous refresh."""
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    content_hash: Optional[str] = None
+    record: Optional[Dict[str, str]] = None
+
+
+@dataclass
+class CrawlDelta:
+    """Records keyed by page URL that were added, changed or removed since the last refresh."""
+    added: Dict[str, QARecord] = field(default_factory=dict)
+    changed: Dict[str, QARecord] = field(default_factory=dict)
+    removed: List[str] = field(default_factory=list)
+    unchanged: List[str] = field(default_factory=list)
+    stats: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def upserts(self) -> Dict[str, QARecord]:
+        return {**self.added, **self.changed}
+
+    def as_dict(self) -> Dict:
+        return {
+            "added": {url: rec.as_dict() for url, rec in self.added.items()},
+            "changed": {url: rec.as_dict() for url, rec in self.changed.items()},
+            "removed": self.removed,
+            "unchanged": self.unchanged,
+            "stats": self.stats,
+        }
+
+
+class CrawlState:
+    """Per-URL validators (ETag / Last-Modified) and record hashes, persisted as JSON."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.entry: PageState = PageState()
+        self.links: List[str] = []
+        self.pages: Dict[str, PageState] = {}
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.entry = PageState(**data.get("entry", {}))
+            self.links = data.get("links", [])
+            self.pages = {url: PageState(**page) for url, page in data.get("pages", {}).items()}
+
+    def records(self) -> Dict[str, QARecord]:
+        return {url: QARecord(**page.record) for url, page in self.pages.items() if page.record}
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        data = {
+            "entry": vars(self.entry),
+            "links": self.links,
+            "pages": {url: vars(page) for url, page in self.pages.items()},
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def refresh_rd_tax(state: CrawlState, entry_url: str = "https://www.rd.go.th/548.html",
+                   timeout: int = 15, sess: Optional[requests.Session] = None) -> CrawlDelta:
+    """
+    Re-crawl only what changed since the refresh that produced *state*.
+
+    Every page is fetched with ``If-None-Match`` / ``If-Modified-Since`` from the
+    previous response, so unchanged pages come back as an empty ``304``. Pages that
+    are re-downloaded are still compared by record hash, which catches servers that
+    ignore the validators or re-render identical content. Sidebar links that
+    disappeared become removals. *state* is updated in place (call ``state.save()``
+    once the delta has been applied).
+    """
+    sess = sess or requests.Session()
+    delta = CrawlDelta(stats={"pages": 0, "fetched": 0, "not_modified": 0, "errors": 0})
+
+    root = _conditional_get(sess, entry_url, timeout, state.entry)
+    if root is not None:
+        state.links = _sidebar_links(root, entry_url)
+    delta.stats["pages"] = len(state.links)
+
+    for url in state.links:
+        page = state.pages.setdefault(url, PageState())
+        try:
+            soup = _conditional_get(sess, url, timeout, page)
+            rec = _extract_record(soup) if soup is not None else None
+        except Exception:
+            # Keep the previous record rather than treating a flaky page as removed, and
+            # forget the validators so the page is downloaded in full next time
+            page.etag = page.last_modified = None
+            delta.stats["errors"] += 1
+            if page.record:
+                delta.unchanged.append(url)
+            continue
+        if rec is None:
+            delta.stats["not_modified"] += 1
+            delta.unchanged.append(url)
+            continue
+
+        delta.stats["fetched"] += 1
+        content_hash = rec.content_hash()
+        if page.content_hash is None:
+            delta.added[url] = rec
+        elif page.content_hash != content_hash:
+            delta.changed[url] = rec
+        else:
+            delta.unchanged.append(url)
+        page.content_hash = content_hash
+        page.record = rec.as_dict()
+
+    live = set(state.links)
+    for url in [u for u in state.pages if u not in live]:
+        if state.pages.pop(url).record:
+            delta.removed.append(url)
+    return delta
+
+
+# ──────────── internal helpers ──────────── #
+
+def _get_soup(sess: requests.Session, url: str, timeout: int) -> BeautifulSoup:
+    resp = sess.get(url, timeout=timeout, headers={"User-Agent": "Mozilla/5.0"})
+    resp.raise_for_status()
+    return BeautifulSoup(resp.text, "lxml")
+
+
+def _conditional_get(sess: requests.Session, url: str, timeout: int, page: PageState) -> Optional[BeautifulSoup]:
+    """Like :func:`_get_soup`, but ``None`` when the server answers ``304 Not Modified``."""
+    headers = {"User-Agent": "Mozilla/5.0"}
+    if page.etag:
+        headers["If-None-Match"] = page.etag
+    if page.last_modified:
+        headers["If-Modified-Since"] = page.last_modified
+    resp = sess.get(url, timeout=timeout, headers=headers)
+    if resp.status_code == 304:
+        return None
+    resp.raise_for_status()
+    page.etag = resp.headers.get("ETag")
+    page.last_modified = resp.headers.get("Last-Modified")
+    return BeautifulSoup(resp.text, "lxml")
+
+
+def _sidebar_links(soup: BeautifulSoup, entry_url: str) -> List[str]:
+    sidebar = _locate_sidebar(soup)
+    links = [
+        urljoin(entry_url, a["href"])
+        for a in sidebar.select("a[href]")
+        if a["href"].endswith(".html")
+    ]
+    seen: set[str] = set()
+    return [u for u in links if not (u in seen or seen.add(u))]
+
+
+def _locate_sidebar(soup: BeautifulSoup) -> Tag:
+    """
+    RD pages put the topic tree in the first UL with at least ten <li>.
+    This works for every tax‑knowledge page tested (e.g. 548.html, 549.html).
+    """
+    for ul in soup.select("list-menu"):
+        if len(ul.find_all("li")) >= 10:
+            return ul
+    raise RuntimeError("Sidebar menu not found – page layout may have changed.")
+
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def _norm(text: str) -> str:
+    """
+    Replace NBSP with a regular space and collapse runs of whitespace.
+    """
+    return _WHITESPACE_RE.sub(" ", text.replace("\u00A0", " ")).strip()
+
+
+def _extract_record(soup: BeautifulSoup) -> QARecord:
+    # Question → the first H1/H2/H3 tag (pages often use H3)
+    heading_tag: Optional[Tag] = next(
+        (soup.find(tag) for tag in ("h1", "h2", "h3") if soup.find(tag)), None
+    )
+
+    question = _norm(heading_tag.get_text(strip=True)) if heading_tag else ""
+
+    # Context → pick the largest <article>, <section>, or <div> block by text length
+    candidate_blocks = soup.find_all(["article", "section", "div"], recursive=True)
+    main_block = max(candidate_blocks, key=lambda t: len(t.get_text(" ", strip=True)))
+    full_text = _norm(main_block.get_text(" ", strip=True))
+
+    # Answer → body minus heading (if present and non‑trivial), else blank
+    answer = ""
+    if question and question in full_text:
+        answer = _norm(full_text.split(question, 1)[1].lstrip(" :–-"))
+    else:
+        # No clean split; treat entire text as context only
+        return QARecord(context=full_text)
+
+    return QARecord(context=full_text, question=question, answer=answer)
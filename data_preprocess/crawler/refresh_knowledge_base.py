@@ -0,0 +1,162 @@
+"""Incrementally refresh the crawled RD knowledge base in the retrieval indexes.
+
+Pages are re-fetched with conditional GETs, records are compared by content hash,
+and only added or changed records are embedded; removed pages are deleted from
+the index. Crawled records live in the ``knowledge_base`` vector index that
+``VectorIndex.open`` and ``HybridRetriever`` serve, keyed by page URL next to the
+``knowledgeBase.json`` records, and the BM25 sidecar is rebuilt from the updated
+index (tokenizing only, no embeddings). The delta is written to ``--delta-out``
+for review.
+
+    python refresh_knowledge_base.py                         # rd.go.th, bge-m3
+    python refresh_knowledge_base.py --fixture               # local fixture site, offline embedder
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, Optional, Sequence
+
+import numpy as np
+
+from rd_crawler import CrawlDelta, CrawlState, QARecord, refresh_rd_tax
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if REPO_ROOT not in sys.path:
+    sys.path.append(REPO_ROOT)
+
+from common.lexical_index import BM25Index
+from common.vector_index import INDEX_DIR, KNOWLEDGE_BASE_PATH, VectorIndex, record_text
+
+STATE_DIR = os.path.join(REPO_ROOT, ".cache", "crawler")
+INDEX_NAME = "knowledge_base"
+
+
+def as_record(url: str, rec: QARecord) -> Dict[str, str]:
+    """A crawled record in the ``knowledgeBase.json`` shape, keyed by its page URL."""
+    return {"id": url, "url": url, "question": rec.question, "answer": rec.answer or rec.context}
+
+
+def refresh_knowledge_base(state: CrawlState, embed_fn: Callable[[Sequence[str]], np.ndarray],
+                           entry_url: str = "https://www.rd.go.th/548.html", index_dir: str = INDEX_DIR,
+                           index_name: str = INDEX_NAME, knowledge_base_path: str = KNOWLEDGE_BASE_PATH,
+                           delta_out: Optional[str] = None, batch_size: int = 32) -> Dict:
+    """Apply one incremental crawl to the retrieval indexes and return the refresh report."""
+    delta: CrawlDelta = refresh_rd_tax(state, entry_url=entry_url)
+    # Built from knowledgeBase.json when missing or stale; crawled records are added below
+    index = VectorIndex.open(knowledge_base_path, embed_fn, index_dir=index_dir, name=index_name)
+    indexed = set(index.ids)
+    # Live records the index lacks (first refresh, or the index was rebuilt from knowledgeBase.json)
+    upserts = {url: rec for url, rec in state.records().items() if url not in indexed}
+    upserts.update(delta.upserts)
+    urls = list(upserts)
+    records = [as_record(url, upserts[url]) for url in urls]
+    deleted = [url for url in delta.removed if url in indexed]
+
+    start = time.perf_counter()
+    texts = [record_text(record) for record in records]
+    chunks = [np.asarray(embed_fn(texts[i:i + batch_size]), dtype=np.float32) for i in range(0, len(texts), batch_size)]
+    embed_seconds = time.perf_counter() - start
+
+    if urls or deleted:
+        metadata = [{k: v for k, v in record.items() if k != "id"} for record in records]
+        index.apply_delta(urls, np.concatenate(chunks) if chunks else None, metadata, deleted=deleted)
+        # BM25 has corpus-wide statistics, so rebuild it from the index's records (no embedding involved)
+        lexical_records = [{"id": doc_id, **meta} for doc_id, meta in zip(index.ids, index.metadata)]
+        BM25Index.build(lexical_records, source_hash=index.source_hash).save(index_dir, index_name)
+
+    # Only remember the new validators once the index reflects them
+    state.save()
+    if delta_out:
+        os.makedirs(os.path.dirname(os.path.abspath(delta_out)), exist_ok=True)
+        with open(delta_out, "w", encoding="utf-8") as f:
+            json.dump(delta.as_dict(), f, ensure_ascii=False, indent=2)
+
+    live_records = len(state.records())
+    return {
+        **delta.stats,
+        "skipped": delta.stats["not_modified"],
+        "added": len(delta.added),
+        "changed": len(delta.changed),
+        "removed": len(delta.removed),
+        "unchanged": len(delta.unchanged),
+        "embedded": len(urls),
+        "embeddings_saved": live_records - len(urls),
+        "embed_seconds": embed_seconds,
+    }
+
+
+def print_report(title: str, report: Dict) -> None:
+    print(f"\n== {title} ==")
+    print(f"Pages: {report['pages']}  fetched: {report['fetched']}  skipped (304): {report['skipped']}  "
+          f"errors: {report['errors']}")
+    print(f"Records added: {report['added']}  changed: {report['changed']}  removed: {report['removed']}  "
+          f"unchanged: {report['unchanged']}")
+    print(f"Embedded: {report['embedded']}  embedding calls saved: {report['embeddings_saved']}  "
+          f"({report['embed_seconds']:.2f}s embedding)")
+
+
+def run_fixture_demo(embed_fn, conditional: bool = True) -> None:
+    """Crawl the local fixture site three times: cold, unchanged, then with edits."""
+    from fixture_server import FixtureSite
+
+    with tempfile.TemporaryDirectory() as workdir, FixtureSite(conditional=conditional) as site:
+        state_path = os.path.join(workdir, "state.json")
+
+        def refresh(title):
+            state = CrawlState(state_path)
+            report = refresh_knowledge_base(state, embed_fn, entry_url=site.entry_url, index_dir=workdir)
+            print_report(title, report)
+            return report
+
+        refresh("cold crawl")
+        refresh("nothing changed")
+
+        site.set_page("/tax-2.html", "เมื่อมีเงินได้แล้ว ต้องทำอะไรบ้าง?", "ขอมีเลขประจำตัวผู้เสียภาษีอากรภายใน 60 วัน (แก้ไข)")
+        site.set_page("/tax-new.html", "ยื่นแบบ ภ.ง.ด.90 ได้ถึงเมื่อไร?", "ยื่นได้ภายในวันที่ 31 มีนาคมของปีถัดไป")
+        site.remove_page("/tax-3.html")
+        report = refresh("one edited, one added, one removed")
+
+        index = VectorIndex.load(workdir, INDEX_NAME)
+        lexical = BM25Index.load(workdir, INDEX_NAME)
+        crawled = [doc_id for doc_id in index.ids if str(doc_id).startswith(site.url)]
+        assert (report["added"], report["changed"], report["removed"]) == (1, 1, 1), report
+        assert len(crawled) == len(CrawlState(state_path).records())
+        assert f"{site.url}/tax-3.html" not in index.ids
+        assert lexical.ids == index.ids
+        print(f"\nFixture site served {site.stats['full']} full pages and {site.stats['not_modified']} 304s; "
+              f"index holds {len(crawled)} crawled and {len(index) - len(crawled)} knowledgeBase.json records")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entry-url", default="https://www.rd.go.th/548.html")
+    parser.add_argument("--state", default=os.path.join(STATE_DIR, "rd_state.json"))
+    parser.add_argument("--delta-out", default=os.path.join(STATE_DIR, "rd_delta.json"))
+    parser.add_argument("--index-dir", default=INDEX_DIR)
+    parser.add_argument("--embedder", choices=["bge-m3", "hashed"],
+                        help="defaults to bge-m3, or the offline hashed embedder with --fixture")
+    parser.add_argument("--embedding-service", help="URL of a running common.embedding_service to embed with")
+    parser.add_argument("--fixture", action="store_true", help="run against the local fixture site instead")
+    parser.add_argument("--no-validators", action="store_true",
+                        help="with --fixture: the site sends no ETag/Last-Modified, so only record hashes help")
+    args = parser.parse_args()
+
+    from common.semantic_cache import bge_m3_embedder, hashed_ngram_embedder
+
+    if args.embedding_service:
+        from common.embedding_service import EmbeddingClient
+
+        embed = EmbeddingClient(args.embedding_service)
+    elif (args.embedder or ("hashed" if args.fixture else "bge-m3")) == "hashed":
+        embed = hashed_ngram_embedder(dim=1024)
+    else:
+        embed = bge_m3_embedder()
+
+    if args.fixture:
+        run_fixture_demo(embed, conditional=not args.no_validators)
+    else:
+        print_report(args.entry_url, refresh_knowledge_base(CrawlState(args.state), embed, entry_url=args.entry_url,
+                                                            index_dir=args.index_dir, delta_out=args.delta_out))
@@ -0,0 +1,101 @@
+"""Staged ``ocr_test.py`` flow against ``OcrPipeline`` on the local stub API.
+
+The baseline reproduces ``ocr_test.process_pdf``: render every page to
+``pdf_images/`` at 300 DPI, read the files back, then send batches of ten one
+after another. The pipeline renders in a process pool while earlier batches are
+in flight. Then the pipeline runs again on a warm cache, and once more on a cold
+cache with one batch failing, followed by a resume.
+
+    python benchmark_ocr.py --pdf ../../../methods/long_context_inference/raw_data/taxreturn.pdf
+"""
+import argparse
+import base64
+import os
+import tempfile
+import time
+
+import fitz  # PyMuPDF
+
+from mock_chat_api import MockChatServer
+from ocr_pipeline import DEFAULT_INSTRUCTION, OcrIncomplete, OcrPipeline, SCRIPTS_DIR, gateway, route_for
+
+DEFAULT_PDF = os.path.join(SCRIPTS_DIR, "..", "..", "..", "methods", "long_context_inference", "raw_data",
+                           "taxreturn.pdf")
+
+
+def staged_ocr(route, pdf_path, image_dir, batch_size=10, dpi=300):
+    """``ocr_test.process_pdf`` on *route*: render all, then send serially."""
+    os.makedirs(image_dir, exist_ok=True)
+    image_paths = []
+    with fitz.open(pdf_path) as pdf_document:
+        for page_num in range(len(pdf_document)):
+            zoom_factor = dpi / 72
+            pixmap = pdf_document.load_page(page_num).get_pixmap(matrix=fitz.Matrix(zoom_factor, zoom_factor))
+            image_path = os.path.join(image_dir, f"page_{page_num + 1}.jpg")
+            pixmap.save(image_path)
+            image_paths.append(image_path)
+
+    results = []
+    for i in range(0, len(image_paths), batch_size):
+        content = [{"type": "text", "text": DEFAULT_INSTRUCTION}]
+        for image_path in image_paths[i:i + batch_size]:
+            with open(image_path, "rb") as image_file:
+                encoded = base64.b64encode(image_file.read()).decode("utf-8")
+            content.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encoded}"}})
+        completion = gateway.complete_sync({"messages": [{"role": "user", "content": content}]}, route=route)
+        results.append(completion.text)
+    return "\n\n".join(results)
+
+
+def run(args):
+    with fitz.open(args.pdf) as pdf_document:
+        page_count = len(pdf_document)
+    with tempfile.TemporaryDirectory() as workdir, \
+            MockChatServer(latency=args.latency, per_image=args.per_image) as mock:
+        route = route_for(mock.url + "/v1")
+
+        start = time.perf_counter()
+        staged_ocr(route, args.pdf, os.path.join(workdir, "pdf_images"))
+        staged = time.perf_counter() - start
+        staged_requests = len(mock.requests)
+
+        def pipeline(cache_name):
+            return OcrPipeline(route, batch_size=args.batch_size, max_in_flight=args.max_in_flight,
+                               render_workers=args.render_workers, cache_dir=os.path.join(workdir, cache_name))
+
+        cold, cold_stats = pipeline("cache").run(args.pdf)
+        warm, warm_stats = pipeline("cache").run(args.pdf)
+        assert warm == cold
+
+        mock.fail_pages = {1}
+        try:
+            pipeline("resume").run(args.pdf)
+            raise AssertionError("expected the first batch to fail")
+        except OcrIncomplete as e:
+            failed_pages = [page + 1 for page in e.failed_pages]
+        mock.fail_pages = set()
+        resumed, resume_stats = pipeline("resume").run(args.pdf)
+        assert resumed == cold
+
+    print(f"{os.path.basename(args.pdf)}: {page_count} pages, stub API {args.latency * 1000:.0f} ms + "
+          f"{args.per_image * 1000:.0f} ms per image")
+    print(f"Staged (render all to disk, {staged_requests} serial requests): {staged:6.2f}s")
+    print(f"Pipelined ({cold_stats['requests']} requests, {args.max_in_flight} in flight):     "
+          f"{cold_stats['seconds']:6.2f}s  ({staged / cold_stats['seconds']:.1f}x, "
+          f"rendering done after {cold_stats['render_seconds']:.2f}s)")
+    print(f"Rendering uses {args.render_workers or os.cpu_count()} process(es); it bounds the warm-cache rerun")
+    print(f"Rerun, warm cache:                 {warm_stats['seconds']:6.2f}s  "
+          f"({warm_stats['cache_hits']}/{warm_stats['pages']} pages cached, {warm_stats['requests']} requests)")
+    print(f"Resume after pages {failed_pages} failed: {resume_stats['seconds']:6.2f}s  "
+          f"({resume_stats['pages_sent']} pages re-sent, {resume_stats['cache_hits']} from cache)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", default=DEFAULT_PDF)
+    parser.add_argument("--latency", type=float, default=1.0, help="stub API seconds per request")
+    parser.add_argument("--per-image", type=float, default=0.3, help="stub API seconds per image")
+    parser.add_argument("--batch-size", type=int, default=3)
+    parser.add_argument("--max-in-flight", type=int, default=4)
+    parser.add_argument("--render-workers", type=int)
+    run(parser.parse_args())
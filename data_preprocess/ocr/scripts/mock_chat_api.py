@@ -0,0 +1,133 @@
+"""Local OpenAI-compatible ``/v1/chat/completions`` stub for exercising the OCR pipeline offline.
+
+Every image in a request is "read" as a short deterministic Thai text derived from
+the image bytes, prefixed with the ``=== PAGE n ===`` marker that preceded it, so
+callers can check page order and caching without a vision model.
+"""
+import base64
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockChatServer:
+    """Threaded HTTP server answering chat completions with canned OCR output.
+
+    :param latency:        Seconds per request, plus *per_image* seconds per image.
+    :param fail_first:     Answer the first N requests with a 500.
+    :param fail_pages:     1-based page numbers whose requests always fail (until cleared).
+    :param drop_markers:   Answer without page markers, like a model ignoring the instruction.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, per_image=0.0, fail_first=0, fail_pages=(),
+                 drop_markers=False):
+        self.latency = latency
+        self.per_image = per_image
+        self.fail_first = fail_first
+        self.fail_pages = set(fail_pages)
+        self.drop_markers = drop_markers
+        self.requests = []  # page markers per request, in arrival order
+        self.images = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def transcribe(self, content):
+        """``(markers, answer text)`` for the user content of a request."""
+        marker, markers, parts = None, [], []
+        for part in content if isinstance(content, list) else []:
+            if part.get("type") == "text" and part["text"].startswith("=== PAGE"):
+                marker = part["text"].strip()
+            elif part.get("type") == "image_url":
+                data = part["image_url"]["url"].split(",", 1)[-1]
+                digest = hashlib.sha1(base64.b64decode(data)).hexdigest()[:12]
+                text = f"ข้อความจำลองจากภาพ {digest}\n| คอลัมน์ | ค่า |\n|---|---|\n| ภาษี | {int(digest[:4], 16)} |"
+                if marker and not self.drop_markers:
+                    text = f"{marker}\n{text}"
+                markers.append(marker)
+                parts.append(text)
+                marker = None
+        return markers, "\n\n".join(parts)
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, payload):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": self.path}})
+                    return
+                markers, text = server.transcribe(body["messages"][-1]["content"])
+                pages = {int(m.split()[2]) for m in markers if m}
+                with server._lock:
+                    server.requests.append(markers)
+                    fail = len(server.requests) <= server.fail_first or bool(pages & server.fail_pages)
+                    if fail:
+                        server.failed += 1
+                    else:
+                        server.images += len(markers)
+                time.sleep(server.latency + server.per_image * len(markers))
+                if fail:
+                    self._send_json(500, {"error": {"message": "Mock upstream error", "type": "server_error"}})
+                    return
+                self._send_json(200, {
+                    "id": f"chatcmpl-mock-{len(server.requests)}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "mock"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": text}}],
+                    "usage": {"prompt_tokens": 258 * len(markers), "completion_tokens": len(text) // 3,
+                              "total_tokens": 258 * len(markers) + len(text) // 3},
+                })
+
+        return Handler
+
+
+if __name__ == "__main__":
+    with MockChatServer(port=8789, latency=1.0) as mock:
+        print(f"Mock chat completions API listening on {mock.url}/v1 (Ctrl+C to stop)")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,301 @@
+"""Streaming OCR pipeline: the same vision-LLM extraction as ``ocr_test.py``, pipelined.
+
+Pages are rendered in a process pool straight to in-memory JPEG bytes (no
+``pdf_images/`` round-trip), grouped into batches in page order, and sent with
+several requests in flight while later pages are still rendering. Each page's
+text is cached under the hash of its rendered image, so a rerun only sends pages
+whose image changed, and a run that failed part-way resumes from what it
+finished. Requests go through the shared LLM gateway's ``ocr`` route (pooled
+connections, retries with backoff, circuit breaker).
+
+    python ocr_pipeline.py ../../../methods/long_context_inference/raw_data/taxreturn.pdf
+    python ocr_pipeline.py --mock some.pdf          # against the local stub API
+"""
+import argparse
+import base64
+import hashlib
+import os
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import replace
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import fitz  # PyMuPDF
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.abspath(os.path.join(SCRIPTS_DIR, "..", "..", ".."))
+if REPO_ROOT not in sys.path:
+    sys.path.append(REPO_ROOT)
+
+from common.llm_gateway import Target, gateway
+
+CACHE_DIR = os.path.join(REPO_ROOT, ".cache", "ocr_pages")
+
+MODEL = "google/gemini-2.0-flash-thinking-exp:free"
+DEFAULT_INSTRUCTION = "Extract all text from this document, including tables and formatting"
+PAGE_MARKER = "=== PAGE {} ==="
+_PAGE_MARKER_RE = re.compile(r"^[ \t]*=== PAGE (\d+) ===[ \t]*$", re.MULTILINE)
+
+# The OCR model on OpenRouter, for this module and ocr_test.py
+OCR_ROUTE = "ocr"
+gateway.add_route(OCR_ROUTE, [Target(
+    "openrouter", MODEL,
+    headers=(("HTTP-Referer", os.getenv("YOUR_SITE_URL", "https://example.com")),
+             ("X-Title", os.getenv("YOUR_SITE_NAME", "PDF OCR Application"))),
+)])
+
+
+def route_for(base_url: str, api_key: str = "mock") -> str:
+    """The OCR route pointed at another OpenAI-compatible endpoint (the local stub API)."""
+    route = f"{OCR_ROUTE}@{base_url}"
+    if route not in gateway.routes:
+        gateway.add_route(route, [replace(target, base_url=base_url, api_key=api_key)
+                                  for target in gateway.routes[OCR_ROUTE]])
+    return route
+
+
+def render_page(pdf_path: str, page_index: int, dpi: int = 300) -> bytes:
+    """JPEG bytes of one page at *dpi*, rendered without touching the disk."""
+    with fitz.open(pdf_path) as pdf_document:
+        zoom_factor = dpi / 72  # 72 is the base DPI for PDF
+        pixmap = pdf_document.load_page(page_index).get_pixmap(matrix=fitz.Matrix(zoom_factor, zoom_factor))
+        return pixmap.tobytes("jpeg")
+
+
+def _render_job(job: Tuple[str, int, int]) -> Tuple[int, bytes]:
+    pdf_path, page_index, dpi = job
+    return page_index, render_page(pdf_path, page_index, dpi)
+
+
+def build_message_content(instruction: str, pages: Sequence[Tuple[int, bytes]]) -> List[dict]:
+    """The ``ocr_test.py`` prompt, with a marker before each image so the answer can be split per page."""
+    content = [{
+        "type": "text",
+        "text": f"""
+                {instruction}
+
+                These are pages from a PDF document. Extract all text content while preserving the structure.
+                Pay special attention to tables, columns, headers, and any structured content.
+                Maintain paragraph breaks and formatting.
+                Each image is preceded by a line like "{PAGE_MARKER.format(1)}"; start the text of that page
+                with the same line.
+                """,
+    }]
+    for page_number, jpeg in pages:
+        content.append({"type": "text", "text": PAGE_MARKER.format(page_number)})
+        content.append({
+            "type": "image_url",
+            "image_url": {"url": f"data:image/jpeg;base64,{base64.b64encode(jpeg).decode('utf-8')}"},
+        })
+    return content
+
+
+def split_pages(text: str, page_numbers: Sequence[int]) -> Optional[Dict[int, str]]:
+    """Per-page text from a marked-up answer, or None when the markers don't match the batch."""
+    markers = list(_PAGE_MARKER_RE.finditer(text))
+    if [int(m.group(1)) for m in markers] != list(page_numbers):
+        return None
+    pages = {}
+    for marker, following in zip(markers, markers[1:] + [None]):
+        end = following.start() if following else len(text)
+        pages[int(marker.group(1))] = text[marker.end():end].strip()
+    return pages
+
+
+class PageCache:
+    """OCR text per rendered page image, one small file per entry, written atomically."""
+
+    def __init__(self, cache_dir: Optional[str], model: str, instruction: str):
+        self.cache_dir = cache_dir
+        self._salt = f"{model}\n{instruction}\n".encode("utf-8")
+
+    def key(self, *image_hashes: str) -> str:
+        return hashlib.sha256(self._salt + "|".join(image_hashes).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(os.path.join(self.cache_dir, key + ".txt"), "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, text: str) -> None:
+        if self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".txt")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, os.path.join(self.cache_dir, key + ".txt"))
+
+
+class OcrIncomplete(RuntimeError):
+    """Some batches failed; the pages that succeeded are cached, so rerunning resumes."""
+
+    def __init__(self, failed_pages: List[int], errors: List[BaseException]):
+        super().__init__(f"OCR failed for pages {failed_pages}: {errors[0]!r}")
+        self.failed_pages = failed_pages
+        self.errors = errors
+
+
+class OcrPipeline:
+    """
+    :param route:          Gateway route the requests are sent on.
+    :param batch_size:     Pages per request (``ocr_test.py`` used 10).
+    :param max_in_flight:  Requests sent concurrently.
+    :param render_workers: Render processes (default: one per CPU).
+    :param cache_dir:      Per-page result cache; None disables it.
+    """
+
+    def __init__(self, route: str = OCR_ROUTE, instruction: Optional[str] = None,
+                 batch_size: int = 10, max_in_flight: int = 3, render_workers: Optional[int] = None,
+                 dpi: int = 300, cache_dir: Optional[str] = CACHE_DIR):
+        self.route = route
+        self.model = gateway.routes[route][0].model
+        self.instruction = instruction or DEFAULT_INSTRUCTION
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.render_workers = render_workers
+        self.dpi = dpi
+        self.cache = PageCache(cache_dir, self.model, self.instruction)
+
+    def _request(self, pages: Sequence[Tuple[int, bytes]]) -> str:
+        completion = gateway.complete_sync(
+            {"messages": [{"role": "user", "content": build_message_content(self.instruction, pages)}]},
+            route=self.route,
+        )
+        return completion.text
+
+    def run(self, pdf_path: str, pages: Optional[Sequence[int]] = None,
+            dpis: Optional[Dict[int, int]] = None) -> Tuple[Dict[int, str], Dict]:
+        """OCR *pages* (0-based; default all) and return ``({page_index: text}, stats)``.
+
+        *dpis* overrides the render resolution of individual pages.
+
+        Raises :class:`OcrIncomplete` after every other batch has finished if some
+        batch could not be processed.
+        """
+        start = time.perf_counter()
+        if pages is None:
+            with fitz.open(pdf_path) as pdf_document:
+                pages = range(len(pdf_document))
+        pages = list(pages)
+        stats = {"pages": len(pages), "cache_hits": 0, "requests": 0, "pages_sent": 0, "failed_pages": 0}
+        results: Dict[int, str] = {}
+        in_flight = []
+
+        with ProcessPoolExecutor(max_workers=self.render_workers) as renderers, \
+                ThreadPoolExecutor(max_workers=self.max_in_flight) as senders:
+            rendered = [renderers.submit(_render_job, (pdf_path, page, (dpis or {}).get(page, self.dpi)))
+                        for page in pages]
+            for first in range(0, len(rendered), self.batch_size):
+                # Blocks only until this batch's pages are rendered; later pages keep rendering
+                batch = [future.result() for future in rendered[first:first + self.batch_size]]
+                hashes = {page: hashlib.sha256(jpeg).hexdigest() for page, jpeg in batch}
+
+                misses = []
+                for page, jpeg in batch:
+                    cached = self.cache.get(self.cache.key(hashes[page]))
+                    if cached is None:
+                        misses.append((page, jpeg))
+                    else:
+                        results[page] = cached
+                        stats["cache_hits"] += 1
+                if not misses:
+                    continue
+                # A batch whose answer could not be split per page is cached as a whole
+                whole_key = self.cache.key(*(hashes[page] for page, _ in misses))
+                whole = self.cache.get(whole_key)
+                if whole is not None:
+                    results.update(self._spread(whole, [page for page, _ in misses]))
+                    stats["cache_hits"] += len(misses)
+                    continue
+                numbered = [(page + 1, jpeg) for page, jpeg in misses]
+                in_flight.append((misses, hashes, whole_key, senders.submit(self._request, numbered)))
+                stats["requests"] += 1
+                stats["pages_sent"] += len(misses)
+
+            stats["render_seconds"] = time.perf_counter() - start
+            failed, errors = [], []
+            for misses, hashes, whole_key, future in in_flight:
+                batch_pages = [page for page, _ in misses]
+                try:
+                    text = future.result()
+                except Exception as e:
+                    failed.extend(batch_pages)
+                    errors.append(e)
+                    continue
+                per_page = split_pages(text, [page + 1 for page in batch_pages])
+                if per_page is None:
+                    self.cache.put(whole_key, text)
+                    results.update(self._spread(text, batch_pages))
+                    continue
+                for page in batch_pages:
+                    results[page] = per_page[page + 1]
+                    self.cache.put(self.cache.key(hashes[page]), per_page[page + 1])
+
+        stats["failed_pages"] = len(failed)
+        stats["seconds"] = time.perf_counter() - start
+        if failed:
+            raise OcrIncomplete(sorted(failed), errors)
+        return results, stats
+
+    @staticmethod
+    def _spread(text: str, batch_pages: List[int]) -> Dict[int, str]:
+        """Attach an unsplittable batch answer to its first page (the rest contribute nothing)."""
+        return {page: text if i == 0 else "" for i, page in enumerate(batch_pages)}
+
+
+def join_pages(results: Dict[int, str]) -> str:
+    """Page texts in page order, separated like the batches in ``ocr_test.py``."""
+    return "\n\n".join(results[page] for page in sorted(results) if results[page])
+
+
+def process_pdf(pdf_path: str, output_dir: str = "./ocr_result", pipeline: Optional[OcrPipeline] = None,
+                pages: Optional[Sequence[int]] = None) -> str:
+    """Pipelined ``ocr_test.process_pdf``: writes ``<output_dir>/<name>_extracted_text.txt``."""
+    pipeline = pipeline or OcrPipeline()
+    results, stats = pipeline.run(pdf_path, pages=pages)
+    result = join_pages(results)
+
+    os.makedirs(output_dir, exist_ok=True)
+    pdf_basename = os.path.splitext(os.path.basename(pdf_path))[0]
+    output_file = os.path.join(output_dir, f"{pdf_basename}_extracted_text.txt")
+    with open(output_file, "w", encoding="utf-8") as f:
+        f.write(result)
+    print(f"{stats['pages']} pages: {stats['cache_hits']} from cache, {stats['pages_sent']} sent in "
+          f"{stats['requests']} requests, {stats['seconds']:.1f}s. Extracted text saved to {output_file}")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdf_path")
+    parser.add_argument("--output-dir", default="./ocr_result")
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--max-in-flight", type=int, default=3)
+    parser.add_argument("--dpi", type=int, default=300)
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--mock", action="store_true", help="send requests to the local stub API instead of OpenRouter")
+    args = parser.parse_args()
+
+    cache_dir = None if args.no_cache else CACHE_DIR
+    if args.mock:
+        from mock_chat_api import MockChatServer
+
+        with MockChatServer(latency=1.0) as mock:
+            pipeline = OcrPipeline(route_for(mock.url + "/v1"), batch_size=args.batch_size,
+                                   max_in_flight=args.max_in_flight, dpi=args.dpi, cache_dir=cache_dir)
+            process_pdf(args.pdf_path, args.output_dir, pipeline)
+    else:
+        pipeline = OcrPipeline(batch_size=args.batch_size, max_in_flight=args.max_in_flight, dpi=args.dpi,
+                               cache_dir=cache_dir)
+        process_pdf(args.pdf_path, args.output_dir, pipeline)
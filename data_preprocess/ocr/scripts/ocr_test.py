@@ -1,7 +1,6 @@
 import os
 import base64
 import io
-from openai import OpenAI
 from dotenv import load_dotenv
 from PIL import Image
 from pdf2image import convert_from_path
@@ -9,22 +8,23 @@ from IPython.display import display
 
 
 import os
+import sys
 import base64
-from openai import OpenAI
 from dotenv import load_dotenv
 import fitz  # PyMuPDF
 
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+if REPO_ROOT not in sys.path:
+    sys.path.append(REPO_ROOT)
+
+from common.llm_gateway import gateway
+
 # Load environment variables
 load_dotenv()
-OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
-YOUR_SITE_URL = os.getenv('YOUR_SITE_URL', 'https://example.com')
-YOUR_SITE_NAME = os.getenv('YOUR_SITE_NAME', 'PDF OCR Application')
 
-# Initialize OpenRouter client
-client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=OPENROUTER_API_KEY,
-)
+# OpenRouter through the shared gateway (pooled connections, retries with backoff);
+# the route is registered in ocr_pipeline.py
+from ocr_pipeline import OCR_ROUTE
 
 def convert_pdf_to_images(pdf_path, output_folder, dpi=300):
     """Convert PDF to images using PyMuPDF instead of pdf2image"""
@@ -93,22 +93,20 @@ def process_images(image_paths, instruction):
             })
         
         # Make the API call
-        completion = client.chat.completions.create(
-            extra_headers={
-                "HTTP-Referer": YOUR_SITE_URL,
-                "X-Title": YOUR_SITE_NAME,
+        completion = gateway.complete_sync(
+            {
+                "messages": [
+                    {
+                        "role": "user",
+                        "content": message_content
+                    }
+                ]
             },
-            model="google/gemini-2.0-flash-thinking-exp:free",
-            messages=[
-                {
-                    "role": "user",
-                    "content": message_content
-                }
-            ]
+            route=OCR_ROUTE,
         )
         
         # Append the result
-        results.append(completion.choices[0].message.content)
+        results.append(completion.text)
     
     # Combine all batch results
     return "\n\n".join(results)
@@ -0,0 +1,225 @@
+"""Text-layer fast path: only pages PyMuPDF cannot read well go to vision OCR.
+
+Each page's ``page.get_text()`` is repaired (legacy Thai private-use glyphs,
+decomposed sara am, spaces before combining marks) and scored. A page is sent to
+``OcrPipeline`` when its text layer is missing or mostly image, when too little
+of it is Thai, when combining marks are still misplaced after the repair, or
+when it holds a table (``get_text`` flattens tables; the vision model keeps them
+as markdown). OCR pages are rendered at a DPI chosen from their smallest font or
+their scan resolution instead of a flat 300.
+
+    python text_layer.py --mock                      # the five raw_data PDFs, timed against full OCR
+    python text_layer.py --classify-only some.pdf    # just print the per-page decisions
+"""
+import argparse
+import math
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import fitz  # PyMuPDF
+
+from ocr_pipeline import OCR_ROUTE, OcrPipeline, REPO_ROOT, join_pages, route_for
+
+RAW_DATA_DIR = os.path.join(REPO_ROOT, "methods", "long_context_inference", "raw_data")
+
+_THAI_RE = re.compile(r"[ก-๛]")
+_OTHER_LETTER_RE = re.compile(r"[^\W\d_ก-๛]")
+_MARKS = "ัิ-ฺ็-๎"
+_MARK_RE = re.compile(f"[{_MARKS}]")
+# A combining mark must sit on a consonant or on another mark (vowel, then tone)
+_MISPLACED_MARK_RE = re.compile(f"(?<![ก-ฮ{_MARKS}])[{_MARKS}]")
+_SPACE_BEFORE_MARK_RE = re.compile(f"(?<=[ก-ฮ{_MARKS}])[ \t]+(?=[{_MARKS}])")
+
+# Positional glyph variants of legacy Thai fonts (U+F700-U+F71A) back to Unicode
+_THAI_PUA = str.maketrans({
+    "\uf700": "ฐ", "\uf701": "ิ", "\uf702": "ี", "\uf703": "ึ", "\uf704": "ื",
+    "\uf705": "่", "\uf706": "้", "\uf707": "๊", "\uf708": "๋", "\uf709": "์",
+    "\uf70a": "่", "\uf70b": "้", "\uf70c": "๊", "\uf70d": "๋", "\uf70e": "์",
+    "\uf70f": "ญ", "\uf710": "ั", "\uf711": "ํ", "\uf712": "็", "\uf713": "่",
+    "\uf714": "้", "\uf715": "๊", "\uf716": "๋", "\uf717": "์", "\uf718": "ุ",
+    "\uf719": "ู", "\uf71a": "ฺ",
+})
+_PUA_RE = re.compile("[\uf700-\uf71a]")
+
+
+def repair_thai_text(text: str) -> str:
+    """Undo the common ways PDF text layers break Thai, and tidy whitespace."""
+    text = text.translate(_THAI_PUA).replace("ํา", "ำ")
+    text = _SPACE_BEFORE_MARK_RE.sub("", text)
+    text = "\n".join(line.rstrip() for line in text.splitlines())
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+
+@dataclass
+class PageAssessment:
+    page: int  # 0-based
+    chars: int
+    thai_ratio: float
+    misplaced_marks: int
+    repaired_glyphs: int
+    tables: int
+    image_coverage: float
+    dpi: int
+    reasons: List[str] = field(default_factory=list)
+    text: str = ""
+
+    @property
+    def needs_ocr(self) -> bool:
+        return bool(self.reasons)
+
+
+def _ocr_dpi(page: "fitz.Page", sizes: Sequence[float], images: Sequence[dict], min_dpi: int, max_dpi: int,
+             glyph_px: int) -> int:
+    """Enough resolution for the smallest font to be *glyph_px* tall, or the native resolution of a scan."""
+    if images and not sizes:
+        largest = max(images, key=lambda info: abs(fitz.Rect(info["bbox"])))
+        width_inches = fitz.Rect(largest["bbox"]).width / 72
+        dpi = largest["width"] / width_inches if width_inches else max_dpi
+    else:
+        dpi = glyph_px * 72 / min(sizes) if sizes else max_dpi
+    return int(min(max_dpi, max(min_dpi, math.ceil(dpi / 25) * 25)))
+
+
+def assess_page(page: "fitz.Page", min_chars: int = 40, min_thai_ratio: float = 0.5, max_misplaced: float = 0.01,
+                max_image_coverage: float = 0.5, min_dpi: int = 150, max_dpi: int = 300,
+                glyph_px: int = 40) -> PageAssessment:
+    """Score one page's text layer; a non-empty ``reasons`` list means it should go to OCR."""
+    raw = page.get_text()
+    text = repair_thai_text(raw)
+    thai = len(_THAI_RE.findall(text))
+    letters = thai + len(_OTHER_LETTER_RE.findall(text))
+    marks = len(_MARK_RE.findall(text))
+    misplaced = len(_MISPLACED_MARK_RE.findall(text))
+
+    page_area = abs(page.rect) or 1.0
+    images = [info for info in page.get_image_info() if abs(fitz.Rect(info["bbox"]) & page.rect) > 0]
+    coverage = min(1.0, sum(abs(fitz.Rect(info["bbox"]) & page.rect) for info in images) / page_area)
+    tables = [table for table in page.find_tables().tables if table.row_count >= 2 and table.col_count >= 2]
+    sizes = [span["size"] for block in page.get_text("dict")["blocks"] for line in block.get("lines", [])
+             for span in line["spans"] if span["text"].strip()]
+
+    reasons = []
+    if len(text) < min_chars:
+        reasons.append("no text layer")
+    elif coverage > max_image_coverage:
+        reasons.append("mostly image")
+    if letters and thai / letters < min_thai_ratio:
+        reasons.append("low Thai ratio")
+    if marks and misplaced / marks > max_misplaced:
+        reasons.append("broken combining marks")
+    if tables:
+        reasons.append("table")
+
+    return PageAssessment(
+        page=page.number, chars=len(text), thai_ratio=thai / letters if letters else 0.0,
+        misplaced_marks=misplaced, repaired_glyphs=len(_PUA_RE.findall(raw)) + raw.count("ํา"),
+        tables=len(tables), image_coverage=coverage,
+        dpi=_ocr_dpi(page, sizes, images, min_dpi, max_dpi, glyph_px), reasons=reasons, text=text,
+    )
+
+
+def assess_pdf(pdf_path: str, **thresholds) -> List[PageAssessment]:
+    with fitz.open(pdf_path) as pdf_document:
+        return [assess_page(page, **thresholds) for page in pdf_document]
+
+
+def extract_pdf(pdf_path: str, pipeline: Optional[OcrPipeline] = None,
+                **thresholds) -> Tuple[Dict[int, str], Dict]:
+    """``({page_index: text}, stats)``: text-layer pages as extracted, the rest through *pipeline*."""
+    start = time.perf_counter()
+    assessments = assess_pdf(pdf_path, **thresholds)
+    results = {a.page: a.text for a in assessments if not a.needs_ocr}
+    ocr_pages = [a.page for a in assessments if a.needs_ocr]
+    stats = {"pages": len(assessments), "text_layer_pages": len(results), "ocr_pages": len(ocr_pages),
+             "classify_seconds": time.perf_counter() - start, "ocr": None}
+    if ocr_pages:
+        pipeline = pipeline or OcrPipeline()
+        ocr_results, stats["ocr"] = pipeline.run(pdf_path, pages=ocr_pages,
+                                                 dpis={a.page: a.dpi for a in assessments if a.needs_ocr})
+        results.update(ocr_results)
+    stats["assessments"] = assessments
+    stats["seconds"] = time.perf_counter() - start
+    return results, stats
+
+
+def write_extracted_text(pdf_path: str, output_dir: str, text: str) -> str:
+    os.makedirs(output_dir, exist_ok=True)
+    pdf_basename = os.path.splitext(os.path.basename(pdf_path))[0]
+    output_file = os.path.join(output_dir, f"{pdf_basename}_extracted_text.txt")
+    with open(output_file, "w", encoding="utf-8") as f:
+        f.write(text)
+    return output_file
+
+
+def process_pdf(pdf_path: str, output_dir: str = "./ocr_result", pipeline: Optional[OcrPipeline] = None,
+                **thresholds) -> str:
+    """Like ``ocr_pipeline.process_pdf``, writing ``<output_dir>/<name>_extracted_text.txt``."""
+    results, stats = extract_pdf(pdf_path, pipeline, **thresholds)
+    result = join_pages(results)
+    output_file = write_extracted_text(pdf_path, output_dir, result)
+    print(f"{stats['pages']} pages: {stats['text_layer_pages']} from the text layer, {stats['ocr_pages']} OCR, "
+          f"{stats['seconds']:.1f}s. Extracted text saved to {output_file}")
+    return result
+
+
+def print_assessments(pdf_path: str, assessments: Sequence[PageAssessment]) -> None:
+    print(f"\n{os.path.basename(pdf_path)}")
+    for a in assessments:
+        decision = f"OCR @ {a.dpi} dpi ({', '.join(a.reasons)})" if a.needs_ocr else "text layer"
+        repaired = f", {a.repaired_glyphs} glyphs repaired" if a.repaired_glyphs else ""
+        print(f"  page {a.page + 1:>2}: {a.chars:>5} chars, Thai {a.thai_ratio:4.0%}, {a.misplaced_marks} misplaced "
+              f"marks, {a.tables} tables, images {a.image_coverage:4.0%}{repaired} -> {decision}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdf_paths", nargs="*", help=f"default: every PDF in {RAW_DATA_DIR}")
+    parser.add_argument("--output-dir", default="./ocr_result")
+    parser.add_argument("--classify-only", action="store_true")
+    parser.add_argument("--compare", action="store_true",
+                        help="also OCR every page, to measure the time saved (implied by --mock)")
+    parser.add_argument("--mock", action="store_true", help="send OCR requests to the local stub API")
+    parser.add_argument("--mock-latency", type=float, default=1.0)
+    parser.add_argument("--mock-per-image", type=float, default=0.3)
+    args = parser.parse_args()
+
+    pdf_paths = args.pdf_paths or sorted(os.path.join(RAW_DATA_DIR, name) for name in os.listdir(RAW_DATA_DIR)
+                                         if name.lower().endswith(".pdf"))
+    if args.classify_only:
+        for pdf_path in pdf_paths:
+            print_assessments(pdf_path, assess_pdf(pdf_path))
+        raise SystemExit
+
+    def run(route):
+        total = {"pages": 0, "ocr_pages": 0, "seconds": 0.0, "full_seconds": 0.0}
+        for pdf_path in pdf_paths:
+            # No result cache: every run pays for what it sends
+            results, stats = extract_pdf(pdf_path, OcrPipeline(route, cache_dir=None))
+            print_assessments(pdf_path, stats["assessments"])
+            output_file = write_extracted_text(pdf_path, args.output_dir, join_pages(results))
+            line = f"  {stats['ocr_pages']}/{stats['pages']} pages OCR'd, {stats['seconds']:.1f}s -> {output_file}"
+            total["pages"] += stats["pages"]
+            total["ocr_pages"] += stats["ocr_pages"]
+            total["seconds"] += stats["seconds"]
+            if args.compare or args.mock:
+                _, full = OcrPipeline(route, cache_dir=None).run(pdf_path)
+                total["full_seconds"] += full["seconds"]
+                line += f" (full OCR {full['seconds']:.1f}s)"
+            print(line)
+
+        print(f"\n{len(pdf_paths)} PDFs, {total['pages']} pages: {total['pages'] - total['ocr_pages']} pages "
+              f"({1 - total['ocr_pages'] / max(total['pages'], 1):.0%}) served from the text layer")
+        if args.compare or args.mock:
+            print(f"Fast path {total['seconds']:.1f}s vs full OCR {total['full_seconds']:.1f}s: "
+                  f"{total['full_seconds'] - total['seconds']:.1f}s saved")
+
+    if args.mock:
+        from mock_chat_api import MockChatServer
+
+        with MockChatServer(latency=args.mock_latency, per_image=args.mock_per_image) as mock:
+            run(route_for(mock.url + "/v1"))
+    else:
+        run(OCR_ROUTE)
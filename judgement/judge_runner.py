@@ -0,0 +1,316 @@
+"""LLM-as-judge over the four methods' result files, concurrent and memoized.
+
+Uses the judge prompt, ``EvaluationResult`` schema and model of
+``llmasjudge.ipynb``, but judges every case concurrently under a requests/tokens
+per-minute budget and stores each verdict in ``.cache/judge/verdicts.jsonl``
+under a hash of (question, golden answer, candidate answer, prompt, model). A
+rerun only judges cases that are new or changed. Replies that do not parse as an
+``EvaluationResult`` are re-requested for that case alone.
+
+    python judge_runner.py                       # OpenAI judge, needs OPENAI_API_KEY
+    python judge_runner.py --stub                # offline, against stub_judge.py
+    python judge_runner.py rag=../methods/rag/evaluation_results.json --out judgement.json
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import openai
+from dotenv import load_dotenv
+from pydantic import BaseModel, Field, ValidationError, field_validator
+from termcolor import cprint
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if REPO_ROOT not in sys.path:
+    sys.path.append(REPO_ROOT)
+
+from common.rate_limiter import RateLimiter
+from common.result_journal import write_json_atomic
+from common.text_metrics import RESULT_FILES, load_test_cases
+
+load_dotenv()
+
+JUDGE_MODEL = "gpt-4.1-mini-2025-04-14"
+VERDICT_CACHE = os.path.join(REPO_ROOT, ".cache", "judge", "verdicts.jsonl")
+
+# gpt-4.1-mini tier 1 limits; the limiter adopts the real ones from x-ratelimit-* headers
+REQUESTS_PER_MINUTE = 500
+TOKENS_PER_MINUTE = 200_000
+MAX_CONCURRENCY = 8
+MAX_OUTPUT_TOKENS = 512
+CHARS_PER_TOKEN = 2.5
+
+
+class EvaluationResult(BaseModel):
+    score: int = Field(description="The score from 1 to 5.")
+    reasoning: str = Field(description="A brief explanation for the assigned score.")
+
+    @field_validator("score")
+    @classmethod
+    def score_must_be_in_range(cls, v):
+        if not 1 <= v <= 5:
+            raise ValueError("Score must be between 1 and 5")
+        return v
+
+
+def format_instructions() -> str:
+    """The ``PydanticOutputParser(EvaluationResult).get_format_instructions()`` text of the notebook."""
+    schema = {key: value for key, value in EvaluationResult.model_json_schema().items() if key not in ("title", "type")}
+    return (
+        "The output should be formatted as a JSON instance that conforms to the JSON schema below.\n\n"
+        'As an example, for the schema {"properties": {"foo": {"title": "Foo", "description": "a list of strings", '
+        '"type": "array", "items": {"type": "string"}}}, "required": ["foo"]}\n'
+        'the object {"foo": ["bar", "baz"]} is a well-formatted instance of the schema. '
+        'The object {"properties": {"foo": ["bar", "baz"]}} is not well-formatted.\n\n'
+        f"Here is the output schema:\n```\n{json.dumps(schema, ensure_ascii=False)}\n```"
+    )
+
+
+JUDGE_PROMPT = """
+You are an impartial AI judge in TAX. Your task is to evaluate the quality of a submitted answer compared to a golden (correct) answer for a given question.
+Please provide a score from 1 to 5 based on the following criteria:
+
+1:  Completely Incorrect - The submitted answer is entirely wrong, irrelevant, or fails to address the question.
+2:  Mostly Incorrect - The submitted answer has significant errors or omissions, though it might show a slight understanding or attempt.
+3:  Partially Correct - The submitted answer is partially correct but contains notable inaccuracies, misses key points, or lacks sufficient detail. It addresses the main aspects of the question but has clear room for improvement.
+4:  Mostly Correct - The submitted answer is largely correct and addresses the question well, with only minor inaccuracies, omissions, or stylistic issues.
+5:  Fully Correct - The submitted answer is accurate, complete, and aligns perfectly or very closely with the golden answer. It demonstrates a thorough understanding.
+
+You MUST provide your output in the specified JSON format. Do not add any other text before or after the JSON.
+
+Question:
+{question}
+
+Golden Answer:
+{golden_answer}
+
+Submitted Answer to Evaluate:
+{submitted_answer}
+
+{format_instructions}
+"""
+
+
+class JudgeParseError(ValueError):
+    """The judge's reply is not a valid ``EvaluationResult``."""
+
+
+def build_prompt(question: str, golden_answer: str, submitted_answer: str, template: str = JUDGE_PROMPT) -> str:
+    return template.format(question=question, golden_answer=golden_answer, submitted_answer=submitted_answer,
+                           format_instructions=format_instructions())
+
+
+def parse_verdict(text: str) -> EvaluationResult:
+    """Parse a reply the way ``PydanticOutputParser`` does: the JSON object, fenced or not."""
+    match = re.search(r"\{.*\}", text or "", re.DOTALL)
+    if match is None:
+        raise JudgeParseError(f"No JSON object in judge reply: {text[:100]!r}")
+    try:
+        return EvaluationResult.model_validate_json(match.group(0))
+    except ValidationError as e:
+        raise JudgeParseError(f"Invalid EvaluationResult: {e.errors()[0]['msg']}") from e
+
+
+def verdict_key(question: str, golden_answer: str, submitted_answer: str, template: str, model: str) -> str:
+    payload = json.dumps([question, golden_answer, submitted_answer, template, model], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class VerdictCache:
+    """Append-only JSONL of ``{"key", "score", "reasoning", "model", "ts"}``; the latest line per key wins."""
+
+    def __init__(self, path: Optional[str] = VERDICT_CACHE):
+        self.path = path
+        self._verdicts: Dict[str, dict] = {}
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # torn write from a crash
+                    self._verdicts[record["key"]] = record
+
+    def get(self, key: str) -> Optional[dict]:
+        return self._verdicts.get(key)
+
+    def put(self, key: str, verdict: EvaluationResult, model: str) -> dict:
+        record = {"key": key, "score": verdict.score, "reasoning": verdict.reasoning, "model": model, "ts": time.time()}
+        self._verdicts[key] = record
+        if self.path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a+b") as f:
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        f.write(b"\n")
+                f.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+        return record
+
+
+async def judge_case(client: openai.AsyncOpenAI, limiter: RateLimiter, prompt: str, model: str,
+                     max_parse_attempts: int = 3, max_rate_limited: int = 5) -> Tuple[EvaluationResult, Dict]:
+    """Judge one prompt, re-asking only while the reply fails to parse."""
+    stats = {"requests": 0, "parse_failures": 0, "input_tokens": 0, "output_tokens": 0}
+    rate_limited = 0
+    last_error = None
+    while stats["parse_failures"] < max_parse_attempts:
+        reserved_input = int(len(prompt) / CHARS_PER_TOKEN)
+        await limiter.acquire(reserved_input, MAX_OUTPUT_TOKENS)
+        try:
+            raw = await client.chat.completions.with_raw_response.create(
+                model=model, temperature=0, max_tokens=MAX_OUTPUT_TOKENS,
+                messages=[{"role": "user", "content": prompt}],
+            )
+        except openai.RateLimitError as e:
+            rate_limited += 1
+            if rate_limited > max_rate_limited:
+                raise
+            delay = limiter.on_rate_limited(e.response.headers)
+            cprint(f"Rate limit hit. Pausing all judges for {delay:.1f} seconds...", "yellow")
+            continue
+        completion = raw.parse()
+        stats["requests"] += 1
+        usage = completion.usage
+        if usage is not None:
+            stats["input_tokens"] += usage.prompt_tokens
+            stats["output_tokens"] += usage.completion_tokens
+            limiter.reconcile(reserved_input, MAX_OUTPUT_TOKENS, usage.prompt_tokens, usage.completion_tokens)
+        limiter.on_success(raw.headers)
+        try:
+            return parse_verdict(completion.choices[0].message.content), stats
+        except JudgeParseError as e:
+            stats["parse_failures"] += 1
+            last_error = e
+    raise JudgeParseError(f"{last_error} (after {max_parse_attempts} replies)")
+
+
+async def judge_files(files: Dict[str, str], client: openai.AsyncOpenAI, model: str = JUDGE_MODEL,
+                      cache: Optional[VerdictCache] = None, limiter: Optional[RateLimiter] = None,
+                      max_concurrency: int = MAX_CONCURRENCY, template: str = JUDGE_PROMPT) -> Dict[str, Dict]:
+    """Judge every case of ``{method: result file}``; returns per-method verdicts and run stats."""
+    cache = cache or VerdictCache(None)
+    limiter = limiter or RateLimiter(requests_per_minute=REQUESTS_PER_MINUTE, input_tokens_per_minute=TOKENS_PER_MINUTE,
+                                     output_tokens_per_minute=TOKENS_PER_MINUTE, input_estimate=0)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    results = {method: {"cases": [], "stats": Counter()} for method in files}
+    pending: Dict[str, asyncio.Task] = {}
+
+    async def run(key, prompt):
+        async with semaphore:
+            verdict, stats = await judge_case(client, limiter, prompt, model)
+        # Stored as soon as it is judged, so an interrupted run keeps what it finished
+        cache.put(key, verdict, model)
+        return verdict, stats
+
+    for method, path in files.items():
+        for tc in load_test_cases(path):
+            key = verdict_key(tc["question"], tc["golden_answer"], tc["inference_result"], template, model)
+            case = {"id": tc["id"], "key": key}
+            results[method]["cases"].append(case)
+            if cache.get(key) is not None:
+                results[method]["stats"]["cached"] += 1
+            elif key not in pending:
+                # Identical (question, answers) across methods are judged once
+                prompt = build_prompt(tc["question"], tc["golden_answer"], tc["inference_result"], template)
+                pending[key] = asyncio.create_task(run(key, prompt))
+
+    outcomes = dict(zip(pending, await asyncio.gather(*pending.values(), return_exceptions=True)))
+    run_stats = Counter()
+    for key, outcome in outcomes.items():
+        if isinstance(outcome, BaseException):
+            continue
+        run_stats.update(outcome[1])
+
+    for method, result in results.items():
+        for case in result["cases"]:
+            record = cache.get(case["key"])
+            if record is not None:
+                case.update(score=record["score"], reasoning=record["reasoning"])
+            else:
+                error = outcomes.get(case["key"])
+                case["error"] = f"{type(error).__name__}: {error}"
+                result["stats"]["failed"] += 1
+        result["stats"]["judged"] = sum(1 for case in result["cases"] if case["key"] in outcomes
+                                        and "error" not in case)
+    return {"methods": results, "run": dict(run_stats), "judged_prompts": len(pending)}
+
+
+def score_distribution(cases: List[dict]) -> Dict:
+    scores = [case["score"] for case in cases if "score" in case]
+    histogram = Counter(scores)
+    return {
+        "n": len(cases),
+        "scored": len(scores),
+        "mean": sum(scores) / len(scores) if scores else None,
+        "histogram": {str(score): histogram.get(score, 0) for score in range(1, 6)},
+    }
+
+
+def print_report(report: Dict, seconds: float) -> None:
+    cprint(f"{'method':<14}{'mean':>6}   " + "".join(f"{score:>4}" for score in range(1, 6))
+           + f"{'cached':>8}{'judged':>8}{'failed':>8}", "cyan")
+    for method, result in report["methods"].items():
+        distribution = score_distribution(result["cases"])
+        mean = f"{distribution['mean']:.2f}" if distribution["mean"] is not None else "-"
+        stats = result["stats"]
+        print(f"{method:<14}{mean:>6}   " + "".join(f"{count:>4}" for count in distribution["histogram"].values())
+              + f"{stats['cached']:>8}{stats['judged']:>8}{stats['failed']:>8}")
+    run = report["run"]
+    cprint(f"{report['judged_prompts']} prompts judged with {run.get('requests', 0)} requests "
+           f"({run.get('parse_failures', 0)} unparseable replies re-asked), "
+           f"{run.get('input_tokens', 0)} input / {run.get('output_tokens', 0)} output tokens, {seconds:.1f}s", "green")
+
+
+def main(args) -> Dict:
+    files = (dict(item.split("=", 1) if "=" in item else (os.path.splitext(os.path.basename(item))[0], item)
+                  for item in args.files) if args.files else RESULT_FILES)
+    cache = VerdictCache(None if args.no_cache else args.cache)
+
+    async def run(client, model):
+        start = time.perf_counter()
+        report = await judge_files(files, client, model=model, cache=cache, max_concurrency=args.concurrency)
+        print_report(report, time.perf_counter() - start)
+        return report
+
+    if args.stub:
+        from judgement.stub_judge import StubJudgeServer
+
+        with StubJudgeServer(latency=args.stub_latency, malformed_every=args.stub_malformed_every) as stub:
+            client = openai.AsyncOpenAI(base_url=stub.url + "/v1", api_key="stub", max_retries=0)
+            report = asyncio.run(run(client, args.model or "stub-judge"))
+    else:
+        # Rate limits are handled by the limiter, not the SDK
+        client = openai.AsyncOpenAI(api_key=os.environ["OPENAI_API_KEY"], max_retries=0)
+        report = asyncio.run(run(client, args.model or JUDGE_MODEL))
+
+    if args.out:
+        write_json_atomic(args.out, {
+            method: {**score_distribution(result["cases"]),
+                     "cases": [{key: value for key, value in case.items() if key != "key"} for case in result["cases"]]}
+            for method, result in report["methods"].items()
+        })
+        cprint(f"Verdicts saved to {args.out}", "green")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", metavar="METHOD=PATH",
+                        help="result files to judge (default: the four methods' result files)")
+    parser.add_argument("--model", help=f"judge model (default: {JUDGE_MODEL}, or stub-judge with --stub)")
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENCY)
+    parser.add_argument("--cache", default=VERDICT_CACHE)
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--out", help="write per-method distributions and verdicts as JSON")
+    parser.add_argument("--stub", action="store_true", help="judge with the local stub instead of OpenAI")
+    parser.add_argument("--stub-latency", type=float, default=0.5)
+    parser.add_argument("--stub-malformed-every", type=int, default=4)
+    main(parser.parse_args())
@@ -0,0 +1,138 @@
+"""Local OpenAI-compatible stand-in for the LLM judge, for running ``judge_runner.py`` offline.
+
+The verdict is derived from the character-trigram overlap between the golden and
+the submitted answer in the judge prompt, so it is deterministic and roughly
+tracks answer quality. ``malformed_every`` makes the first reply for every Nth
+distinct prompt break the ``EvaluationResult`` schema, to exercise the parse
+retries.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_SECTIONS_RE = re.compile(r"Golden Answer:\n(.*?)\n\nSubmitted Answer to Evaluate:\n(.*?)\n\nThe output should be",
+                          re.DOTALL)
+
+
+def _trigrams(text):
+    text = re.sub(r"\s+", "", text)
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def stub_verdict(prompt):
+    """``{"score", "reasoning"}`` for a judge prompt."""
+    match = _SECTIONS_RE.search(prompt)
+    golden, submitted = (match.group(1), match.group(2)) if match else ("", prompt)
+    golden_grams, submitted_grams = _trigrams(golden), _trigrams(submitted)
+    overlap = len(golden_grams & submitted_grams) / max(len(golden_grams), 1)
+    score = 1 + min(4, int(overlap * 5))
+    return {"score": score, "reasoning": f"Stub judge: {overlap:.0%} of the golden answer's trigrams are covered."}
+
+
+class StubJudgeServer:
+    """Threaded HTTP server answering ``/v1/chat/completions`` with stub verdicts.
+
+    :param latency:         Seconds every response is delayed by.
+    :param malformed_every: Break the first reply for every Nth distinct prompt (0 = never).
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, malformed_every=0):
+        self.latency = latency
+        self.malformed_every = malformed_every
+        self.stats = {"requests": 0, "malformed": 0}
+        self._seen = set()
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reply(self, prompt):
+        digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+        with self._lock:
+            self.stats["requests"] += 1
+            first = digest not in self._seen
+            self._seen.add(digest)
+            malformed = first and self.malformed_every and digest[0] % self.malformed_every == 0
+            if malformed:
+                self.stats["malformed"] += 1
+        verdict = stub_verdict(prompt)
+        if malformed:
+            # Alternate between prose and an out-of-range score
+            if digest[1] % 2:
+                return f"The answer deserves a {verdict['score']} because it mostly matches."
+            return json.dumps({"score": verdict["score"] + 5, "reasoning": verdict["reasoning"]})
+        return json.dumps(verdict, ensure_ascii=False)
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, payload):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": self.path}})
+                    return
+                prompt = "\n".join(m["content"] for m in body.get("messages", []) if isinstance(m.get("content"), str))
+                if server.latency:
+                    time.sleep(server.latency)
+                content = server.reply(prompt)
+                prompt_tokens, completion_tokens = len(prompt) // 3, len(content) // 3
+                self._send_json(200, {
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "stub-judge"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": content}}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                              "total_tokens": prompt_tokens + completion_tokens},
+                })
+
+        return Handler
+
+
+if __name__ == "__main__":
+    with StubJudgeServer(port=8790, latency=0.5) as stub:
+        print(f"Stub judge listening on {stub.url}/v1 (Ctrl+C to stop)")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
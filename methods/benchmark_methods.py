@@ -0,0 +1,380 @@
+"""Offline benchmark of the four answering methods against the local mock Messages API.
+
+Long-context, naive RAG, agentic RAG and vanilla inference are driven through one
+interface: an async generator ``method(question, client)`` yielding the same
+updates as ``inference.stream_answer`` (the last one carries ``usage``). Every
+method gets its own ``MockMessagesServer`` with a time to first token and an
+output-token budget per answer, so latency, time to first token, throughput at
+several concurrency levels, tokens and cost per question can be reproduced
+without API keys. Retrieval uses the hybrid retriever over the knowledge base
+with the offline hashed embedder. The mock generates tokens faster than the real
+API so a full run takes about a minute; the ratios between methods hold.
+
+The report is compared with the stored baseline (``benchmark_baseline.json``),
+and any metric that got worse by more than the tolerance is flagged and makes
+the script exit with status 1.
+
+    python benchmark_methods.py                                    # run and compare with the baseline
+    python benchmark_methods.py --update-baseline                  # run and store the result as the baseline
+    python benchmark_methods.py --methods agentic_rag long_context --concurrency 1 8
+    python benchmark_methods.py --profile profile.jsonl            # also break each request down by stage
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+import anthropic
+from termcolor import cprint
+
+METHODS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(METHODS_DIR, "long_context_inference"))
+
+from inference import CHARS_PER_TOKEN, MAX_TOKENS, MODEL, REPO_ROOT, stream_answer
+from document_cache import usage_report
+from mock_messages_api import MockMessagesServer
+from common import tracing
+from common.benchmark import summarize_latencies
+from common.hybrid_retriever import HybridRetriever
+from common.lexical_index import BM25Index
+from common.result_journal import write_json_atomic
+from common.semantic_cache import hashed_ngram_embedder
+from common.vector_index import VectorIndex, load_records
+
+BASELINE_PATH = os.path.join(METHODS_DIR, "benchmark_baseline.json")
+
+# Average output tokens per question in the recorded result files (naive RAG recorded
+# no usage; its answers are about as long as the vanilla ones)
+OUTPUT_TOKENS = {
+    "long_context": 1741,
+    "naive_rag": 804,
+    "agentic_rag": 1530,
+    "vanilla": 804,
+}
+
+# The retriever tool of the agentic RAG notebook (``create_retriever_tool``)
+SEARCH_TOOL = {
+    "name": "search_tax_information",
+    "description": "Searches and returns information about text in thai language.",
+    "input_schema": {"type": "object", "properties": {"query": {"type": "string"}}, "required": ["query"]},
+}
+AGENT_TOP_K = 4  # LangChain's as_retriever() default
+MAX_AGENT_TURNS = 5
+
+# Higher is worse for every compared metric except throughput
+LATENCY_KEYS = [("latency", "p50"), ("latency", "p95"), ("time_to_first_token", "p50")]
+USAGE_KEYS = ["input_tokens", "output_tokens", "cost_usd", "llm_calls"]
+
+
+def load_questions():
+    with open(os.path.join(REPO_ROOT, "testset", "tax-test-set.json"), "r", encoding="utf-8") as f:
+        return [case["question"] for case in json.load(f)["test_cases"]]
+
+
+def map_response_to_context_prompt(response):
+    """Retrieved answers wrapped like the naive RAG notebook's system prompt."""
+    return "".join(f"<start_context>{match['metadata']['answer']}<end_context>" for match in response["matches"])
+
+
+def _add_usage(total, usage):
+    for key in ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens",
+                "total_input_tokens", "tokens_saved", "cost", "cost_saved"):
+        total[key] = total.get(key, 0) + usage[key]
+    return total
+
+
+async def stream_turns(client, request, tool_fn=None):
+    """Stream *request*, running ``tool_fn(name, input) -> str`` for tool calls until the model answers.
+
+    Yields the same updates as ``inference.stream_answer``; the final one adds
+    ``llm_calls`` and sums ``usage`` over every turn.
+    """
+    start_time = time.time()
+    messages = list(request["messages"])
+    total_usage = {}
+    partial_text = ""
+    first_token_time = None
+    trace = tracing.current_trace()
+    for turn in range(1, MAX_AGENT_TURNS + 1):
+        sent_time = time.time()
+        turn_first_token = None
+        async with client.messages.stream(**dict(request, messages=messages)) as stream:
+            async for text in stream.text_stream:
+                now = time.time()
+                if turn_first_token is None:
+                    turn_first_token = now
+                if first_token_time is None:
+                    first_token_time = now
+                partial_text += text
+                yield {
+                    "text": partial_text,
+                    "done": False,
+                    "elapsed": now - start_time,
+                    "time_to_first_token": first_token_time - start_time,
+                }
+            message = await stream.get_final_message()
+        usage = usage_report(message.usage)
+        _add_usage(total_usage, usage)
+        if trace is not None:
+            # Tool-call turns stream no text: the whole turn counts as waiting on the network
+            turn_end = time.time()
+            trace.add_span("network_wait", sent_time, turn_first_token or turn_end, turn=turn)
+            if turn_first_token is not None:
+                trace.add_span("generation", turn_first_token, turn_end, turn=turn,
+                               output_tokens=usage["output_tokens"])
+
+        tool_uses = [block for block in message.content if block.type == "tool_use"]
+        if message.stop_reason != "tool_use" or tool_fn is None or not tool_uses:
+            break
+        results = await asyncio.gather(*(asyncio.to_thread(tool_fn, block.name, block.input) for block in tool_uses))
+        messages.append({"role": "assistant", "content": message.content})
+        messages.append({"role": "user", "content": [
+            {"type": "tool_result", "tool_use_id": block.id, "content": result}
+            for block, result in zip(tool_uses, results)
+        ]})
+
+    end_time = time.time()
+    if first_token_time is None:
+        first_token_time = end_time
+    yield {
+        "text": "".join(block.text for block in message.content if block.type == "text"),
+        "done": True,
+        "elapsed": end_time - start_time,
+        "time_to_first_token": first_token_time - start_time,
+        "usage": total_usage,
+        "llm_calls": turn,
+    }
+
+
+def build_methods(retriever, top_k=5):
+    """``{name: method(question, client)}`` for the four answering methods."""
+
+    def vanilla(question, client):
+        # ChatAnthropic(temperature=0, max_tokens=2500).invoke(question)
+        return stream_turns(client, {
+            "model": MODEL, "max_tokens": MAX_TOKENS, "temperature": 0,
+            "messages": [{"role": "user", "content": question}],
+        })
+
+    async def naive_rag(question, client):
+        # Retrieve once, put the context in the system prompt, one LLM call
+        response = await asyncio.to_thread(retriever.query, question, top_k)
+        async for update in stream_turns(client, {
+            "model": MODEL, "max_tokens": MAX_TOKENS,
+            "system": map_response_to_context_prompt(response),
+            "messages": [{"role": "user", "content": question}],
+        }):
+            yield update
+
+    def search_tax_information(name, tool_input):
+        response = retriever.query(tool_input["query"], AGENT_TOP_K)
+        return "\n\n".join(match["metadata"]["answer"] for match in response["matches"])
+
+    def agentic_rag(question, client):
+        # create_react_agent(llm, tools=[search_tax_information]): the model decides when to search
+        return stream_turns(client, {
+            "model": MODEL, "max_tokens": MAX_TOKENS, "temperature": 0, "tools": [SEARCH_TOOL],
+            "messages": [{"role": "user", "content": question}],
+        }, tool_fn=search_tax_information)
+
+    return {
+        "long_context": stream_answer,
+        "naive_rag": naive_rag,
+        "agentic_rag": agentic_rag,
+        "vanilla": vanilla,
+    }
+
+
+def build_retriever(index_dir):
+    records = load_records()
+    dense = VectorIndex.build(records, hashed_ngram_embedder(), index_dir=index_dir)
+    return HybridRetriever(BM25Index.build(records), dense)
+
+
+def filler_answer(output_tokens):
+    """Mock ``answer_fn`` whose answers stream about *output_tokens* tokens of text."""
+    text = "ผู้มีเงินได้ต้องยื่นแบบแสดงรายการภาษีเงินได้บุคคลธรรมดาภายในกำหนดเวลา "
+    length = int(output_tokens * CHARS_PER_TOKEN)
+    return lambda question: (text * (length // len(text) + 1))[:length]
+
+
+async def run_level(name, method, client, questions, concurrency):
+    """Answer every question with at most *concurrency* in flight; latency, TTFT, throughput and usage."""
+    semaphore = asyncio.Semaphore(concurrency)
+    producer = tracing.traced(name, lambda question: method(question, client))
+    latencies, first_tokens, finals = [], [], []
+
+    async def one(question):
+        async with semaphore:
+            start = time.perf_counter()
+            first = None
+            async for update in producer(question):
+                if first is None and update["text"]:
+                    first = time.perf_counter() - start
+            latencies.append(time.perf_counter() - start)
+            first_tokens.append(first if first is not None else latencies[-1])
+            finals.append(update)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(question) for question in questions))
+    wall = time.perf_counter() - start
+    return {
+        "requests": len(latencies),
+        "throughput_rps": len(latencies) / wall,
+        "wall_seconds": wall,
+        "latency": summarize_latencies(latencies),
+        "time_to_first_token": summarize_latencies(first_tokens),
+    }, finals
+
+
+async def run_method(name, method, args, questions):
+    output_tokens = args.output_tokens or OUTPUT_TOKENS[name]
+    token_delay = args.chunk_chars / CHARS_PER_TOKEN / args.tokens_per_second
+    with MockMessagesServer(latency=args.latency, output_tokens=output_tokens, answer_fn=filler_answer(output_tokens),
+                            token_delay=token_delay, chunk_chars=args.chunk_chars, tool_rounds=args.tool_rounds) as mock:
+        client = anthropic.AsyncAnthropic(base_url=mock.url, api_key="mock", max_retries=0)
+        # One unmeasured question first, so the prompt cache and connections are warm like in steady state
+        async for _ in method(questions[0], client):
+            pass
+        levels, finals = {}, []
+        for concurrency in args.concurrency:
+            levels[str(concurrency)], level_finals = await run_level(name, method, client, questions, concurrency)
+            finals.extend(level_finals)
+        await client.close()
+
+    count = len(finals)
+    per_question = {
+        "input_tokens": sum(f["usage"]["total_input_tokens"] for f in finals) / count,
+        "uncached_input_tokens": sum(f["usage"]["input_tokens"] for f in finals) / count,
+        "cache_read_input_tokens": sum(f["usage"]["cache_read_input_tokens"] for f in finals) / count,
+        "output_tokens": sum(f["usage"]["output_tokens"] for f in finals) / count,
+        "cost_usd": sum(f["usage"]["cost"] for f in finals) / count,
+        "llm_calls": sum(f.get("llm_calls", 1) for f in finals) / count,
+    }
+    return {"levels": levels, "per_question": per_question}
+
+
+async def run_benchmark(args):
+    questions = load_questions()
+    questions = [questions[i % len(questions)] for i in range(args.requests)]
+    report = {"config": benchmark_config(args), "methods": {}}
+    with tempfile.TemporaryDirectory() as index_dir:
+        methods = build_methods(build_retriever(index_dir), top_k=args.top_k)
+        for name in args.methods:
+            report["methods"][name] = await run_method(name, methods[name], args, questions)
+            print_method(name, report["methods"][name])
+    return report
+
+
+def benchmark_config(args):
+    """Settings that must match for two reports to be comparable."""
+    return {
+        "model": MODEL,
+        "requests": args.requests,
+        "concurrency": list(args.concurrency),
+        "latency": args.latency,
+        "tokens_per_second": args.tokens_per_second,
+        "chunk_chars": args.chunk_chars,
+        "output_tokens": {name: args.output_tokens or OUTPUT_TOKENS[name] for name in args.methods},
+        "tool_rounds": args.tool_rounds,
+        "top_k": args.top_k,
+    }
+
+
+def compare_to_baseline(report, baseline, tolerance=0.2, min_delta=0.05, usage_tolerance=0.01):
+    """Lines describing every metric that is worse than in *baseline* beyond the tolerance.
+
+    Timings carry scheduling noise, so they get *tolerance* (relative) plus
+    *min_delta* seconds; tokens, cost and LLM calls are deterministic and get
+    *usage_tolerance*.
+    """
+    regressions = []
+    for name, result in report["methods"].items():
+        base = baseline["methods"].get(name)
+        if base is None:
+            continue
+        for key in USAGE_KEYS:
+            old, new = base["per_question"][key], result["per_question"][key]
+            if new > old * (1 + usage_tolerance) + 1e-9:
+                regressions.append(f"{name}: {key} per question {old:.4g} -> {new:.4g}")
+        for level, stats in result["levels"].items():
+            base_stats = base["levels"].get(level)
+            if base_stats is None:
+                continue
+            for group, key in LATENCY_KEYS:
+                old, new = base_stats[group][key], stats[group][key]
+                if new > old * (1 + tolerance) + min_delta:
+                    regressions.append(f"{name} @ {level}: {group} {key} {old:.3f}s -> {new:.3f}s")
+            old, new = base_stats["throughput_rps"], stats["throughput_rps"]
+            if new < old / (1 + tolerance):
+                regressions.append(f"{name} @ {level}: throughput {old:.2f} -> {new:.2f} requests/second")
+    return regressions
+
+
+def print_method(name, result):
+    usage = result["per_question"]
+    cprint(f"\n== {name} ==", 'blue')
+    cprint(f"Per question: {usage['input_tokens']:.1f} input tokens ({usage['cache_read_input_tokens']:.1f} cached), "
+           f"{usage['output_tokens']:.1f} output tokens, {usage['llm_calls']:.1f} LLM calls, "
+           f"${usage['cost_usd']:.4f}", 'green')
+    for level, stats in result["levels"].items():
+        latency, first = stats["latency"], stats["time_to_first_token"]
+        cprint(f"Concurrency {level:>3}: {stats['throughput_rps']:6.2f} requests/second  "
+               f"latency p50 {latency['p50']:.3f}s p95 {latency['p95']:.3f}s p99 {latency['p99']:.3f}s  "
+               f"TTFT p50 {first['p50']:.3f}s p95 {first['p95']:.3f}s", 'yellow')
+
+
+def main(args):
+    if args.profile:
+        # Start a fresh timeline file so the stage summary covers this run only
+        open(args.profile, "w").close()
+        tracing.enable_profiling(args.profile)
+    report = asyncio.run(run_benchmark(args))
+    if args.profile:
+        cprint(f"\nPer-stage breakdown (timelines in {args.profile}):", 'blue')
+        tracing.print_profile_summary(tracing.summarize_profile(tracing.load_profile(args.profile)))
+    if args.out:
+        write_json_atomic(args.out, report)
+    if args.update_baseline:
+        write_json_atomic(args.baseline, report)
+        cprint(f"\nBaseline written to {args.baseline}", 'green')
+        return 0
+    if not os.path.exists(args.baseline):
+        cprint(f"\nNo baseline at {args.baseline}; run with --update-baseline to store one", 'yellow')
+        return 0
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline["config"] != report["config"]:
+        cprint(f"\nBaseline {args.baseline} was recorded with different settings; not comparing", 'yellow')
+        return 0
+    regressions = compare_to_baseline(report, baseline, args.tolerance)
+    if regressions:
+        cprint(f"\n{len(regressions)} regression(s) against {args.baseline}:", 'red')
+        for line in regressions:
+            cprint(f"  {line}", 'red')
+        return 1
+    cprint(f"\nNo regressions against {args.baseline} (timing tolerance {args.tolerance:.0%})", 'green')
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--methods", nargs="+", choices=list(OUTPUT_TOKENS), default=list(OUTPUT_TOKENS))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="in-flight questions per level")
+    parser.add_argument("--requests", type=int, default=16, help="questions per concurrency level")
+    parser.add_argument("--latency", type=float, default=0.2, help="mock time to first token (seconds)")
+    parser.add_argument("--tokens-per-second", type=float, default=2000, help="mock generation speed")
+    parser.add_argument("--chunk-chars", type=int, default=24, help="characters per streamed delta")
+    parser.add_argument("--output-tokens", type=int, help="answer length for every method (default: per method)")
+    parser.add_argument("--tool-rounds", type=int, default=1, help="searches the mock makes the agent run")
+    parser.add_argument("--top-k", type=int, default=5, help="contexts retrieved by naive RAG")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative slack for timings")
+    parser.add_argument("--out", help="also write the report to this JSON file")
+    parser.add_argument("--profile", help="write per-request stage timelines to this JSONL file")
+    sys.exit(main(parser.parse_args()))
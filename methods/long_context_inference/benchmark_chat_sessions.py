@@ -0,0 +1,169 @@
+"""Tokens and latency of multi-turn chat over 20-turn scripted conversations.
+
+Several users hold the same scripted 20-turn conversation at once against the
+local mock Messages API, once per history strategy:
+
+    resend          every earlier turn re-sent verbatim, only the documents cached
+    cached_history  earlier turns re-sent with cache breakpoints on the latest answers
+    session         cached history plus background summaries and the per-turn input cap
+
+The report gives input tokens per turn (mean, max and at the last turn), the
+uncached share, total cost including the summary calls, and latency and time
+to first token; the mock's time to first token grows with the uncached prompt.
+
+    python benchmark_chat_sessions.py
+    python benchmark_chat_sessions.py --conversations 5 --max-input-tokens 18000 --out chat_benchmark.json
+"""
+import argparse
+import asyncio
+import time
+
+import anthropic
+from termcolor import cprint
+
+from chat_sessions import MAX_TURN_INPUT_TOKENS, SUMMARIZE_AFTER_TOKENS, ChatSessions
+from mock_messages_api import MockMessagesServer
+from common.benchmark import summarize_latencies
+from common.result_journal import write_json_atomic
+
+# Average output tokens per question in tax-test-results.json
+OUTPUT_TOKENS = 1741
+
+# One user's conversation: an employee working out their tax return, with follow-ups
+CONVERSATION = [
+    "ผมเป็นพนักงานบริษัท มีเงินเดือน 40,000 บาทต่อเดือน ต้องยื่นภาษีเงินได้บุคคลธรรมดาหรือไม่?",
+    "ต้องใช้แบบแสดงรายการภาษีแบบไหน?",
+    "ยื่นแบบได้ถึงวันที่เท่าไร และถ้ายื่นออนไลน์ได้ขยายเวลาหรือไม่?",
+    "เงินเดือนของผมหักค่าใช้จ่ายได้เท่าไร?",
+    "ผมมีภรรยาที่ไม่มีเงินได้ หักลดหย่อนคู่สมรสได้เท่าไร?",
+    "มีลูก 2 คน คนที่สองเกิดปี 2566 หักลดหย่อนบุตรได้เท่าไร?",
+    "ค่าฝากครรภ์และค่าคลอดบุตรหักลดหย่อนได้ไหม?",
+    "ผมส่งเงินให้พ่อแม่อายุ 65 ปีทุกเดือน หักค่าอุปการะเลี้ยงดูบิดามารดาได้หรือไม่?",
+    "เบี้ยประกันสุขภาพของพ่อแม่ล่ะ?",
+    "ผมจ่ายเงินสมทบประกันสังคมทุกเดือน หักได้เท่าไร?",
+    "ถ้าซื้อกองทุน RMF และ SSF ปีนี้ หักลดหย่อนรวมกันได้สูงสุดเท่าไร?",
+    "ดอกเบี้ยเงินกู้ซื้อบ้านหักได้เท่าไร?",
+    "ผมบริจาคเงินให้โรงเรียน 10,000 บาท หักได้เท่าไร?",
+    "ถ้าผมมีรายได้เสริมจากการขายของออนไลน์ปีละ 200,000 บาท ต้องเสียภาษีอย่างไร?",
+    "เงินได้จากการขายของออนไลน์เป็นเงินได้ประเภทไหน หักค่าใช้จ่ายได้เท่าไร?",
+    "สรุปแล้วเงินได้สุทธิของผมประมาณเท่าไร?",
+    "จากเงินได้สุทธินั้น ผมต้องเสียภาษีเท่าไร?",
+    "บริษัทหักภาษี ณ ที่จ่ายไว้แล้ว ผมจะได้ภาษีคืนไหม?",
+    "ถ้าต้องชำระภาษีเพิ่ม ผ่อนชำระได้หรือไม่?",
+    "ถ้ายื่นแบบช้ากว่ากำหนด ผมจะโดนค่าปรับและเงินเพิ่มเท่าไร?",
+]
+
+STRATEGIES = {
+    "resend": dict(max_input_tokens=None, summarize_after_tokens=None, cache_history=False),
+    "cached_history": dict(max_input_tokens=None, summarize_after_tokens=None, cache_history=True),
+    "session": dict(cache_history=True),
+}
+
+
+def filler_answer(output_tokens):
+    """Mock ``answer_fn`` whose answers are about *output_tokens* tokens long (three characters each)."""
+    text = "ผู้มีเงินได้ต้องยื่นแบบแสดงรายการภาษีเงินได้บุคคลธรรมดาภายในกำหนดเวลา "
+    length = output_tokens * 3
+    return lambda question: (text * (length // len(text) + 1))[:length]
+
+
+async def converse(chat, session_id, think_time):
+    """One user working through the scripted conversation; per-turn rows."""
+    rows = []
+    for turn, question in enumerate(CONVERSATION, 1):
+        final = None
+        async for update in chat.stream(session_id, question):
+            final = update
+        usage = final["usage"]
+        rows.append({
+            "turn": turn,
+            "input_tokens": usage["total_input_tokens"],
+            "uncached_input_tokens": usage["input_tokens"] + usage["cache_creation_input_tokens"],
+            "cost": usage["cost"],
+            "latency": final["elapsed"],
+            "time_to_first_token": final["time_to_first_token"],
+            "history_turns": final["session"]["history_turns"],
+            "dropped_turns": final["session"]["dropped_turns"],
+        })
+        await asyncio.sleep(think_time)
+    return rows
+
+
+async def run_strategy(name, args):
+    settings = dict(STRATEGIES[name])
+    if name == "session":
+        settings.update(max_input_tokens=args.max_input_tokens, summarize_after_tokens=args.summarize_after_tokens)
+    with MockMessagesServer(latency=args.latency, output_tokens=args.output_tokens, chunk_chars=64,
+                            answer_fn=filler_answer(args.output_tokens),
+                            prefill_tokens_per_second=args.prefill_tokens_per_second) as mock:
+        client = anthropic.AsyncAnthropic(base_url=mock.url, api_key="mock", max_retries=0)
+        chat = ChatSessions(client, **settings)
+        start = time.time()
+        conversations = await asyncio.gather(*(converse(chat, f"user-{i}", args.think_time)
+                                               for i in range(args.conversations)))
+        await chat.wait_for_summaries()
+        wall = time.time() - start
+
+    rows = [row for conversation in conversations for row in conversation]
+    last = [row for row in rows if row["turn"] == len(CONVERSATION)]
+    metrics = chat.metrics()
+    by_turn = [sum(row["input_tokens"] for row in rows if row["turn"] == turn) / args.conversations
+               for turn in range(1, len(CONVERSATION) + 1)]
+    return {
+        "strategy": name,
+        "settings": settings,
+        "conversations": args.conversations,
+        "turns": len(rows),
+        "wall_seconds": wall,
+        "input_tokens_per_turn": sum(row["input_tokens"] for row in rows) / len(rows),
+        "max_input_tokens": max(row["input_tokens"] for row in rows),
+        "last_turn_input_tokens": sum(row["input_tokens"] for row in last) / len(last),
+        "uncached_input_tokens_per_turn": sum(row["uncached_input_tokens"] for row in rows) / len(rows),
+        "cost_per_conversation": (sum(row["cost"] for row in rows) + metrics["summary_cost"]) / args.conversations,
+        "summary_cost_per_conversation": metrics["summary_cost"] / args.conversations,
+        "summaries": metrics["summaries"],
+        "dropped_turns": metrics["dropped_turns"],
+        "state_bytes": metrics["state_bytes"],
+        "latency": summarize_latencies([row["latency"] for row in rows]),
+        "time_to_first_token": summarize_latencies([row["time_to_first_token"] for row in rows]),
+        "input_tokens_by_turn": by_turn,
+    }
+
+
+def print_report(results):
+    cprint(f"\n{'strategy':<15} {'in/turn':>8} {'max in':>8} {'turn 20':>8} {'uncached':>9} {'$/conv':>8} "
+           f"{'summary $':>9} {'p50 s':>6} {'p95 s':>6} {'TTFT p50':>8} {'state':>8}", 'cyan')
+    for r in results:
+        print(f"{r['strategy']:<15} {r['input_tokens_per_turn']:>8.0f} {r['max_input_tokens']:>8} "
+              f"{r['last_turn_input_tokens']:>8.0f} {r['uncached_input_tokens_per_turn']:>9.0f} "
+              f"{r['cost_per_conversation']:>8.3f} {r['summary_cost_per_conversation']:>9.3f} "
+              f"{r['latency']['p50']:>6.2f} {r['latency']['p95']:>6.2f} {r['time_to_first_token']['p50']:>8.2f} "
+              f"{r['state_bytes'] / 1024:>6.1f}KB")
+    for r in results:
+        series = " ".join(f"{tokens / 1000:.1f}k" for tokens in r["input_tokens_by_turn"])
+        cprint(f"{r['strategy']} input tokens by turn: {series}", 'yellow')
+
+
+async def main(args):
+    return [await run_strategy(name, args) for name in args.strategies]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--strategies", nargs="+", choices=list(STRATEGIES), default=list(STRATEGIES))
+    parser.add_argument("--conversations", type=int, default=3, help="users holding the conversation at once")
+    parser.add_argument("--max-input-tokens", type=int, default=MAX_TURN_INPUT_TOKENS)
+    parser.add_argument("--summarize-after-tokens", type=int, default=SUMMARIZE_AFTER_TOKENS)
+    parser.add_argument("--think-time", type=float, default=0.5, help="pause between a user's turns (seconds)")
+    parser.add_argument("--latency", type=float, default=0.3, help="mock base time to first token (seconds)")
+    parser.add_argument("--prefill-tokens-per-second", type=float, default=10000,
+                        help="mock prompt reading speed for uncached input tokens")
+    parser.add_argument("--output-tokens", type=int, default=OUTPUT_TOKENS)
+    parser.add_argument("--out", help="write the report to this JSON file")
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+    print_report(results)
+    if args.out:
+        write_json_atomic(args.out, results)
+        cprint(f"Report saved to: {args.out}", 'green')
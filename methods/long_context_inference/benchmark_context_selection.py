@@ -0,0 +1,171 @@
+"""Side-by-side benchmark of full-PDF context and budgeted context selection.
+
+Every question of ``testset/tax-test-set.json`` is answered once per mode:
+``full`` attaches the four PDFs (prompt cache warm after the first question) and
+``select@<budget>`` sends only the OCR text sections chosen by
+``context_selection.ContextSelector``, falling back to the PDFs when unsure. The
+report gives input tokens, cost (also what full mode costs on a cold cache),
+latency, time to first token and the fallback rate per mode.
+
+Offline the answers come from the local mock Messages API, whose time to first
+token grows with the uncached prompt, and answer quality is estimated as context
+recall: the share of the golden answer's terms present in the context sent.
+With ``--live`` the real API answers and quality is BLEU-4 and ROUGE-L F1
+against the golden answers.
+
+    python benchmark_context_selection.py
+    python benchmark_context_selection.py --budget 2000 4000 8000
+    python benchmark_context_selection.py --live --out context_selection_benchmark.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import anthropic
+from termcolor import cprint
+
+import inference
+from inference import REPO_ROOT, stream_answer
+from context_selection import context_selector
+from mock_messages_api import MockMessagesServer
+from common.benchmark import summarize_latencies
+from common.lexical_index import thai_tokens
+from common.result_journal import write_json_atomic
+from common.text_metrics import bleu_scores, rouge_scores, tokenize_for_metrics
+
+TEST_SET_PATH = os.path.join(REPO_ROOT, "testset", "tax-test-set.json")
+
+# Average output tokens per question in tax-test-results.json
+OUTPUT_TOKENS = 1741
+
+
+def load_test_cases(path=TEST_SET_PATH):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["test_cases"]
+
+
+def context_recall(golden_answer, context_terms):
+    """Share of the golden answer's terms that appear in the context."""
+    terms = set(thai_tokens(golden_answer))
+    return len(terms & context_terms) / len(terms) if terms else 0.0
+
+
+def answer_quality(golden_answer, answer):
+    reference, candidate = tokenize_for_metrics(golden_answer), tokenize_for_metrics(answer)
+    return {"bleu4": bleu_scores(reference["bleu"], candidate["bleu"])["bleu4"],
+            "rougeL_f1": rouge_scores(reference["rouge"], candidate["rouge"])["rougeL_f1"]}
+
+
+async def run_mode(mode, test_cases, client):
+    """Answer every test case sequentially in *mode* and return per-question rows."""
+    context_mode, _, budget = mode.partition("@")
+    if budget:
+        inference.CONTEXT_TOKEN_BUDGET = int(budget)
+    full_terms = set().union(*(set(thai_tokens(f"{s.title}\n{s.text}")) for s in context_selector.sections))
+
+    rows = []
+    for case in test_cases:
+        final = None
+        async for update in stream_answer(case["question"], client, context_mode):
+            final = update
+        usage = final["usage"]
+        if final["context_mode"] == "select":
+            selection = context_selector.select(case["question"], inference.CONTEXT_TOKEN_BUDGET)
+            context_terms = set().union(*(set(thai_tokens(f"{s.title}\n{s.text}")) for s in selection.sections))
+        else:
+            context_terms = full_terms
+        rows.append({
+            "id": case["id"],
+            "context_mode": final["context_mode"],
+            "fallback": final.get("context_fallback", False),
+            "input_tokens": usage["total_input_tokens"],
+            "uncached_input_tokens": usage["total_input_tokens"] - usage["cache_read_input_tokens"],
+            "output_tokens": usage["output_tokens"],
+            "cost": usage["cost"],
+            "cold_cost": usage["cost"] + usage["cost_saved"],
+            "latency": final["elapsed"],
+            "time_to_first_token": final["time_to_first_token"],
+            "context_recall": context_recall(case["golden_answer"], context_terms),
+            "answer": final["text"],
+        })
+    return rows
+
+
+def summarize(mode, rows, live):
+    count = len(rows)
+    summary = {
+        "mode": mode,
+        "questions": count,
+        "input_tokens": sum(r["input_tokens"] for r in rows) / count,
+        "uncached_input_tokens": sum(r["uncached_input_tokens"] for r in rows) / count,
+        "cost_per_question": sum(r["cost"] for r in rows) / count,
+        "cold_cost_per_question": sum(r["cold_cost"] for r in rows) / count,
+        "latency": summarize_latencies([r["latency"] for r in rows]),
+        "time_to_first_token": summarize_latencies([r["time_to_first_token"] for r in rows]),
+        "fallback_rate": sum(r["fallback"] for r in rows) / count,
+        "context_recall": sum(r["context_recall"] for r in rows) / count,
+    }
+    if live:
+        for name in ("bleu4", "rougeL_f1"):
+            summary[name] = sum(r[name] for r in rows) / count
+    return summary
+
+
+async def run_benchmark(args):
+    test_cases = load_test_cases(args.test_set)
+    modes = ["full"] + [f"select@{budget}" for budget in args.budget]
+    report = {"modes": [], "questions": {}}
+    for mode in modes:
+        cprint(f"Running {mode} on {len(test_cases)} questions...", 'blue')
+        if args.live:
+            client = anthropic.AsyncAnthropic(api_key=os.environ["ANTHROPIC_API_KEY"])
+            rows = await run_mode(mode, test_cases, client)
+            for row, case in zip(rows, test_cases):
+                row.update(answer_quality(case["golden_answer"], row["answer"]))
+        else:
+            # A fresh mock per mode so full mode starts on a cold prompt cache
+            with MockMessagesServer(latency=args.latency, output_tokens=args.output_tokens,
+                                    prefill_tokens_per_second=args.prefill_tokens_per_second) as mock:
+                client = anthropic.AsyncAnthropic(base_url=mock.url, api_key="mock", max_retries=0)
+                rows = await run_mode(mode, test_cases, client)
+        report["modes"].append(summarize(mode, rows, args.live))
+        report["questions"][mode] = rows
+    return report
+
+
+def print_report(report, live):
+    quality = "BLEU-4  ROUGE-L" if live else ""
+    cprint(f"\n{'mode':<12} {'input tok':>9} {'uncached':>9} {'$/question':>10} {'cold $/q':>9} "
+           f"{'p50 s':>7} {'TTFT s':>7} {'fallback':>8} {'recall':>7} {quality}", 'cyan')
+    for m in report["modes"]:
+        line = (f"{m['mode']:<12} {m['input_tokens']:>9.0f} {m['uncached_input_tokens']:>9.0f} "
+                f"{m['cost_per_question']:>10.4f} {m['cold_cost_per_question']:>9.4f} "
+                f"{m['latency']['p50']:>7.2f} {m['time_to_first_token']['p50']:>7.2f} "
+                f"{m['fallback_rate']:>8.0%} {m['context_recall']:>7.2f}")
+        if live:
+            line += f" {m['bleu4']:>7.3f} {m['rougeL_f1']:>8.3f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--test-set", default=TEST_SET_PATH)
+    parser.add_argument("--budget", type=int, nargs="+", default=[inference.CONTEXT_TOKEN_BUDGET],
+                        help="token budgets to run context selection with")
+    parser.add_argument("--live", action="store_true", help="call the real API (needs ANTHROPIC_API_KEY)")
+    parser.add_argument("--latency", type=float, default=0.3, help="mock base time to first token (seconds)")
+    parser.add_argument("--prefill-tokens-per-second", type=float, default=5000,
+                        help="mock prompt reading speed for uncached input tokens")
+    parser.add_argument("--output-tokens", type=int, default=OUTPUT_TOKENS)
+    parser.add_argument("--out", help="write the report (with per-question rows) to this JSON file")
+    args = parser.parse_args()
+
+    start = time.time()
+    report = asyncio.run(run_benchmark(args))
+    print_report(report, args.live)
+    cprint(f"\nFinished in {time.time() - start:.1f} seconds", 'green')
+    if args.out:
+        write_json_atomic(args.out, report)
+        cprint(f"Report saved to: {args.out}", 'green')
@@ -0,0 +1,140 @@
+"""Check the LLM gateway's hedging, retries and failover against local stub servers.
+
+Two mock providers are started: the primary speaks the Anthropic Messages API
+and the backup is reached through its OpenAI-compatible chat completions
+endpoint, so every scenario also crosses providers. Scenarios:
+
+    tail          4% of primary requests take 2 extra seconds, hedging off
+    tail_hedged   the same, with a backup request once the primary passes its p95 latency
+    flaky         30% of primary requests fail with 529 (retried with backoff)
+    primary_down  every primary request fails (the backup answers everything)
+    hang_fail     the primary fails only after the hedge has fired (no retries, slow backup)
+
+Each scenario reports latency percentiles, errors, hedges, retries, failovers,
+circuit-breaker trips and the requests that skipped an open target. The script
+exits with status 1 if hedging does not cut the p99 latency, any request of the
+flaky and primary_down scenarios fails, or the breaker does not stop primary_down
+from spending retries on the dead primary (1.5 calls per request or more), or
+hang_fail sends the backup more than one call per request.
+
+    python benchmark_gateway.py
+    python benchmark_gateway.py --requests 400 --concurrency 16
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from termcolor import cprint
+
+from inference import MAX_TOKENS, MODEL, SYSTEM_PROMPT
+from mock_messages_api import MockMessagesServer
+from common.benchmark import summarize_latencies
+from common.llm_gateway import LLMGateway, Target
+
+QUESTION = "ถ้ามีรายได้ต่อปี ไม่ถึง 500,000 บาท ต้องยื่นภาษีหรือไม่?"
+
+SCENARIOS = {
+    "tail": dict(primary=dict(slow_ratio=0.04, slow_latency=2.0), hedge=False),
+    "tail_hedged": dict(primary=dict(slow_ratio=0.04, slow_latency=2.0), hedge=True),
+    "flaky": dict(primary=dict(fail_ratio=0.3), hedge=True),
+    "primary_down": dict(primary=dict(fail_ratio=1.0), hedge=True),
+    "hang_fail": dict(primary=dict(slow_ratio=1.0, slow_latency=0.2, fail_ratio=1.0), backup=dict(latency=0.6),
+                      hedge=True, gateway=dict(max_attempts=1, hedge_after=0.1)),
+}
+
+
+async def run_scenario(name, args):
+    settings = SCENARIOS[name]
+    with MockMessagesServer(latency=args.latency, output_tokens=200, seed=1, **settings["primary"]) as primary, \
+            MockMessagesServer(**{"latency": args.latency, "output_tokens": 200, "seed": 2,
+                                  **settings.get("backup", {})}) as backup:
+        gateway = LLMGateway(
+            {"chat": [Target("anthropic", MODEL, base_url=primary.url, api_key="mock"),
+                      Target("openai", "gpt-4o-mini", base_url=backup.url + "/v1", api_key="mock")]},
+            base_delay=0.05,
+            hedge_percentile=95.0 if settings["hedge"] else None,
+            **settings.get("gateway", {}),
+        )
+        request = {"system": SYSTEM_PROMPT, "max_tokens": MAX_TOKENS,
+                   "messages": [{"role": "user", "content": [{"type": "text", "text": QUESTION}]}]}
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies, errors, winners = [], 0, {}
+
+        async def one():
+            nonlocal errors
+            async with semaphore:
+                start = time.monotonic()
+                try:
+                    completion = await gateway.complete(request, route="chat")
+                except Exception:
+                    errors += 1
+                    return
+                latencies.append(time.monotonic() - start)
+                winners[completion.winner] = winners.get(completion.winner, 0) + 1
+
+        start = time.monotonic()
+        await asyncio.gather(*(one() for _ in range(args.requests)))
+        wall = time.monotonic() - start
+        await gateway.aclose()
+        stats = gateway.metrics()
+        backup_calls = len(backup.requests)
+    return {"scenario": name, "requests": args.requests, "errors": errors, "wall_seconds": wall,
+            "latency": summarize_latencies(latencies), "winners": winners,
+            "calls_per_request": stats["calls"] / args.requests, "backup_calls": backup_calls,
+            **{key: stats[key] for key in ("hedges", "hedge_wins", "retries", "failovers", "breaker_trips",
+                                           "skipped")}}
+
+
+def print_report(results):
+    cprint(f"\n{'scenario':<13} {'errors':>6} {'p50 s':>6} {'p95 s':>6} {'p99 s':>6} "
+           f"{'calls/req':>9} {'hedges':>6} {'won':>4} {'retries':>7} {'failovers':>9} {'trips':>5} "
+           f"{'skipped':>7}", 'cyan')
+    for r in results:
+        latency = r["latency"]
+        print(f"{r['scenario']:<13} {r['errors']:>6} {latency['p50']:>6.2f} {latency['p95']:>6.2f} "
+              f"{latency['p99']:>6.2f} "
+              f"{r['calls_per_request']:>9.2f} {r['hedges']:>6} {r['hedge_wins']:>4} {r['retries']:>7} "
+              f"{r['failovers']:>9} {r['breaker_trips']:>5} {r['skipped']:>7}")
+
+
+def check(results):
+    """Failed expectations, as messages."""
+    by_name = {r["scenario"]: r for r in results}
+    problems = []
+    if "tail" in by_name and "tail_hedged" in by_name:
+        before, after = by_name["tail"]["latency"]["p99"], by_name["tail_hedged"]["latency"]["p99"]
+        if after > before / 2:
+            problems.append(f"hedging left p99 at {after:.2f}s (unhedged {before:.2f}s)")
+    for name in ("flaky", "primary_down"):
+        if name in by_name and by_name[name]["errors"]:
+            problems.append(f"{name}: {by_name[name]['errors']} requests failed despite the backup provider")
+    if "primary_down" in by_name and by_name["primary_down"]["calls_per_request"] >= 1.5:
+        problems.append(f"primary_down: {by_name['primary_down']['calls_per_request']:.2f} calls per request, "
+                        f"the circuit breaker did not skip the failing primary")
+    if "hang_fail" in by_name and by_name["hang_fail"]["backup_calls"] != by_name["hang_fail"]["requests"]:
+        problems.append(f"hang_fail: the backup got {by_name['hang_fail']['backup_calls']} calls for "
+                        f"{by_name['hang_fail']['requests']} requests (failover repeated the hedge)")
+    return problems
+
+
+async def main(args):
+    return [await run_scenario(name, args) for name in args.scenarios]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.1, help="mock response time (seconds)")
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+    print_report(results)
+    problems = check(results)
+    for problem in problems:
+        cprint(problem, 'red')
+    if not problems:
+        cprint("\nHedging, retries and failover behave as expected", 'green')
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,242 @@
+# Multi-turn chat over the long-context documents with a bounded input per turn
+import asyncio
+import contextvars
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import anthropic
+from termcolor import cprint
+
+from inference import CHARS_PER_TOKEN, MAX_TOKENS, MODEL, SYSTEM_PROMPT, stream_request
+from document_cache import document_cache, usage_report
+from common import tracing
+
+# Input tokens allowed per turn, documents included (the four PDFs are about 13.5k)
+MAX_TURN_INPUT_TOKENS = 20000
+DOCUMENT_TOKENS = 13500
+# Verbatim history beyond this many tokens is folded into the running summary
+SUMMARIZE_AFTER_TOKENS = 6000
+KEEP_RECENT_TURNS = 1
+SUMMARY_MAX_TOKENS = 600
+# Cache breakpoints on the latest assistant turns (the documents use one more; the API allows four)
+HISTORY_BREAKPOINTS = 2
+
+SUMMARY_PROMPT = ("You summarize a conversation between a user and a Thai tax expert so it can continue "
+                  "without the full transcript. Keep the user's situation (income, family, deductions), "
+                  "what they asked and the facts, figures and conclusions given. Write in Thai, at most 300 words.")
+SUMMARY_HEADING = "Summary of the earlier conversation:"
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+@dataclass
+class ChatSession:
+    session_id: str
+    summary: str = ""
+    turns: List[Tuple[str, str]] = field(default_factory=list)  # (question, answer) not yet in the summary
+    summarized_turns: int = 0
+    last_used: float = field(default_factory=time.monotonic)
+    summarizing: Optional[asyncio.Task] = None
+
+    @property
+    def turn_count(self) -> int:
+        return self.summarized_turns + len(self.turns)
+
+    def size_bytes(self) -> int:
+        return len(self.summary.encode("utf-8")) + sum(
+            len(question.encode("utf-8")) + len(answer.encode("utf-8")) for question, answer in self.turns)
+
+
+class SessionStore:
+    """In-memory sessions; the least recently used go first beyond *max_sessions* or after *idle_seconds*.
+
+    A session holds only its running summary and the turns not folded into it yet,
+    so its size stays bounded however long the conversation gets.
+    """
+
+    def __init__(self, max_sessions: int = 1000, idle_seconds: float = 3600):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, session_id: str) -> ChatSession:
+        """The session for *session_id*, created if it is new or was evicted."""
+        self._evict_idle()
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = ChatSession(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._discard(self._sessions.popitem(last=False)[1])
+        else:
+            self._sessions.move_to_end(session_id)
+        session.last_used = time.monotonic()
+        return session
+
+    def reset(self, session_id: str) -> None:
+        session = self._sessions.pop(session_id, None)
+        if session is not None and session.summarizing is not None:
+            session.summarizing.cancel()
+
+    def sessions(self) -> List[ChatSession]:
+        return list(self._sessions.values())
+
+    def size_bytes(self) -> int:
+        return sum(session.size_bytes() for session in self._sessions.values())
+
+    def _evict_idle(self) -> None:
+        now = time.monotonic()
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if now - oldest.last_used < self.idle_seconds:
+                break
+            self._discard(self._sessions.popitem(last=False)[1])
+
+    def _discard(self, session: ChatSession) -> None:
+        self.evicted += 1
+        if session.summarizing is not None:
+            session.summarizing.cancel()
+
+
+class ChatSessions:
+    """Session-aware long-context chat.
+
+    Every turn sends the cached document prefix, the running summary of older
+    turns, the recent turns verbatim and the new question. Once the verbatim
+    turns pass *summarize_after_tokens*, all but the last *keep_recent_turns* are
+    folded into the summary by a background LLM call that the next turn does not
+    wait for. Requests are capped at *max_input_tokens*: while the summary has
+    not caught up, the oldest verbatim turns are left out of the prompt. The
+    latest assistant turns carry cache breakpoints, so earlier turns are read
+    from the prompt cache instead of being paid for again.
+
+    ``None`` for *summarize_after_tokens* or *max_input_tokens* and
+    ``cache_history=False`` give plain history re-sending, for comparison.
+    """
+
+    def __init__(self, client, store: Optional[SessionStore] = None,
+                 max_input_tokens: Optional[int] = MAX_TURN_INPUT_TOKENS,
+                 summarize_after_tokens: Optional[int] = SUMMARIZE_AFTER_TOKENS,
+                 keep_recent_turns: int = KEEP_RECENT_TURNS, cache_history: bool = True):
+        self.client = client
+        self.store = store if store is not None else SessionStore()
+        self.max_input_tokens = max_input_tokens
+        self.summarize_after_tokens = summarize_after_tokens
+        self.keep_recent_turns = keep_recent_turns
+        self.cache_history = cache_history
+        # Learned from the first turn of a session: documents plus system prompt
+        self.document_tokens = DOCUMENT_TOKENS
+        self.stats = {"turns": 0, "dropped_turns": 0, "summaries": 0, "summary_errors": 0,
+                      "summary_input_tokens": 0, "summary_output_tokens": 0, "summary_cost": 0.0}
+
+    def build_request(self, session: ChatSession, question: str):
+        """Keyword arguments for the next turn of *session*, whether the documents were reused and what was sent."""
+        _, documents, documents_reused = document_cache.get_blocks()
+        summary_block = [{"type": "text", "text": f"{SUMMARY_HEADING}\n{session.summary}"}] if session.summary else []
+
+        turns = session.turns
+        if self.max_input_tokens is not None:
+            used = self.document_tokens + estimate_tokens(question) + estimate_tokens(session.summary)
+            kept = 0
+            for past_question, answer in reversed(turns):
+                used += estimate_tokens(past_question) + estimate_tokens(answer)
+                if used > self.max_input_tokens:
+                    break
+                kept += 1
+            turns = turns[len(turns) - kept:]
+
+        messages = []
+        lead = list(documents) + summary_block
+        for past_question, answer in turns:
+            messages.append({"role": "user", "content": lead + [{"type": "text", "text": past_question}]})
+            messages.append({"role": "assistant", "content": [{"type": "text", "text": answer}]})
+            lead = []
+        messages.append({"role": "user", "content": lead + [{"type": "text", "text": question}]})
+
+        if self.cache_history:
+            for message in messages[-2::-2][:HISTORY_BREAKPOINTS]:
+                message["content"][-1]["cache_control"] = {"type": "ephemeral"}
+
+        request = {"model": MODEL, "max_tokens": MAX_TOKENS, "system": SYSTEM_PROMPT, "messages": messages}
+        sent = {"history_turns": len(turns), "dropped_turns": len(session.turns) - len(turns),
+                "summarized_turns": session.summarized_turns, "summary": bool(session.summary)}
+        return request, documents_reused, sent
+
+    async def stream(self, session_id: str, question: str):
+        """Answer the next turn of the session like ``inference.stream_answer``; the final update adds ``session``."""
+        start_time = time.time()
+        session = self.store.get(session_id)
+        with tracing.span("prompt_build") as attributes:
+            request, documents_reused, sent = self.build_request(session, question)
+            attributes.update(sent)
+
+        async for update in stream_request(request, self.client, start_time):
+            if update["done"]:
+                session.turns.append((question, update["text"]))
+                self.stats["turns"] += 1
+                self.stats["dropped_turns"] += sent["dropped_turns"]
+                if not sent["history_turns"] and not sent["summary"]:
+                    self.document_tokens = update["usage"]["total_input_tokens"] - estimate_tokens(question)
+                self._maybe_summarize(session)
+                update.update(documents_reused=documents_reused,
+                              session=dict(sent, turn=session.turn_count, summarizing=session.summarizing is not None))
+            yield update
+
+    def reset(self, session_id: str) -> None:
+        self.store.reset(session_id)
+
+    async def wait_for_summaries(self) -> None:
+        """Wait until no session has a summary in progress."""
+        pending = [session.summarizing for session in self.store.sessions() if session.summarizing is not None]
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def metrics(self) -> Dict[str, object]:
+        return dict(self.stats, sessions=len(self.store), evicted_sessions=self.store.evicted,
+                    state_bytes=self.store.size_bytes())
+
+    def _maybe_summarize(self, session: ChatSession) -> None:
+        if self.summarize_after_tokens is None or session.summarizing is not None:
+            return
+        if len(session.turns) <= self.keep_recent_turns:
+            return
+        history_tokens = sum(estimate_tokens(q) + estimate_tokens(a) for q, a in session.turns)
+        if history_tokens < self.summarize_after_tokens:
+            return
+        count = len(session.turns) - self.keep_recent_turns
+        # A fresh context so the summary is not recorded in the finished request's trace
+        session.summarizing = asyncio.create_task(self._summarize(session, count), context=contextvars.Context())
+
+    async def _summarize(self, session: ChatSession, count: int) -> None:
+        """Fold the oldest *count* verbatim turns of *session* into its summary."""
+        transcript = "\n\n".join(f"ผู้ใช้: {question}\nผู้ช่วย: {answer}" for question, answer in session.turns[:count])
+        content = f"Summary so far:\n{session.summary}\n\nNew turns:\n{transcript}" if session.summary else transcript
+        try:
+            message = await self.client.messages.create(
+                model=MODEL,
+                max_tokens=SUMMARY_MAX_TOKENS,
+                system=SUMMARY_PROMPT,
+                messages=[{"role": "user", "content": content}],
+            )
+            usage = usage_report(message.usage)
+            session.summary = message.content[0].text
+            del session.turns[:count]
+            session.summarized_turns += count
+            self.stats["summaries"] += 1
+            self.stats["summary_input_tokens"] += usage["total_input_tokens"]
+            self.stats["summary_output_tokens"] += usage["output_tokens"]
+            self.stats["summary_cost"] += usage["cost"]
+        except anthropic.APIError as e:
+            # The turns stay verbatim (the input cap still applies) and the next turn retries
+            self.stats["summary_errors"] += 1
+            cprint(f"Summarizing session {session.session_id} failed: {type(e).__name__}: {e}", 'red')
+        finally:
+            session.summarizing = None
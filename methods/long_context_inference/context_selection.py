@@ -0,0 +1,234 @@
+# Budgeted context selection: send the relevant sections of the documents instead of the whole PDFs
+import glob
+import math
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence
+
+from common.lexical_index import BM25Index, thai_tokens
+from common.semantic_cache import REPO_ROOT, SourceFingerprint
+from common.tracing import span
+
+# Text of the long-context documents: the OCR output plus the text layer of taxInformation.pdf
+TEXT_SOURCES = sorted(glob.glob(os.path.join(REPO_ROOT, "data_preprocess", "ocr", "results", "*.txt")))
+
+# Rough Thai characters per token (as in inference.CHARS_PER_TOKEN)
+CHARS_PER_TOKEN = 2.5
+
+_QUESTION_LABEL_RE = re.compile(r"^\s*คำถาม\s*:")
+_BOLD_RE = re.compile(r"^\s*\*\*(.+?)\*\*\s*$")
+_MARKDOWN_HEADING_RE = re.compile(r"^\s*#+\s+(.+)$")
+_ITEM_NUMBER_RE = re.compile(r"^\s*(\(?\d+(\.\d+)*[.)]|\([ก-ฮ]\))\s*")
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _heading(line: str) -> Optional[str]:
+    """The heading text if *line* is a section heading: a question, a bold line or a markdown heading."""
+    line = line.strip()
+    if _QUESTION_LABEL_RE.match(line):
+        return line
+    match = _BOLD_RE.match(line) or _MARKDOWN_HEADING_RE.match(line)
+    if match:
+        return match.group(1).strip()
+    if line.endswith("?") and len(line) <= 200:
+        return line
+    return None
+
+
+def _split_long_line(line: str, max_tokens: int) -> List[str]:
+    """Break a line longer than *max_tokens* at spaces (Thai separates phrases, not words)."""
+    max_chars = int(max_tokens * CHARS_PER_TOKEN)
+    pieces, current = [], ""
+    for phrase in re.split(r"(?<=\s)", line):
+        if current and len(current) + len(phrase) > max_chars:
+            pieces.append(current.rstrip())
+            current = ""
+        current += phrase
+    if current.strip():
+        pieces.append(current.rstrip())
+    return pieces
+
+
+@dataclass
+class Section:
+    id: str
+    source: str
+    title: str
+    text: str
+    tokens: int
+
+
+def split_sections(text: str, source: str, max_tokens: int = 350) -> List[Section]:
+    """Split document text into titled sections of at most about *max_tokens* tokens.
+
+    A heading line starts a new section, and its title is repeated on the parts
+    of a section that had to be split at line boundaries. Lines that repeat an
+    earlier one up to their item number (OCR sometimes loops on a list) are
+    dropped.
+    """
+    sections, seen = [], set()
+    title, body = "", []
+
+    def flush():
+        joined = "\n".join(body).strip()
+        if joined:
+            sections.append(Section(f"{source}:{len(sections)}", source, title, joined,
+                                    estimate_tokens(title) + estimate_tokens(joined)))
+        body.clear()
+
+    for line in text.splitlines():
+        heading = _heading(line)
+        if heading is not None:
+            flush()
+            title = heading
+            continue
+        key = _ITEM_NUMBER_RE.sub("", re.sub(r"\s+", " ", line)).strip()
+        if len(key) >= 30:
+            if key in seen:
+                continue
+            seen.add(key)
+        for piece in _split_long_line(line, max_tokens):
+            if body and estimate_tokens("\n".join(body + [piece])) > max_tokens:
+                flush()
+            body.append(piece)
+    flush()
+    return sections
+
+
+@dataclass
+class Selection:
+    sections: List[Section]
+    tokens: int
+    top_score: float
+    coverage: float  # share of the question's terms found in the selected sections
+    score_share: float  # share of the relevant sections' BM25 score that fit in the budget
+    fallback: bool
+    reason: str = ""
+    scores: List[float] = field(default_factory=list)
+
+    @property
+    def text(self) -> str:
+        """Selected sections in document order, grouped per source document."""
+        parts, source = [], None
+        for section in self.sections:
+            if section.source != source:
+                if source is not None:
+                    parts.append("</document>")
+                source = section.source
+                parts.append(f'<document source="{source}">')
+            parts.append(f"## {section.title}\n{section.text}" if section.title else section.text)
+        if source is not None:
+            parts.append("</document>")
+        return "\n\n".join(parts)
+
+
+class ContextSelector:
+    """Picks the sections of the document text most relevant to a question, under a token budget.
+
+    Sections are ranked with BM25 over newmm tokens and added best first while
+    they fit in the budget and score at least *min_relative_score* of the best
+    one. Selection is declared unreliable, and the caller should send the full
+    documents, when the best score is below *min_score*, the selected sections
+    contain less than *min_coverage* of the question's terms, or the budget
+    keeps less than *min_score_share* of the summed score of the sections above
+    the relative cutoff (the answer is spread over more text than fits). The
+    index is built on first use and rebuilt when a source file changes.
+
+    *min_score_share* is calibrated on ``testset/tax-test-set.json``. Coverage is
+    100% on nearly every question and the best score does not separate good
+    selections from bad ones. The kept score share is 0.43-0.60 on the three
+    questions whose selection at 4000 tokens loses a quarter or more of the
+    golden answer's terms, and 0.62 or more on all but one of the others.
+    Selection only pays off while the prompt cache is cold. Once the PDFs are
+    cached, full mode is cheaper and faster per question (see
+    ``benchmark_context_selection.py``).
+    """
+
+    def __init__(self, sources: Sequence[str] = TEXT_SOURCES, max_section_tokens: int = 350,
+                 min_score: float = 3.0, min_coverage: float = 0.6, min_relative_score: float = 0.25,
+                 min_score_share: float = 0.62):
+        self.sources = list(sources)
+        self.max_section_tokens = max_section_tokens
+        self.min_score = min_score
+        self.min_coverage = min_coverage
+        self.min_relative_score = min_relative_score
+        self.min_score_share = min_score_share
+        self.fingerprint = SourceFingerprint(self.sources)
+        self._source_hash = None
+        self._sections: List[Section] = []
+        self._terms: List[set] = []
+        self._index: Optional[BM25Index] = None
+        self._lock = threading.Lock()
+        self.stats = {"selections": 0, "fallbacks": 0}
+
+    def _ensure_index(self) -> None:
+        with self._lock:
+            source_hash = self.fingerprint.current()
+            if self._index is not None and source_hash == self._source_hash:
+                return
+            sections = []
+            for path in self.sources:
+                with open(path, "r", encoding="utf-8") as f:
+                    sections.extend(split_sections(f.read(), os.path.basename(path), self.max_section_tokens))
+            records = [{"id": s.id, "text": f"{s.title}\n{s.text}"} for s in sections]
+            self._index = BM25Index.build(records, text_fn=lambda record: record["text"])
+            self._terms = [set(thai_tokens(record["text"])) for record in records]
+            self._sections = sections
+            self._source_hash = source_hash
+
+    @property
+    def sections(self) -> List[Section]:
+        self._ensure_index()
+        return self._sections
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(section.tokens for section in self.sections)
+
+    def select(self, question: str, budget: int = 4000) -> Selection:
+        """Sections for *question* within *budget* tokens; ``fallback`` says to send the full documents."""
+        with span("context_selection", budget=budget) as attributes:
+            self._ensure_index()
+            scores, rows = self._index.search(question, top_k=len(self._sections))
+            chosen, used, relevant, kept = [], 0, 0.0, 0.0
+            for score, row in zip(scores, rows):
+                if score < self.min_relative_score * scores[0]:
+                    break
+                relevant += score
+                section = self._sections[row]
+                if used + section.tokens <= budget:
+                    chosen.append(row)
+                    used += section.tokens
+                    kept += score
+
+            terms = set(thai_tokens(question))
+            covered = set().union(*(self._terms[row] for row in chosen)) if chosen else set()
+            coverage = len(terms & covered) / len(terms) if terms else 0.0
+            top_score = float(scores[0]) if len(scores) else 0.0
+            score_share = kept / relevant if relevant else 0.0
+            reason = ""
+            if top_score < self.min_score:
+                reason = f"best section scores {top_score:.2f} < {self.min_score}"
+            elif coverage < self.min_coverage:
+                reason = f"selected sections cover {coverage:.0%} of the question's terms"
+            elif score_share < self.min_score_share:
+                reason = f"the budget keeps {score_share:.0%} of the relevant sections' score"
+
+            selection = Selection(
+                sections=[self._sections[row] for row in sorted(chosen)], tokens=used, top_score=top_score,
+                coverage=coverage, score_share=score_share, fallback=bool(reason), reason=reason,
+                scores=[float(score) for score, row in zip(scores, rows) if row in chosen],
+            )
+            self.stats["selections"] += 1
+            self.stats["fallbacks"] += selection.fallback
+            attributes.update(sections=len(chosen), tokens=used, fallback=selection.fallback)
+        return selection
+
+
+# Shared instance used by inference.py
+context_selector = ContextSelector()
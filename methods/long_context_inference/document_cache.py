@@ -0,0 +1,158 @@
+# https://docs.anthropic.com/en/docs/build-with-claude/prompt-caching
+import base64
+import hashlib
+import os
+import threading
+
+from common.tracing import span
+
+# The four documents every long-context question is answered against.
+# URL documents are fetched by the API; local files are sent inline as base64.
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DOCUMENT_SOURCES = [
+    {"type": "url", "url": "https://www.rd.go.th/fileadmin/user_upload/borkor/tax121260.pdf"},
+    {"type": "url", "url": "https://www.rd.go.th/fileadmin/user_upload/borkor/taxreturn23072567.pdf"},
+    {"type": "url", "url": "https://www.rd.go.th/fileadmin/download/tax_deductions_update280168.pdf"},
+    {"type": "file", "path": os.path.join(BASE_DIR, "raw_data", "taxInformation.pdf")},
+]
+
+# Claude 3.7 Sonnet pricing (USD per token)
+INPUT_PRICE = 0.000003
+OUTPUT_PRICE = 0.000015
+CACHE_WRITE_PRICE = INPUT_PRICE * 1.25
+CACHE_READ_PRICE = INPUT_PRICE * 0.1
+
+
+class DocumentCache:
+    """Builds the document content blocks once per content hash and keeps them in memory.
+
+    The last document block carries ``cache_control`` so the API caches the whole
+    shared prefix (system prompt + documents) and repeat questions read it back
+    at the cache price instead of paying for it again.
+    """
+
+    def __init__(self, sources=None, cache_prefix=True):
+        self.sources = sources if sources is not None else DOCUMENT_SOURCES
+        self.cache_prefix = cache_prefix
+        self._blocks = {}  # content hash -> list of content blocks
+        self._file_hashes = {}  # path -> ((mtime, size), sha256, raw bytes)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _read_file(self, path):
+        """Return (sha256, raw bytes) for a local file, re-reading only when it changed on disk."""
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self._file_hashes.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1], cached[2]
+
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        self._file_hashes[path] = (signature, digest, data)
+        return digest, data
+
+    def content_hash(self):
+        """Hash of every source: URLs by value, local files by content."""
+        hasher = hashlib.sha256()
+        hasher.update(str(self.cache_prefix).encode("utf-8"))
+        for source in self.sources:
+            if source["type"] == "url":
+                hasher.update(b"url:" + source["url"].encode("utf-8"))
+            else:
+                digest, _ = self._read_file(source["path"])
+                hasher.update(b"file:" + digest.encode("utf-8"))
+        return hasher.hexdigest()
+
+    def _build_blocks(self):
+        blocks = []
+        for source in self.sources:
+            if source["type"] == "url":
+                blocks.append({
+                    "type": "document",
+                    "source": {"type": "url", "url": source["url"]},
+                })
+            else:
+                _, data = self._read_file(source["path"])
+                blocks.append({
+                    "type": "document",
+                    "source": {
+                        "type": "base64",
+                        "media_type": "application/pdf",
+                        "data": base64.standard_b64encode(data).decode("utf-8"),
+                    },
+                })
+
+        # Breakpoint on the last document caches everything before the question
+        if self.cache_prefix and blocks:
+            blocks[-1]["cache_control"] = {"type": "ephemeral"}
+        return blocks
+
+    def get_blocks(self):
+        """Return (content hash, document blocks, hit) for the current sources.
+
+        The returned list is shared between callers; copy it before mutating.
+        """
+        with self._lock, span("pdf_load") as attributes:
+            key = self.content_hash()
+            blocks = self._blocks.get(key)
+            attributes["cached"] = blocks is not None
+            if blocks is not None:
+                self.hits += 1
+                return key, blocks, True
+
+            blocks = self._build_blocks()
+            # Sources changed on disk: drop stale builds so memory stays bounded
+            self._blocks.clear()
+            self._blocks[key] = blocks
+            self.misses += 1
+            return key, blocks, False
+
+    def build_content(self, question):
+        """User message content: the shared document prefix followed by the question."""
+        _, blocks, hit = self.get_blocks()
+        return list(blocks) + [{"type": "text", "text": question}], hit
+
+
+# Shared instance used by inference.py and inference_gradio.py
+document_cache = DocumentCache()
+
+
+def usage_report(usage):
+    """Summarise an API ``usage`` object: tokens, prompt-cache status, cost and savings.
+
+    ``input_tokens`` from the API excludes cached tokens, so the uncached cost
+    of the same request is what every prefix token would have cost at full price.
+    """
+    input_tokens = usage.input_tokens
+    output_tokens = usage.output_tokens
+    cache_write = getattr(usage, "cache_creation_input_tokens", None) or 0
+    cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+
+    if cache_read:
+        cache_status = "hit"
+    elif cache_write:
+        cache_status = "miss"
+    else:
+        cache_status = "none"
+
+    cost = (input_tokens * INPUT_PRICE
+            + cache_write * CACHE_WRITE_PRICE
+            + cache_read * CACHE_READ_PRICE
+            + output_tokens * OUTPUT_PRICE)
+    uncached_cost = (input_tokens + cache_write + cache_read) * INPUT_PRICE + output_tokens * OUTPUT_PRICE
+
+    return {
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "cache_creation_input_tokens": cache_write,
+        "cache_read_input_tokens": cache_read,
+        "total_input_tokens": input_tokens + cache_write + cache_read,
+        "cache_status": cache_status,
+        "tokens_saved": cache_read,
+        "cost": cost,
+        "cost_saved": uncached_cost - cost,
+    }
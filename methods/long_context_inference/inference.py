@@ -1,211 +1,397 @@
 # https://docs.anthropic.com/en/docs/build-with-claude/pdf-support#option-1-url-based-pdf-document
 import anthropic
 from termcolor import cprint
+import asyncio
 import json
 import time
 import os
-import base64
-import random
-import math
+import sys
+from dataclasses import replace
 
 from dotenv import load_dotenv
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if REPO_ROOT not in sys.path:
+    sys.path.append(REPO_ROOT)
+
+from common import tracing
+from common.llm_gateway import Target, gateway
+from common.rate_limiter import RateLimiter
+from common.result_journal import ResultJournal, journal_path_for
+from context_selection import context_selector
+from document_cache import document_cache, usage_report
+
 load_dotenv()
 
-# Function to process a question and return Claude's response with retry logic
-def process_question(question):
-    client = anthropic.Anthropic(api_key=os.environ["ANTHROPIC_API_KEY"])
+SYSTEM_PROMPT = "You are a tax expert. Answer the user's question based on the documents provided, answer in Thai with suitable length"
+
+MODEL = "claude-3-7-sonnet-20250219"
+MAX_TOKENS = 2500
+
+# Gateway route for answers: slow requests are hedged on, and failed ones moved to, the backup model.
+# With OPENROUTER_API_KEY set, the route ends with the same model through OpenRouter, so an Anthropic
+# API outage fails over to a second provider; without it failover is between Anthropic models only
+LONG_CONTEXT_ROUTE = "long_context"
+BACKUP_MODEL = os.getenv("LONG_CONTEXT_BACKUP_MODEL", "claude-3-5-sonnet-20241022")
+FAILOVER_MODEL = os.getenv("LONG_CONTEXT_FAILOVER_MODEL", "anthropic/claude-3.7-sonnet")
+gateway.add_route(LONG_CONTEXT_ROUTE, [Target("anthropic", MODEL), Target("anthropic", BACKUP_MODEL)] + (
+    [Target("openrouter", FAILOVER_MODEL)] if os.getenv("OPENROUTER_API_KEY") else []))
+
+# Budgets for the concurrent batch runner (Anthropic tier 1 limits for Claude 3.7 Sonnet);
+# the limiter adopts the real limits from the response headers once requests succeed
+REQUESTS_PER_MINUTE = 50
+INPUT_TOKENS_PER_MINUTE = 20000
+OUTPUT_TOKENS_PER_MINUTE = 8000
+MAX_CONCURRENCY = 8
+
+# "full" attaches the whole PDFs; "select" sends only the OCR text sections relevant to the
+# question, within CONTEXT_TOKEN_BUDGET tokens, and falls back to the PDFs when unsure
+CONTEXT_MODE = os.getenv("CONTEXT_MODE", "full")
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 4000))
+
+def build_request(question, context_mode=None):
+    """Keyword arguments for ``messages.create``, whether the document blocks were reused and the context used."""
+    context_mode = context_mode or CONTEXT_MODE
+    context = {"context_mode": "full"}
+    if context_mode == "select":
+        selection = context_selector.select(question, CONTEXT_TOKEN_BUDGET)
+        context.update(context_fallback=selection.fallback, context_tokens=selection.tokens)
+        if not selection.fallback:
+            context.update(context_mode="select", context_sections=len(selection.sections))
+            content = [{"type": "text", "text": selection.text}, {"type": "text", "text": question}]
+            return request_for(content), False, context
+        cprint(f"Context selection unsure ({selection.reason}), sending the full documents", 'yellow')
+    elif context_mode != "full":
+        raise ValueError(f"Unknown context mode: {context_mode!r}")
     
-    # Load from a local file
-    with open("./raw_data/taxInformation.pdf", "rb") as f:
-        pdf_data_local = base64.standard_b64encode(f.read()).decode("utf-8")
+    # Document blocks are built once per content hash and reused across questions
+    content, documents_reused = document_cache.build_content(question)
+    return request_for(content), documents_reused, context
+
+def request_for(content):
+    return {
+        "model": MODEL,
+        "max_tokens": MAX_TOKENS,
+        "system": SYSTEM_PROMPT,
+        "messages": [
+            {
+                "role": "user",
+                "content": content
+            }
+        ],
+    }
+
+def summarize_message(question, text, usage, time_taken, attempt, documents_reused, context=None, target=None):
+    """Log a successful response and return the per-question result dict."""
+    usage = usage_report(usage)
     
-    # Retry parameters
-    max_retries = 5
-    base_delay = 60  # Start with 60 seconds delay after a rate limit
+    # Log information about the response
+    cprint(f"Successfully processed: {question}" + (f" (answered by {target})" if target else ""), 'cyan')
+    cprint(text[:200] + "...", 'magenta')  # Print just first part of the response
+    cprint(f"Input token: {usage['total_input_tokens']} "
+           f"(cache write: {usage['cache_creation_input_tokens']}, cache read: {usage['cache_read_input_tokens']})", 'green')
+    cprint(f"Output token: {usage['output_tokens']}", 'green')
+    cprint(f"Prompt cache: {usage['cache_status']}, documents reused: {documents_reused}, "
+           f"tokens saved: {usage['tokens_saved']}", 'green')
+    if context and context["context_mode"] == "select":
+        cprint(f"Context: {context['context_sections']} selected sections, ~{context['context_tokens']} tokens", 'green')
+    cprint(f"Cost used: {usage['cost']:.2f} dollars (saved {usage['cost_saved']:.2f})", 'red')
+    cprint(f"Time taken: {time_taken:.2f} seconds", 'yellow')
     
-    for attempt in range(1, max_retries + 1):
-        try:
-            initial_time = time.time()
-            cprint(f"Attempt {attempt}/{max_retries} for question: {question[:50]}...", 'cyan')
-            
-            message = client.messages.create(
-                model="claude-3-7-sonnet-20250219",
-                max_tokens=2500,
-                system="You are a tax expert. Answer the user's question based on the documents provided, answer in Thai with suitable length",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "document",
-                                "source": {
-                                    "type": "url",
-                                    "url": "https://www.rd.go.th/fileadmin/user_upload/borkor/tax121260.pdf"
-                                }
-                            },
-                            {
-                                "type": "document",
-                                "source": {
-                                    "type": "url",
-                                    "url": "https://www.rd.go.th/fileadmin/user_upload/borkor/taxreturn23072567.pdf"
-                                }
-                            },
-                            {
-                                "type": "document",
-                                "source": {
-                                    "type": "url",
-                                    "url": "https://www.rd.go.th/fileadmin/download/tax_deductions_update280168.pdf"
-                                }
-                            },
-                            {
-                                "type": "document",
-                                "source": {
-                                    "type": "base64",
-                                    "media_type": "application/pdf",
-                                    "data": pdf_data_local
-                                }
-                            },
-                            {
-                                "type": "text",
-                                "text": question
-                            }
-                        ]
-                    }
-                ],
-            )
-            time_taken = time.time() - initial_time
-            
-            # Log information about the response
-            cprint(f"Successfully processed: {question}", 'cyan')
-            cprint(message.content[0].text[:200] + "...", 'magenta')  # Print just first part of the response
-            cprint(f"Input token: {message.usage.input_tokens}", 'green')
-            cprint(f"Output token: {message.usage.output_tokens}", 'green')
-            cprint(f"Cost used: {(message.usage.input_tokens*0.000003)+ (message.usage.output_tokens*0.000015):.2f} dollars", 'red')
-            cprint(f"Time taken: {time_taken:.2f} seconds", 'yellow')
+    return {
+        "answer": text,
+        "input_tokens": usage["total_input_tokens"],
+        "output_tokens": usage["output_tokens"],
+        "cache_creation_input_tokens": usage["cache_creation_input_tokens"],
+        "cache_read_input_tokens": usage["cache_read_input_tokens"],
+        "cache_status": usage["cache_status"],
+        "documents_reused": documents_reused,
+        "tokens_saved": usage["tokens_saved"],
+        "cost": usage["cost"],
+        "cost_saved": usage["cost_saved"],
+        "time_taken": time_taken,
+        "attempts": attempt,
+        **({"target": target} if target else {}),
+        **(context or {}),
+    }
+
+# Function to process a question and return Claude's response; the gateway retries with backoff,
+# hedges slow requests and fails over to the backup model
+def process_question(question, route=LONG_CONTEXT_ROUTE, context_mode=None):
+    request, documents_reused, context = build_request(question, context_mode)
+    cprint(f"Processing question: {question[:50]}...", 'cyan')
+    
+    try:
+        completion = gateway.complete_sync(request, route)
+    except Exception as e:
+        cprint(f"Error: {type(e).__name__}: {str(e)}", 'red')
+        raise
+    
+    return summarize_message(question, completion.text, completion.usage, completion.latency, completion.attempts,
+                             documents_reused, context, completion.target)
+
+def route_for(client):
+    """The answer route's Anthropic targets pointed at *client*'s endpoint, so fallbacks reach the same server."""
+    route = f"{LONG_CONTEXT_ROUTE}@{client.base_url}"
+    if route not in gateway.routes:
+        gateway.add_route(route, [replace(target, base_url=str(client.base_url), api_key=client.api_key)
+                                  for target in gateway.routes[LONG_CONTEXT_ROUTE] if target.provider == "anthropic"])
+    return route
+
+# Rough Thai characters per token, only used for the live tokens/second estimate while streaming
+CHARS_PER_TOKEN = 2.5
+
+# Async streaming answer used by the serving path: yields progress updates as tokens arrive
+async def stream_answer(question, client, context_mode=None):
+    """Yield dicts with the partial ``text`` and live timings; the last one has ``done`` and ``usage``."""
+    start_time = time.time()
+    with tracing.span("prompt_build"):
+        request, documents_reused, context = build_request(question, context_mode)
+    
+    async for update in stream_request(request, client, start_time):
+        if update["done"]:
+            update.update(documents_reused=documents_reused, **context)
+        yield update
+
+async def stream_request(request, client, start_time):
+    """Stream one ``messages.create`` request as the updates of :func:`stream_answer`, timed from *start_time*."""
+    partial_text = ""
+    first_token_time = None
+    sent_time = time.time()
+    async with client.messages.stream(**request) as stream:
+        async for text in stream.text_stream:
+            now = time.time()
+            if first_token_time is None:
+                first_token_time = now
+            partial_text += text
             
-            return {
-                "answer": message.content[0].text,
-                "input_tokens": message.usage.input_tokens,
-                "output_tokens": message.usage.output_tokens,
-                "cost": (message.usage.input_tokens*0.000003) + (message.usage.output_tokens*0.000015),
-                "time_taken": time_taken,
-                "attempts": attempt
+            generation_time = now - first_token_time
+            yield {
+                "text": partial_text,
+                "done": False,
+                "elapsed": now - start_time,
+                "time_to_first_token": first_token_time - start_time,
+                "tokens_per_second": len(partial_text) / CHARS_PER_TOKEN / generation_time if generation_time > 0 else None,
             }
-            
+        message = await stream.get_final_message()
+    
+    # Final update uses the assembled message so the text matches a non-streamed call exactly
+    end_time = time.time()
+    usage = usage_report(message.usage)
+    if first_token_time is None:
+        first_token_time = end_time
+    trace = tracing.current_trace()
+    if trace is not None:
+        trace.add_span("network_wait", sent_time, first_token_time)
+        trace.add_span("generation", first_token_time, end_time, output_tokens=usage["output_tokens"])
+    yield {
+        "text": message.content[0].text,
+        "done": True,
+        "elapsed": end_time - start_time,
+        "time_to_first_token": first_token_time - start_time,
+        "tokens_per_second": usage["output_tokens"] / max(end_time - first_token_time, 1e-6),
+        "usage": usage,
+    }
+
+# Serving-path wrapper: answer from the semantic cache when a (near-)identical question was seen
+async def cached_stream_answer(question, client, cache):
+    start_time = time.time()
+    with tracing.span("answer_cache") as attributes:
+        hit, vector = await asyncio.to_thread(cache.lookup_with_vector, question)
+        attributes["hit"] = hit is not None
+    if hit is not None:
+        yield {
+            "text": hit["answer"],
+            "done": True,
+            "elapsed": time.time() - start_time,
+            "time_to_first_token": time.time() - start_time,
+            "tokens_per_second": None,
+            "cache": hit,
+        }
+        return
+    
+    async for update in stream_answer(question, client):
+        if update["done"]:
+            await asyncio.to_thread(cache.store, question, update["text"], update["elapsed"],
+                                    {"cost": update["usage"]["cost"]}, vector)
+        yield update
+
+# Rate-limited async variant of process_question used by the batch runner
+async def process_question_async(question, client, limiter, max_attempts=3, context_mode=None):
+    request, documents_reused, context = build_request(question, context_mode)
+    
+    for attempt in range(1, max_attempts + 1):
+        # Reserve the expected uncached input and the worst-case output before sending
+        reserved_input = int(limiter.input_estimate)
+        await limiter.acquire(reserved_input, MAX_TOKENS)
+        
+        try:
+            initial_time = time.time()
+            cprint(f"Attempt {attempt}/{max_attempts} for question: {question[:50]}...", 'cyan')
+            raw = await client.messages.with_raw_response.create(**request)
         except anthropic.RateLimitError as e:
-            if attempt == max_retries:
-                cprint(f"Failed after {max_retries} attempts due to rate limits. Giving up.", 'red')
-                raise
-            
-            # Calculate delay with exponential backoff and jitter
-            delay = base_delay * (2 ** (attempt - 1)) + random.uniform(0, 10)
-            cprint(f"Rate limit hit. Waiting for {delay:.1f} seconds before retry {attempt+1}/{max_retries}...", 'yellow')
-            time.sleep(delay)
-            
-        except Exception as e:
+            # Nothing was generated, so the whole token reservation goes back to the budget
+            limiter.reconcile(reserved_input, MAX_TOKENS, 0, 0)
+            delay = limiter.on_rate_limited(e.response.headers)
+            cprint(f"Rate limit hit. Pausing all workers for {delay:.1f} seconds...", 'yellow')
+            continue
+        except anthropic.APIError as e:
+            limiter.reconcile(reserved_input, MAX_TOKENS, 0, 0)
             cprint(f"Error: {type(e).__name__}: {str(e)}", 'red')
-            if attempt == max_retries:
-                cprint(f"Failed after {max_retries} attempts. Giving up.", 'red')
-                raise
-            
-            # For other errors, wait a bit before retrying but with less backoff
-            delay = 5 * attempt
-            cprint(f"Waiting for {delay} seconds before retry...", 'yellow')
-            time.sleep(delay)
+            break
+        
+        message = raw.parse()
+        time_taken = time.time() - initial_time
+        result = summarize_message(question, message.content[0].text, message.usage, time_taken, attempt,
+                                   documents_reused, context)
+        
+        # Cache reads do not count against the input-token limit
+        uncached_input = result["input_tokens"] - result["cache_read_input_tokens"]
+        limiter.reconcile(reserved_input, MAX_TOKENS, uncached_input, result["output_tokens"])
+        limiter.observe_input(uncached_input)
+        limiter.on_success(raw.headers)
+        return result
+    
+    # Fall back to the gateway (backoff retries, then the backup model) on this client's endpoint,
+    # still within the shared budgets
+    cprint(f"Falling back to the gateway for question: {question[:50]}...", 'yellow')
+    reserved_input = int(limiter.input_estimate)
+    await limiter.acquire(reserved_input, MAX_TOKENS)
+    try:
+        completion = await gateway.complete(request, route_for(client))
+    except Exception:
+        limiter.reconcile(reserved_input, MAX_TOKENS, 0, 0)
+        raise
+    result = summarize_message(question, completion.text, completion.usage, completion.latency, completion.attempts,
+                               documents_reused, context, completion.target)
+    uncached_input = result["input_tokens"] - result["cache_read_input_tokens"]
+    limiter.reconcile(reserved_input, MAX_TOKENS, uncached_input, result["output_tokens"])
+    limiter.observe_input(uncached_input)
+    return result
+
+# Run questions concurrently under requests/token-per-minute budgets
+async def process_questions_concurrently(questions, on_result=None, client=None, limiter=None,
+                                         max_concurrency=MAX_CONCURRENCY, warmup=True, context_mode=None):
+    """Answer *questions* concurrently and return results (or exceptions) in input order.
+    
+    ``on_result(index, result)`` is called as each question finishes. With *warmup*
+    the first question runs alone so the document prefix is cached before the rest fan out.
+    """
+    if client is None:
+        # Pooled connections; retries are handled by the limiter, not the SDK
+        client = gateway.route_client(LONG_CONTEXT_ROUTE)
+    if limiter is None:
+        limiter = RateLimiter(
+            requests_per_minute=REQUESTS_PER_MINUTE,
+            input_tokens_per_minute=INPUT_TOKENS_PER_MINUTE,
+            output_tokens_per_minute=OUTPUT_TOKENS_PER_MINUTE,
+        )
+    semaphore = asyncio.Semaphore(max_concurrency)
+    
+    async def run(index, question):
+        async with semaphore:
+            try:
+                result = await process_question_async(question, client, limiter, context_mode=context_mode)
+            except Exception as e:
+                result = e
+        if on_result is not None:
+            on_result(index, result)
+        return result
+    
+    items = list(enumerate(questions))
+    results = []
+    if warmup and items:
+        results.append(await run(*items[0]))
+        items = items[1:]
+    results.extend(await asyncio.gather(*(run(index, question) for index, question in items)))
+    return results
+
+# Aggregate metrics over the completed test cases (the overall_metrics block of the results file)
+def compute_overall_metrics(test_cases):
+    completed = [case["metrics"] for case in test_cases if "inference_result" in case]
+    overall = {
+        "total_cost_usd": sum(m.get("cost_usd", 0) for m in completed),
+        "total_time_seconds": sum(m.get("time_seconds", 0) for m in completed),
+        "total_attempts": sum(m.get("attempts", 1) for m in completed),
+        "total_tokens_saved": sum(m.get("cache_read_input_tokens", 0) for m in completed),
+        "total_cost_saved_usd": sum(m.get("cost_saved_usd", 0) for m in completed),
+        "average_cost_per_question": 0,
+        "average_time_per_question": 0,
+        "completed_questions": len(completed)
+    }
+    if completed:
+        overall["average_cost_per_question"] = overall["total_cost_usd"] / len(completed)
+        overall["average_time_per_question"] = overall["total_time_seconds"] / len(completed)
+    return overall
 
 # Main function to process all questions
-def process_all_questions(test_set_path, output_path):
+def process_all_questions(test_set_path, output_path, client=None, limiter=None, max_concurrency=MAX_CONCURRENCY,
+                          context_mode=None):
     # Load the test set
     with open(test_set_path, 'r', encoding='utf-8') as f:
         test_set = json.load(f)
     
-    # Check if output file already exists to support resuming
-    start_index = 0
-    results = None
+    # Every finished question is appended to a JSONL journal; the results file is compacted from it
+    journal = ResultJournal(journal_path_for(output_path))
     
-    if os.path.exists(output_path):
+    # Seed the journal from a results file written before journaling existed
+    if os.path.exists(output_path) and not os.path.exists(journal.path):
         try:
             with open(output_path, 'r', encoding='utf-8') as f:
-                results = json.load(f)
-                
-            # Find where we left off
-            for i, test_case in enumerate(results["test_cases"]):
-                if "inference_result" not in test_case:
-                    start_index = i
-                    break
-            
-            if start_index > 0:
-                cprint(f"Resuming from question {start_index+1}", 'green')
+                imported = journal.import_results(json.load(f))
+            cprint(f"Imported {imported} finished questions from {output_path}", 'green')
         except Exception as e:
             cprint(f"Error loading existing results file: {e}", 'red')
             cprint("Starting from the beginning", 'yellow')
     
-    # If we couldn't load or resume, start fresh
-    if results is None:
-        results = test_set.copy()
-        # Initialize metrics tracking
-        results["overall_metrics"] = {
-            "total_cost_usd": 0,
-            "total_time_seconds": 0,
-            "total_attempts": 0,
-            "average_cost_per_question": 0,
-            "average_time_per_question": 0,
-            "completed_questions": 0
-        }
+    # Resume re-runs exactly the questions that are missing or failed
+    test_cases = test_set["test_cases"]
+    pending_ids = set(journal.pending_ids(test_cases))
+    pending = [i for i, test_case in enumerate(test_cases) if test_case["id"] in pending_ids]
+    total_questions = len(test_cases)
+    if len(pending) < total_questions:
+        cprint(f"Resuming: {total_questions - len(pending)} questions already done, {len(pending)} to run", 'green')
     
-    # Process each question
-    total_questions = len(results["test_cases"])
-    for i in range(start_index, total_questions):
-        test_case = results["test_cases"][i]
-        cprint(f"Processing question {i+1}/{total_questions}: {test_case['question'][:50]}...", 'blue')
-        
-        try:
-            # Process the question
-            result = process_question(test_case["question"])
-            
-            # Add the inference result to the test case
-            test_case["inference_result"] = result["answer"]
-            test_case["metrics"] = {
-                "input_tokens": result["input_tokens"],
-                "output_tokens": result["output_tokens"],
-                "cost_usd": result["cost"],
-                "time_seconds": result["time_taken"],
-                "attempts": result.get("attempts", 1)
-            }
-            
-            # Update total metrics
-            results["overall_metrics"]["total_cost_usd"] += result["cost"]
-            results["overall_metrics"]["total_time_seconds"] += result["time_taken"]
-            results["overall_metrics"]["total_attempts"] += result.get("attempts", 1)
-            results["overall_metrics"]["completed_questions"] += 1
-            
-            # Update averages
-            completed = results["overall_metrics"]["completed_questions"]
-            results["overall_metrics"]["average_cost_per_question"] = results["overall_metrics"]["total_cost_usd"] / completed
-            results["overall_metrics"]["average_time_per_question"] = results["overall_metrics"]["total_time_seconds"] / completed
-            
-            cprint(f"Successfully processed question {i+1}/{total_questions}", 'green')
+    def record_result(position, result):
+        i = pending[position]
+        test_case = test_cases[i]
         
-        except Exception as e:
-            cprint(f"Failed to process question {i+1}: {str(e)}", 'red')
-            test_case["error"] = str(e)
-        
-        # Save intermediate results after each question
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(results, f, ensure_ascii=False, indent=2)
+        if isinstance(result, Exception):
+            cprint(f"Failed to process question {i+1}: {str(result)}", 'red')
+            journal.append(test_case["id"], error=str(result))
+            return
         
-        # Wait between API calls to help avoid rate limiting
-        # The delay is dynamic based on the number of input tokens to help stay under the rate limit
-        input_tokens = test_case.get("metrics", {}).get("input_tokens", 90000)  # Default high if unknown
-        delay = max(60, math.ceil(input_tokens / 1000))  # At least 60 seconds, more for large documents
-        cprint(f"Waiting {delay} seconds before the next question to avoid rate limits...", 'yellow')
-        time.sleep(delay)
+        journal.append(test_case["id"], result["answer"], {
+            "input_tokens": result["input_tokens"],
+            "output_tokens": result["output_tokens"],
+            "cost_usd": result["cost"],
+            "time_seconds": result["time_taken"],
+            "attempts": result.get("attempts", 1),
+            "cache_read_input_tokens": result.get("cache_read_input_tokens", 0),
+            "cache_creation_input_tokens": result.get("cache_creation_input_tokens", 0),
+            "cache_status": result.get("cache_status", "none"),
+            "cost_saved_usd": result.get("cost_saved", 0),
+            "context_mode": result.get("context_mode", "full"),
+            "context_fallback": result.get("context_fallback", False),
+        })
+        cprint(f"Successfully processed question {i+1}/{total_questions}", 'green')
     
-    # Save final results
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
+    if pending:
+        # Process the remaining questions concurrently under the rate limits
+        cprint(f"Processing {len(pending)} questions with up to {max_concurrency} in flight...", 'blue')
+        asyncio.run(process_questions_concurrently(
+            [test_cases[i]["question"] for i in pending],
+            on_result=record_result,
+            client=client,
+            limiter=limiter,
+            max_concurrency=max_concurrency,
+            context_mode=context_mode,
+        ))
+    else:
+        cprint("All questions already processed", 'green')
     
-    return results
+    # Compact the journal into the results file
+    return journal.compact(test_set, output_path, overall_metrics=compute_overall_metrics)
 
 if __name__ == "__main__":
     # Define input and output paths
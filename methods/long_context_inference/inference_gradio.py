@@ -1,89 +1,103 @@
 import gradio as gr
-import anthropic
 import os
-import base64
-import time
 from dotenv import load_dotenv
 
+from inference import LONG_CONTEXT_ROUTE, cached_stream_answer
+from chat_sessions import ChatSessions, SessionStore
+from common import tracing
+from common.llm_gateway import gateway
+from common.semantic_cache import SemanticCache
+from common.serving import QueryServer, ServerBusy
+from common.thai_text import normalize_question
+
 # Load environment variables
 load_dotenv()
 
-# Initialize Anthropic client
-client = anthropic.Anthropic(api_key=os.environ["ANTHROPIC_API_KEY"])
+# Async Anthropic client on the gateway's connection pool, shared by all sessions; streams are not
+# hedged, so the SDK retries failed connection attempts itself
+client = gateway.route_client(LONG_CONTEXT_ROUTE).with_options(max_retries=2)
 
-# Function to process user query
-def process_query(user_input):
-    start_time = time.time()
-    
-    # Load PDF data
-    with open("./raw_data/taxInformation.pdf", "rb") as f:
-        pdf_data_local = base64.standard_b64encode(f.read()).decode("utf-8")
-    
-    # Make API call to Claude
-    message = client.messages.create(
-        model="claude-3-7-sonnet-20250219",
-        max_tokens=2500,
-        system="You are a tax expert. Answer the user's question based on the documents provided, answer in Thai with suitable length",
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "document",
-                        "source": {
-                            "type": "url",
-                            "url": "https://www.rd.go.th/fileadmin/user_upload/borkor/tax121260.pdf"
-                        }
-                    },
-                    {
-                        "type": "document",
-                        "source": {
-                            "type": "url",
-                            "url": "https://www.rd.go.th/fileadmin/user_upload/borkor/taxreturn23072567.pdf"
-                        }
-                    },
-                    {
-                        "type": "document",
-                        "source": {
-                            "type": "url",
-                            "url": "https://www.rd.go.th/fileadmin/download/tax_deductions_update280168.pdf"
-                        }
-                    },
-                    {
-                        "type": "document",
-                        "source": {
-                            "type": "base64",
-                            "media_type": "application/pdf",
-                            "data": pdf_data_local
-                        }
-                    },
-                    {
-                        "type": "text",
-                        "text": user_input
-                    }
-                ]
-            }
-        ],
-    )
-    
-    # Calculate metrics
-    time_taken = time.time() - start_time
-    input_tokens = message.usage.input_tokens
-    output_tokens = message.usage.output_tokens
-    cost = (input_tokens * 0.000003) + (output_tokens * 0.000015)
-    
-    # Extract response text
-    response_text = message.content[0].text
-    
-    # Create metrics summary
-    metrics = f"""
-    Input tokens: {input_tokens}
-    Output tokens: {output_tokens}
-    Cost: ${cost:.4f}
-    Time taken: {time_taken:.2f} seconds
-    """
-    
-    return response_text, metrics
+# Serving limits: generations running at once, and how many more may wait for a slot
+MAX_CONCURRENT_GENERATIONS = int(os.getenv("MAX_CONCURRENT_GENERATIONS", 4))
+MAX_QUEUED_GENERATIONS = int(os.getenv("MAX_QUEUED_GENERATIONS", 16))
+
+# Paraphrases of answered questions are served from the semantic answer cache
+answer_cache = SemanticCache("long_context", threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.95)))
+
+# Prometheus metrics are served on METRICS_PORT; set TRACE_PROFILE_PATH to dump per-request timelines as JSONL
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9464))
+tracing.enable_profiling(os.getenv("TRACE_PROFILE_PATH"))
+
+# Chat mode keeps per-browser-session history: a running summary plus recent turns, capped per turn
+chat_sessions = ChatSessions(client, SessionStore(
+    max_sessions=int(os.getenv("MAX_CHAT_SESSIONS", 1000)),
+    idle_seconds=float(os.getenv("CHAT_SESSION_IDLE_SECONDS", 3600)),
+))
+
+long_context = tracing.traced("long_context", lambda question: cached_stream_answer(question, client, answer_cache))
+long_context_chat = tracing.traced("long_context_chat", lambda question, session_id: chat_sessions.stream(session_id, question))
+
+# Requests are (question, chat session id or None); chat answers depend on the history, so they skip the answer cache
+def answer_producer(item):
+    question, session_id = item
+    return long_context(question) if session_id is None else long_context_chat(question, session_id)
+
+# Identical (normalized) questions in flight share one generation (and one trace), within a chat session in chat mode
+query_server = QueryServer(
+    answer_producer,
+    max_concurrency=MAX_CONCURRENT_GENERATIONS,
+    max_queue=MAX_QUEUED_GENERATIONS,
+    key_fn=lambda item: (normalize_question(item[0]), item[1]),
+)
+
+# Create metrics summary
+def format_metrics(update):
+    usage = update.get("usage")
+    lines = []
+    if update.get("time_to_first_token") is not None:
+        lines.append(f"Time to first token: {update['time_to_first_token']:.2f} seconds")
+    if update.get("tokens_per_second") is not None:
+        estimate = "" if usage is not None else " (estimated)"
+        lines.append(f"Output speed: {update['tokens_per_second']:.1f} tokens/second{estimate}")
+    if usage is not None:
+        lines.append(f"Input tokens: {usage['total_input_tokens']} (cache read: {usage['cache_read_input_tokens']}, cache write: {usage['cache_creation_input_tokens']})")
+        lines.append(f"Output tokens: {usage['output_tokens']}")
+        lines.append(f"Prompt cache: {usage['cache_status']} (documents reused: {update['documents_reused']}, tokens saved: {usage['tokens_saved']})")
+        lines.append(f"Cost: ${usage['cost']:.4f} (saved ${usage['cost_saved']:.4f})")
+    if update.get("session") is not None:
+        session = update["session"]
+        lines.append(f"Chat turn {session['turn']}: {session['history_turns']} earlier turns sent in full, "
+                     f"{session['summarized_turns']} summarized, {session['dropped_turns']} left out by the token cap")
+    if update.get("cache") is not None:
+        hit = update["cache"]
+        lines.append(f"Answer cache: {hit['match']} hit (similarity {hit['similarity']:.3f}) for \"{hit['matched_question']}\"")
+    cache_metrics = answer_cache.metrics()
+    lines.append(f"Answer cache hit rate: {cache_metrics['hit_rate']:.0%} ({cache_metrics['hits']}/{cache_metrics['lookups']}), "
+                 f"latency saved: {cache_metrics['latency_saved_seconds']:.1f} seconds")
+    lines.append(f"Time taken: {update['elapsed']:.2f} seconds")
+    return "\n".join(lines)
+
+# Gradio handler: streams partial answers by default, or answers in one shot when streaming is off.
+# Either way the final text comes from the same (possibly shared) generation.
+async def answer_query(user_input, streaming=True, chat_mode=False, request: gr.Request = None):
+    item = (user_input, request.session_hash if chat_mode and request is not None else None)
+    try:
+        if streaming:
+            async for update in query_server.stream(item):
+                yield update["text"], format_metrics(update)
+        else:
+            update = await query_server.submit(item)
+            yield update["text"], format_metrics(update)
+    except ServerBusy:
+        raise gr.Error("ขณะนี้มีผู้ใช้งานจำนวนมาก กรุณาลองใหม่อีกครั้ง")
+
+# Forget the chat history of this browser session
+def new_conversation(request: gr.Request):
+    chat_sessions.reset(request.session_hash)
+    return "", ""
+
+def end_session(request: gr.Request):
+    chat_sessions.reset(request.session_hash)
 
 # Create Gradio interface
 with gr.Blocks(theme=gr.themes.Soft(), title="Thai Tax Advisor (TH)") as demo:
@@ -97,13 +111,17 @@ with gr.Blocks(theme=gr.themes.Soft(), title="Thai Tax Advisor (TH)") as demo:
                 placeholder="ตัวอย่าง: ถ้ามีรายได้ต่อปี ไม่ถึง 500,000 บาท ต้องยื่นภาษีหรือไม่?",
                 lines=3
             )
-            submit_btn = gr.Button("ส่งคำถาม", variant="primary")
+            streaming_toggle = gr.Checkbox(label="แสดงคำตอบทันทีระหว่างประมวลผล (streaming)", value=True)
+            chat_toggle = gr.Checkbox(label="โหมดสนทนาต่อเนื่อง (จำคำถามและคำตอบก่อนหน้า)", value=False)
+            with gr.Row():
+                submit_btn = gr.Button("ส่งคำถาม", variant="primary")
+                new_chat_btn = gr.Button("เริ่มบทสนทนาใหม่")
         
         with gr.Column(scale=3):
             output_text = gr.Markdown(label="คำตอบ")
     
     with gr.Row():
-        metrics_output = gr.Textbox(label="สถิติการใช้งาน", lines=4, interactive=False)
+        metrics_output = gr.Textbox(label="สถิติการใช้งาน", lines=9, interactive=False)
     
     # Examples
     gr.Examples(
@@ -121,16 +139,23 @@ with gr.Blocks(theme=gr.themes.Soft(), title="Thai Tax Advisor (TH)") as demo:
     
     # Set up event handler
     submit_btn.click(
-        fn=process_query,
-        inputs=input_text,
+        fn=answer_query,
+        inputs=[input_text, streaming_toggle, chat_toggle],
         outputs=[output_text, metrics_output]
     )
     
     input_text.submit(
-        fn=process_query,
-        inputs=input_text,
+        fn=answer_query,
+        inputs=[input_text, streaming_toggle, chat_toggle],
         outputs=[output_text, metrics_output]
     )
+    
+    new_chat_btn.click(fn=new_conversation, outputs=[output_text, metrics_output])
+    demo.unload(end_session)
+
+# Let Gradio hand every request to the query server, which enforces the real limits
+demo.queue(default_concurrency_limit=MAX_CONCURRENT_GENERATIONS + MAX_QUEUED_GENERATIONS)
 
 if __name__ == "__main__":
+    tracing.start_metrics_server(METRICS_PORT)
     demo.launch(debug=True, share=True)
\ No newline at end of file
@@ -0,0 +1,124 @@
+"""Load test for the async serving path against the local mock Messages API.
+
+Simulates many concurrent chat users, a share of whom click the same questions
+(like the ``gr.Examples`` entries), and reports throughput, latency percentiles,
+LLM calls made and how many requests were coalesced or rejected.
+
+    python load_test.py --requests 300 --users 60 --duplicate-ratio 0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+import anthropic
+from termcolor import cprint
+
+from inference import REPO_ROOT, stream_answer
+from mock_messages_api import MockMessagesServer
+from common.benchmark import summarize_latencies
+from common.serving import QueryServer, ServerBusy
+
+# The example questions shown in the Gradio app: the ones users are most likely to repeat
+HOT_QUESTIONS = [
+    "อยากทราบวิธีการยื่นแบบภาษีเงินได้บุคคลธรรมดา",
+    "ถ้ามีรายได้ต่อปี ไม่ถึง 500,000 บาท ต้องยื่นภาษีหรือไม่?",
+    "ค่าเบี้ยงเลี้ยงต้องนำมาคิดรวมภาษีหรือไม่?",
+    "ประเภทเงินได้ที่ได้รับยกเว้นภาษีมีอะไรบ้าง?",
+    "เงินบริจาคให้นักการเมืองสามารถนำมาลดหย่อนภาษีได้หรือไม่?",
+    "ยื่นแบบแสดงภาษีได้ที่ไหนบ้าง?",
+    "วิธีการคํานวณภาษีเงินได้บุคคลธรรมดาสิ้นปี",
+]
+
+
+def load_questions():
+    with open(os.path.join(REPO_ROOT, "testset", "tax-test-set.json"), "r", encoding="utf-8") as f:
+        return [case["question"] for case in json.load(f)["test_cases"]]
+
+
+async def run_load(args, coalesce):
+    rng = random.Random(args.seed)
+    questions = load_questions()
+    workload = [
+        rng.choice(HOT_QUESTIONS) if rng.random() < args.duplicate_ratio else rng.choice(questions)
+        for _ in range(args.requests)
+    ]
+
+    with MockMessagesServer(latency=args.latency, token_delay=args.token_delay, output_tokens=args.output_tokens) as mock:
+        client = anthropic.AsyncAnthropic(base_url=mock.url, api_key="mock", max_retries=0)
+        server = QueryServer(
+            lambda question: stream_answer(question, client),
+            max_concurrency=args.max_concurrency,
+            max_queue=args.max_queue,
+            coalesce=coalesce,
+        )
+        latencies, first_updates = [], []
+        rejected = 0
+        next_request = iter(workload)
+
+        async def user():
+            nonlocal rejected
+            for question in next_request:
+                start = time.perf_counter()
+                first = None
+                try:
+                    async for _ in server.stream(question):
+                        if first is None:
+                            first = time.perf_counter() - start
+                except ServerBusy:
+                    rejected += 1
+                    await asyncio.sleep(args.think_time)
+                    continue
+                latencies.append(time.perf_counter() - start)
+                first_updates.append(first)
+                await asyncio.sleep(args.think_time)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(user() for _ in range(args.users)))
+        wall = time.perf_counter() - start
+        llm_calls = len(mock.requests)
+        await client.close()
+
+    return {
+        "mode": "coalesced" if coalesce else "independent",
+        "completed": len(latencies),
+        "rejected": rejected,
+        "llm_calls": llm_calls,
+        "coalesced": server.stats["coalesced"],
+        "throughput_rps": len(latencies) / wall,
+        "latency": summarize_latencies(latencies),
+        "time_to_first_update": summarize_latencies(first_updates),
+        "wall_seconds": wall,
+    }
+
+
+def print_report(report):
+    latency, first = report["latency"], report["time_to_first_update"]
+    cprint(f"\n== {report['mode']} ==", 'blue')
+    cprint(f"Completed: {report['completed']}  rejected: {report['rejected']}  "
+           f"LLM calls: {report['llm_calls']}  coalesced: {report['coalesced']}", 'cyan')
+    cprint(f"Throughput: {report['throughput_rps']:.2f} requests/second over {report['wall_seconds']:.1f} seconds", 'green')
+    cprint(f"Latency p50: {latency['p50']:.3f}s  p95: {latency['p95']:.3f}s  p99: {latency['p99']:.3f}s", 'yellow')
+    cprint(f"First update p50: {first['p50']:.3f}s  p95: {first['p95']:.3f}s", 'yellow')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--users", type=int, default=40, help="concurrent simulated users")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.5, help="share of requests picking an example question")
+    parser.add_argument("--max-concurrency", type=int, default=4)
+    parser.add_argument("--max-queue", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.5, help="mock time to first token (seconds)")
+    parser.add_argument("--token-delay", type=float, default=0.005, help="mock delay between streamed deltas (seconds)")
+    parser.add_argument("--output-tokens", type=int, default=300)
+    parser.add_argument("--think-time", type=float, default=0.05, help="pause between a user's requests (seconds)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-compare", action="store_true", help="only run the coalesced mode")
+    args = parser.parse_args()
+
+    modes = [True] if args.no_compare else [False, True]
+    for coalesce in modes:
+        print_report(asyncio.run(run_load(args, coalesce)))
@@ -0,0 +1,378 @@
+"""Local stand-in for the Anthropic Messages API.
+
+Point the SDK at it with ``anthropic.Anthropic(base_url=server.url, api_key="mock")``
+(or ``ANTHROPIC_BASE_URL``) to exercise the inference code without network access.
+It mimics prompt caching: the prefix up to the last ``cache_control`` breakpoint is
+billed as ``cache_creation_input_tokens`` the first time and as
+``cache_read_input_tokens`` afterwards (with several breakpoints, up to the
+longest prefix cached before). Requests that declare ``tools`` get a
+``tool_use`` reply calling the first tool until *tool_rounds* tool results have
+been sent back, like an agent looking something up before answering. It also
+answers OpenAI-style ``POST /v1/chat/completions`` (without streaming), so one
+mock can stand in for either kind of provider, and can make a share of requests
+slow or fail to exercise hedging, retries and failover.
+"""
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DOCUMENT_TOKENS = 3385  # ~13.5k tokens for the four tax PDFs
+MAX_TOKENS = 4096
+
+
+def estimate_tokens(block):
+    """Rough token count for a content block (documents use a fixed size)."""
+    if isinstance(block, str):
+        return max(1, len(block) // 3)
+    if block.get("type") in ("document", "file"):
+        return DOCUMENT_TOKENS
+    if block.get("type") == "text":
+        return max(1, len(block.get("text", "")) // 3)
+    if block.get("type") == "tool_use":
+        return max(1, len(json.dumps(block.get("input", {}), ensure_ascii=False)) // 3)
+    if block.get("type") == "tool_result":
+        content = block.get("content", "")
+        if isinstance(content, str):
+            return max(1, len(content) // 3)
+        return sum(estimate_tokens(b) for b in content)
+    return 0
+
+
+def _flatten(body):
+    """System and message blocks in prompt order, as (block, is_breakpoint) pairs."""
+    blocks = []
+    system = body.get("system")
+    if isinstance(system, str):
+        blocks.append((system, False))
+    elif isinstance(system, list):
+        blocks.extend((b, "cache_control" in b) for b in system)
+
+    for message in body.get("messages", []):
+        content = message["content"]
+        if isinstance(content, str):
+            blocks.append((content, False))
+        else:
+            blocks.extend((b, "cache_control" in b) for b in content)
+    return blocks
+
+
+def _last_user_text(body):
+    for message in reversed(body.get("messages", [])):
+        if message["role"] != "user":
+            continue
+        content = message["content"]
+        if isinstance(content, str):
+            return content
+        texts = [b["text"] for b in content if b.get("type") == "text"]
+        if texts:
+            return texts[-1]
+    return ""
+
+
+def _tool_results(body):
+    """Number of ``tool_result`` blocks sent back so far in the conversation."""
+    return sum(1 for message in body.get("messages", []) if isinstance(message["content"], list)
+               for block in message["content"] if block.get("type") == "tool_result")
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connections when many clients open at once
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # A client that gave up (a cancelled hedge or timeout) is not a server error
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+class MockMessagesServer:
+    """Threaded HTTP server answering ``POST /v1/messages`` with canned responses.
+
+    :param latency:       Seconds to sleep before answering (time to first token when streaming).
+    :param output_tokens: ``usage.output_tokens`` reported for every answer.
+    :param answer_fn:     Optional ``fn(question) -> str`` for the answer text.
+    :param requests_per_minute: When set, requests beyond this many per *window*
+                          seconds get a 429 ``rate_limit_error`` with ``retry-after``.
+    :param token_delay:   Seconds between text deltas for ``"stream": true`` requests.
+    :param chunk_chars:   Characters per streamed text delta.
+    :param tool_rounds:   Tool calls made before answering when the request declares ``tools``.
+    :param prefill_tokens_per_second: When set, the time to first token grows with the
+                          prompt: uncached input tokens are read at this rate, cache
+                          reads ten times faster.
+    :param slow_ratio:    Share of requests delayed by another *slow_latency* seconds (a latency tail).
+    :param fail_ratio:    Share of requests answered with a 529 ``overloaded_error``.
+    :param seed:          Seed for picking the slow and failing requests.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, output_tokens=200, answer_fn=None,
+                 requests_per_minute=None, window=60.0, token_delay=0.0, chunk_chars=8, tool_rounds=1,
+                 prefill_tokens_per_second=None, slow_ratio=0.0, slow_latency=0.0, fail_ratio=0.0, seed=0):
+        self.latency = latency
+        self.slow_ratio = slow_ratio
+        self.slow_latency = slow_latency
+        self.fail_ratio = fail_ratio
+        self.failed = 0
+        self._random = random.Random(seed)
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.tool_rounds = tool_rounds
+        self.token_delay = token_delay
+        self.chunk_chars = chunk_chars
+        self.output_tokens = output_tokens
+        self.answer_fn = answer_fn or (lambda q: f"คำตอบ (จำลอง) สำหรับคำถาม: {q}")
+        self.requests_per_minute = requests_per_minute
+        self.window = window
+        self.rate_limited = 0
+        self.requests = []  # parsed request bodies, in arrival order
+        self._arrivals = []  # monotonic timestamps of accepted requests
+        self._cached_prefixes = set()
+        self._lock = threading.Lock()
+        self._httpd = _Server((host, port), self._make_handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def usage_for(self, body, output_tokens=None):
+        """Compute the usage block for a request, updating the simulated prompt cache.
+
+        The longest prefix ending at a breakpoint that was cached before is read;
+        the rest up to the last breakpoint is written.
+        """
+        blocks = _flatten(body)
+        tokens = [estimate_tokens(b) for b, _ in blocks]
+        hasher = hashlib.sha256()
+        prefix_keys = []  # (index of the breakpoint block, hash of the prefix through it)
+        for i, (block, is_breakpoint) in enumerate(blocks):
+            hasher.update(json.dumps(block, sort_keys=True).encode("utf-8"))
+            if is_breakpoint:
+                prefix_keys.append((i, hasher.copy().hexdigest()))
+
+        last_breakpoint = prefix_keys[-1][0] if prefix_keys else -1
+        with self._lock:
+            cached_through = max((i for i, key in prefix_keys if key in self._cached_prefixes), default=-1)
+            self._cached_prefixes.update(key for _, key in prefix_keys)
+        default_output = self.output_tokens if output_tokens is None else output_tokens
+        return {
+            "input_tokens": sum(tokens[last_breakpoint + 1:]),
+            "output_tokens": min(default_output, body.get("max_tokens", default_output)),
+            "cache_creation_input_tokens": sum(tokens[cached_through + 1:last_breakpoint + 1]),
+            "cache_read_input_tokens": sum(tokens[:cached_through + 1]),
+        }
+
+    def prefill_seconds(self, usage):
+        """Simulated time to read the prompt of a request with this *usage*."""
+        if not self.prefill_tokens_per_second:
+            return 0.0
+        uncached = usage["input_tokens"] + usage["cache_creation_input_tokens"]
+        return (uncached + usage["cache_read_input_tokens"] / 10) / self.prefill_tokens_per_second
+
+    def draw_fault(self):
+        """``(extra seconds, fail)`` for a new request."""
+        with self._lock:
+            slow, fail = self._random.random() < self.slow_ratio, self._random.random() < self.fail_ratio
+            if fail:
+                self.failed += 1
+        return (self.slow_latency if slow else 0.0), fail
+
+    def build_chat_completion(self, body):
+        """OpenAI-style chat completion for *body*, answering its last user message."""
+        with self._lock:
+            self.requests.append(body)
+            completion_id = f"chatcmpl-mock-{len(self.requests)}"
+        messages = body.get("messages", [])
+        question = next((m["content"] if isinstance(m["content"], str)
+                         else " ".join(p.get("text", "") for p in m["content"] if p.get("type") == "text")
+                         for m in reversed(messages) if m["role"] == "user"), "")
+        text = self.answer_fn(question)[:body.get("max_tokens", MAX_TOKENS) * 3]
+        prompt_tokens = sum(estimate_tokens(m["content"]) if isinstance(m["content"], str)
+                            else sum(estimate_tokens(p) for p in m["content"]) for m in messages)
+        completion_tokens = min(self.output_tokens, body.get("max_tokens", self.output_tokens))
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    def check_rate_limit(self):
+        """Return (allowed, headers) for a new request under the simulated request limit."""
+        if self.requests_per_minute is None:
+            return True, {}
+
+        now = time.monotonic()
+        with self._lock:
+            self._arrivals = [t for t in self._arrivals if now - t < self.window]
+            allowed = len(self._arrivals) < self.requests_per_minute
+            if allowed:
+                self._arrivals.append(now)
+            else:
+                self.rate_limited += 1
+            remaining = self.requests_per_minute - len(self._arrivals)
+            retry_after = self.window - (now - self._arrivals[0]) if self._arrivals else 0.0
+
+        headers = {
+            "anthropic-ratelimit-requests-limit": str(self.requests_per_minute),
+            "anthropic-ratelimit-requests-remaining": str(max(0, remaining)),
+        }
+        if not allowed:
+            headers["retry-after"] = f"{max(0.0, retry_after):.3f}"
+        return allowed, headers
+
+    def build_message(self, body):
+        with self._lock:
+            self.requests.append(body)
+            message_id = f"msg_mock_{len(self.requests)}"
+        question = _last_user_text(body)
+        if body.get("tools") and _tool_results(body) < self.tool_rounds:
+            tool_use = {"type": "tool_use", "id": message_id.replace("msg_", "toolu_"),
+                        "name": body["tools"][0]["name"], "input": {"query": question}}
+            content, stop_reason = [tool_use], "tool_use"
+            usage = self.usage_for(body, output_tokens=estimate_tokens(tool_use))
+        else:
+            # Like the API, stop at max_tokens (about three characters per token here)
+            text = self.answer_fn(question)
+            limit = body.get("max_tokens", MAX_TOKENS) * 3
+            stop_reason = "max_tokens" if len(text) > limit else "end_turn"
+            content = [{"type": "text", "text": text[:limit]}]
+            usage = self.usage_for(body)
+        return {
+            "id": message_id,
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "mock"),
+            "content": content,
+            "stop_reason": stop_reason,
+            "stop_sequence": None,
+            "usage": usage,
+        }
+
+    def stream_events(self, message):
+        """Server-sent events equivalent to *message*, in the Messages streaming format."""
+        usage = message["usage"]
+        start = dict(message, content=[], stop_reason=None, usage=dict(usage, output_tokens=1))
+        yield "message_start", {"type": "message_start", "message": start}
+        for index, block in enumerate(message["content"]):
+            if block["type"] == "tool_use":
+                yield "content_block_start", {"type": "content_block_start", "index": index,
+                                              "content_block": dict(block, input={})}
+                yield "content_block_delta", {"type": "content_block_delta", "index": index,
+                                              "delta": {"type": "input_json_delta",
+                                                        "partial_json": json.dumps(block["input"], ensure_ascii=False)}}
+            else:
+                text = block["text"]
+                yield "content_block_start", {"type": "content_block_start", "index": index,
+                                              "content_block": {"type": "text", "text": ""}}
+                for i in range(0, len(text), self.chunk_chars):
+                    yield "content_block_delta", {"type": "content_block_delta", "index": index,
+                                                  "delta": {"type": "text_delta", "text": text[i:i + self.chunk_chars]}}
+            yield "content_block_stop", {"type": "content_block_stop", "index": index}
+        yield "message_delta", {"type": "message_delta",
+                                "delta": {"stop_reason": message["stop_reason"], "stop_sequence": None},
+                                "usage": {"output_tokens": usage["output_tokens"]}}
+        yield "message_stop", {"type": "message_stop"}
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, payload, headers=None):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                path = self.path.rstrip("/")
+                chat = path.endswith("/chat/completions")
+                if not chat and not path.endswith("/v1/messages"):
+                    self._send_json(404, {"type": "error", "error": {"type": "not_found_error", "message": self.path}})
+                    return
+
+                allowed, headers = server.check_rate_limit()
+                if not allowed:
+                    self._send_json(429, {"type": "error", "error": {"type": "rate_limit_error", "message": "Mock rate limit exceeded"}}, headers)
+                    return
+
+                extra, fail = server.draw_fault()
+                if server.latency or extra:
+                    time.sleep(server.latency + extra)
+                if fail:
+                    self._send_json(529, {"type": "error", "error": {"type": "overloaded_error", "message": "Mock overloaded"}})
+                    return
+                if chat:
+                    self._send_json(200, server.build_chat_completion(body), headers)
+                    return
+                message = server.build_message(body)
+                prefill = server.prefill_seconds(message["usage"])
+                if prefill:
+                    time.sleep(prefill)
+                if body.get("stream"):
+                    self._send_stream(message, headers)
+                else:
+                    self._send_json(200, message, headers)
+
+            def _send_stream(self, message, headers):
+                # No Content-Length: the body ends when the connection closes
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.close_connection = True
+
+                for event, data in server.stream_events(message):
+                    payload = json.dumps(data, ensure_ascii=False)
+                    self.wfile.write(f"event: {event}\ndata: {payload}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                    if event == "content_block_delta" and server.token_delay:
+                        time.sleep(server.token_delay)
+
+        return Handler
+
+
+if __name__ == "__main__":
+    with MockMessagesServer(port=8787) as mock:
+        print(f"Mock Messages API listening on {mock.url} (Ctrl+C to stop)")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,129 @@
+"""Throughput of the micro-batching embedding service against per-query ``model.encode``.
+
+Concurrent clients each embed one question at a time, like chat users hitting
+``find_similar_questions``. The baseline calls the model once per question, as
+the RAG notebooks do; the batched run sends the same workload through
+:class:`~common.embedding_service.EmbeddingBatcher`.
+
+``--backend simulated`` needs no model: a forward pass costs ``--call-ms`` plus
+``--item-ms`` per text and, as a CPU forward pass does, occupies the whole
+machine, so only one runs at a time.
+
+    python benchmark_embedding_service.py --backend int8 --clients 16
+    python benchmark_embedding_service.py --backend simulated --call-ms 40 --item-ms 4
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from termcolor import cprint
+
+from benchmark_vector_index import REPO_ROOT
+from common.benchmark import summarize_latencies
+from common.embedding_service import EmbeddingBatcher, EmbeddingClient, EmbeddingServer, load_bge_m3
+from common.semantic_cache import hashed_ngram_embedder
+from common.vector_index import load_records
+
+
+def simulated_encoder(call_ms, item_ms):
+    embed = hashed_ngram_embedder(dim=1024)
+    device = threading.Lock()
+
+    def encode(texts):
+        with device:
+            time.sleep((call_ms + item_ms * len(texts)) / 1000.0)
+        return embed(texts)
+
+    return encode
+
+
+def load_workload(args):
+    with open(os.path.join(REPO_ROOT, "testset", "tax-test-set.json"), "r", encoding="utf-8") as f:
+        questions = [case["question"] for case in json.load(f)["test_cases"]]
+    questions += [record["question"] for record in load_records()]
+    rng = random.Random(args.seed)
+    # Unique suffixes keep repeats down to --duplicate-ratio so the cache does not flatter the batcher
+    return [rng.choice(questions) if rng.random() < args.duplicate_ratio else f"{rng.choice(questions)} #{i}"
+            for i in range(args.requests)]
+
+
+def run_clients(embed_fn, workload, clients):
+    latencies = []
+
+    def one(question):
+        start = time.perf_counter()
+        embed_fn([question])
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(one, workload))
+    wall = time.perf_counter() - start
+    return {"throughput": len(workload) / wall, "wall": wall, "latency": summarize_latencies(latencies)}
+
+
+def print_report(name, report):
+    latency = report["latency"]
+    cprint(f"\n== {name} ==", 'blue')
+    cprint(f"Throughput: {report['throughput']:.1f} questions/second ({report['wall']:.2f}s)", 'green')
+    cprint(f"Latency p50: {latency['p50'] * 1000:.1f} ms  p95: {latency['p95'] * 1000:.1f} ms  "
+           f"p99: {latency['p99'] * 1000:.1f} ms", 'yellow')
+
+
+def print_histogram(title, snapshot):
+    cprint(f"{title} (mean {snapshot['mean']:.2f}):", 'cyan')
+    previous = 0
+    for bound, cumulative in snapshot["buckets"].items():
+        if cumulative > previous:
+            print(f"  <= {bound:>5}: {cumulative - previous}")
+        previous = cumulative
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["simulated", "torch", "int8", "onnx"], default="simulated")
+    parser.add_argument("--call-ms", type=float, default=40.0, help="simulated cost of a forward pass")
+    parser.add_argument("--item-ms", type=float, default=4.0, help="simulated extra cost per text in a batch")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.3, help="share of requests repeating a known question")
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--cache-size", type=int, default=4096)
+    parser.add_argument("--http", action="store_true", help="go through the HTTP service instead of in-process")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    encode = (simulated_encoder(args.call_ms, args.item_ms) if args.backend == "simulated"
+              else load_bge_m3(args.backend))
+    encode(["warm up"])
+    workload = load_workload(args)
+
+    print_report(f"per-query encode ({args.backend})", run_clients(encode, workload, args.clients))
+
+    batcher = EmbeddingBatcher(encode, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms,
+                               cache_size=args.cache_size)
+    if args.http:
+        with EmbeddingServer(batcher) as server:
+            report = run_clients(EmbeddingClient(server.url), workload, args.clients)
+    else:
+        report = run_clients(batcher, workload, args.clients)
+    print_report(f"micro-batched ({args.backend}, max wait {args.max_wait_ms} ms"
+                 f"{', over HTTP' if args.http else ''})", report)
+
+    metrics = batcher.metrics()
+    cprint(f"Forward passes: {metrics['batches']}  cache hit rate: {metrics['cache_hit_rate']:.1%}", 'cyan')
+    print_histogram("Batch size", metrics["batch_size"])
+    print_histogram("Queue latency (ms)", metrics["queue_latency_ms"])
+    batcher.close()
+
+    # Batched and per-query embeddings of the same text must agree
+    sample = workload[:8]
+    batcher = EmbeddingBatcher(encode)
+    assert np.allclose(batcher.embed(sample), encode(sample), atol=1e-3)
+    batcher.close()
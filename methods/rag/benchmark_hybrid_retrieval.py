@@ -0,0 +1,105 @@
+"""MRR and end-to-end latency of dense-only, BM25-only and hybrid (RRF) retrieval.
+
+Latency covers question in -> matches out, so it includes the bge-m3 forward pass
+that the lexical fast path skips. Queries are the test-set questions and the
+knowledge-base questions (both labelled, see ``benchmark_vector_index.py``) plus a
+few bare tax terms, which are unlabelled and only count towards latency and the
+fast-path rate.
+
+    python benchmark_hybrid_retrieval.py
+    python benchmark_hybrid_retrieval.py --embedder hashed --embed-ms 25   # offline, simulated forward pass
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from termcolor import cprint
+
+from benchmark_vector_index import REPO_ROOT, mean_reciprocal_rank, relevant_ids
+from common.benchmark import summarize_latencies
+from common.hybrid_retriever import HybridRetriever
+from common.lexical_index import BM25Index
+from common.semantic_cache import bge_m3_embedder, hashed_ngram_embedder
+from common.vector_index import VectorIndex, load_records
+
+TERM_QUERIES = ["ลดหย่อน", "ภ.ง.ด.90", "ภ.ง.ด.91", "เบี้ยเลี้ยง", "ค่าเบี้ยเลี้ยง", "เงินได้พึงประเมิน", "บำเหน็จ"]
+
+
+def timed_embedder(embed, embed_ms):
+    def embed_with_delay(texts):
+        if embed_ms:
+            time.sleep(embed_ms / 1000.0)
+        return embed(texts)
+
+    return embed_with_delay
+
+
+def run(args):
+    embed = hashed_ngram_embedder() if args.embedder == "hashed" else bge_m3_embedder()
+    records = load_records()
+    with open(os.path.join(REPO_ROOT, "testset", "tax-test-set.json"), "r", encoding="utf-8") as f:
+        test_cases = json.load(f)["test_cases"]
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        start = time.perf_counter()
+        lexical = BM25Index.build(records)
+        lexical.save(index_dir)
+        lexical_build = time.perf_counter() - start
+        start = time.perf_counter()
+        lexical = BM25Index.load(index_dir)
+        lexical_open = time.perf_counter() - start
+        lexical_bytes = sum(os.path.getsize(p) for p in BM25Index._paths(index_dir, "knowledge_base"))
+        dense = VectorIndex.build(records, embed, index_dir=index_dir)
+        dense.embed_fn = timed_embedder(embed, args.embed_ms)
+        cprint(f"BM25 index: {len(lexical.vocabulary)} terms, {len(lexical.weights)} postings, "
+               f"{lexical_bytes / 1e3:.1f} KB on disk, built in {lexical_build:.2f}s, "
+               f"opened in {lexical_open * 1000:.2f} ms", 'cyan')
+
+        labelled = [(case["question"], label) for case, label in zip(test_cases, relevant_ids(test_cases, records))]
+        labelled += [(record["question"], record["id"]) for record in records]
+        questions = [q for q, _ in labelled] + TERM_QUERIES
+        hybrid_kwargs = dict(candidates=args.candidates, min_lexical_score=args.min_lexical_score,
+                             decisive_ratio=args.decisive_ratio)
+        modes = {
+            "dense only": dense.query,
+            "BM25 only": lexical.query,
+            "hybrid RRF": HybridRetriever(lexical, dense, fast_path=False, **hybrid_kwargs).query,
+            "hybrid RRF + fast path": HybridRetriever(lexical, dense, **hybrid_kwargs).query,
+        }
+
+        # Warm up tokenizer dictionaries, the embedding model and the float32 view of the index
+        for query in modes.values():
+            query(questions[0], top_k=args.top_k)
+
+        for name, query in modes.items():
+            latencies, ranked, lexical_only = [], [], 0
+            for _ in range(args.repeats):
+                for question in questions:
+                    start = time.perf_counter()
+                    result = query(question, top_k=args.top_k)
+                    latencies.append(time.perf_counter() - start)
+                    if len(ranked) < len(questions):
+                        ranked.append([match["id"] for match in result["matches"]])
+                        lexical_only += result.get("retrieval") == "lexical"
+            summary = summarize_latencies(latencies)
+            test_mrr = mean_reciprocal_rank(ranked[:len(test_cases)], [l for _, l in labelled[:len(test_cases)]])
+            kb_mrr = mean_reciprocal_rank(ranked[len(test_cases):len(labelled)], [l for _, l in labelled[len(test_cases):]])
+            cprint(f"\n== {name} ==", 'blue')
+            cprint(f"Latency p50: {summary['p50'] * 1000:.2f} ms  p95: {summary['p95'] * 1000:.2f} ms", 'yellow')
+            cprint(f"MRR@{args.top_k} test set: {test_mrr:.4f}  knowledge-base questions: {kb_mrr:.4f}", 'green')
+            if name.endswith("fast path"):
+                cprint(f"Lexical fast path: {lexical_only}/{len(questions)} queries skipped the embedding", 'cyan')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embedder", choices=["bge-m3", "hashed"], default="bge-m3")
+    parser.add_argument("--embed-ms", type=float, default=0.0, help="extra delay per embedding call (simulated forward pass)")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--candidates", type=int, default=20, help="depth of each ranking fed to RRF")
+    parser.add_argument("--min-lexical-score", type=float, default=2.0)
+    parser.add_argument("--decisive-ratio", type=float, default=0.6)
+    parser.add_argument("--repeats", type=int, default=5)
+    run(parser.parse_args())
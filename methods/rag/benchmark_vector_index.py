@@ -0,0 +1,158 @@
+"""Latency and retrieval quality of the memory-mapped float16 index against FAISS flat.
+
+Both indexes hold the same knowledge-base embeddings. Reported per index:
+open/build time, single-query and batched search latency, MRR@k on
+``testset/tax-test-set.json`` (the relevant record is the one whose answer the
+golden answer was taken from) and MRR@k for the knowledge-base questions
+themselves, as in ``rag_test_ong_version.ipynb``. ``--synthetic`` pads both
+indexes with random unit vectors to see how search scales past the 18 records.
+
+    python benchmark_vector_index.py                      # bge-m3, needs torch
+    python benchmark_vector_index.py --embedder hashed    # offline, no model download
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from termcolor import cprint
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if REPO_ROOT not in sys.path:
+    sys.path.append(REPO_ROOT)
+
+from common.benchmark import summarize_latencies
+from common.semantic_cache import bge_m3_embedder, hashed_ngram_embedder
+from common.vector_index import VectorIndex, load_records
+
+
+def char_ngrams(text, n=3):
+    text = text.replace(" ", "")
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def relevant_ids(test_cases, records):
+    """Knowledge-base id each test case's golden answer was copied from (highest trigram overlap)."""
+    record_grams = [(record["id"], char_ngrams(record["answer"])) for record in records]
+    labels = []
+    for case in test_cases:
+        golden = char_ngrams(case["golden_answer"])
+        labels.append(max(record_grams, key=lambda item: len(golden & item[1]))[0])
+    return labels
+
+
+def mean_reciprocal_rank(ranked_ids, relevant):
+    total = 0.0
+    for ranked, target in zip(ranked_ids, relevant):
+        if target in ranked:
+            total += 1.0 / (ranked.index(target) + 1)
+    return total / len(relevant) if relevant else 0.0
+
+
+def time_single_queries(search, queries, repeats):
+    latencies = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        search(queries[i % len(queries)])
+        latencies.append(time.perf_counter() - start)
+    return summarize_latencies(latencies)
+
+
+def run(args):
+    embed = hashed_ngram_embedder() if args.embedder == "hashed" else bge_m3_embedder()
+    records = load_records()
+    with open(os.path.join(REPO_ROOT, "testset", "tax-test-set.json"), "r", encoding="utf-8") as f:
+        test_cases = json.load(f)["test_cases"]
+
+    start = time.perf_counter()
+    doc_vectors = np.asarray(embed([record["answer"] for record in records]), dtype=np.float32)
+    test_vectors = np.asarray(embed([case["question"] for case in test_cases]), dtype=np.float32)
+    kb_vectors = np.asarray(embed([record["question"] for record in records]), dtype=np.float32)
+    cprint(f"Embedded {len(records)} documents and {len(test_cases) + len(records)} queries "
+           f"with {args.embedder} in {time.perf_counter() - start:.2f}s", 'cyan')
+
+    ids = [record["id"] for record in records]
+    metadata = [{"question": record["question"], "answer": record["answer"]} for record in records]
+    if args.synthetic > len(records):
+        rng = np.random.default_rng(args.seed)
+        extra = rng.standard_normal((args.synthetic - len(records), doc_vectors.shape[1])).astype(np.float32)
+        doc_vectors = np.concatenate([doc_vectors, extra / np.linalg.norm(extra, axis=1, keepdims=True)])
+        ids += [f"synthetic-{i}" for i in range(len(extra))]
+        metadata += [{}] * len(extra)
+
+    test_labels = relevant_ids(test_cases, records)
+    kb_labels = [record["id"] for record in records]
+    queries = np.concatenate([test_vectors, kb_vectors])
+    reports = []
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        VectorIndex.write(doc_vectors, ids, metadata, index_dir=index_dir, name="benchmark")
+        start = time.perf_counter()
+        index = VectorIndex.load(index_dir, "benchmark")
+        open_seconds = time.perf_counter() - start
+        size_mb = os.path.getsize(os.path.join(index_dir, "benchmark.npy")) / 1e6
+
+        def mmap_ranked(vectors):
+            _, rows = index.search(vectors, top_k=args.top_k)
+            return [[index.ids[r] for r in row] for row in rows]
+
+        reports.append(("mmap float16", open_seconds, size_mb, mmap_ranked,
+                        lambda q: index.search(q, top_k=args.top_k)))
+
+        try:
+            import faiss
+        except ImportError:
+            faiss = None
+            cprint("faiss is not installed (pip install faiss-cpu); skipping the FAISS flat baseline", 'red')
+        if faiss is not None:
+            normalised = doc_vectors / np.linalg.norm(doc_vectors, axis=1, keepdims=True)
+            start = time.perf_counter()
+            flat = faiss.IndexFlatIP(normalised.shape[1])
+            flat.add(normalised)
+            build_seconds = time.perf_counter() - start
+
+            def faiss_search(vectors):
+                vectors = np.atleast_2d(vectors).astype(np.float32)
+                return flat.search(vectors / np.linalg.norm(vectors, axis=1, keepdims=True), args.top_k)
+
+            def faiss_ranked(vectors):
+                _, rows = faiss_search(vectors)
+                return [[ids[r] for r in row if r >= 0] for row in rows]
+
+            reports.append(("FAISS flat float32", build_seconds, normalised.nbytes / 1e6, faiss_ranked, faiss_search))
+
+        results = {}
+        for name, open_seconds, size_mb, ranked, search in reports:
+            single = time_single_queries(search, queries, args.repeats)
+            start = time.perf_counter()
+            for _ in range(args.batch_repeats):
+                ranked(queries)
+            batch_seconds = (time.perf_counter() - start) / args.batch_repeats
+            results[name] = ranked(queries)
+            cprint(f"\n== {name} ({len(ids)} vectors, {size_mb:.2f} MB) ==", 'blue')
+            cprint(f"Open/build: {open_seconds * 1000:.2f} ms", 'cyan')
+            cprint(f"Single query p50: {single['p50'] * 1e6:.0f} us  p95: {single['p95'] * 1e6:.0f} us", 'yellow')
+            cprint(f"Batch of {len(queries)}: {batch_seconds * 1000:.2f} ms "
+                   f"({batch_seconds / len(queries) * 1e6:.0f} us/query)", 'yellow')
+            cprint(f"MRR@{args.top_k} test set: {mean_reciprocal_rank(results[name][:len(test_cases)], test_labels):.4f}  "
+                   f"knowledge-base questions: {mean_reciprocal_rank(results[name][len(test_cases):], kb_labels):.4f}",
+                   'green')
+
+        if len(results) == 2:
+            mmap_ids, faiss_ids = results.values()
+            overlap = np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(mmap_ids, faiss_ids)])
+            cprint(f"\nTop-{args.top_k} overlap of float16 mmap with FAISS flat: {overlap:.4f}", 'green')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embedder", choices=["bge-m3", "hashed"], default="bge-m3")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=1000, help="single queries timed per index")
+    parser.add_argument("--batch-repeats", type=int, default=20)
+    parser.add_argument("--synthetic", type=int, default=0, help="pad the index with random vectors up to this size")
+    parser.add_argument("--seed", type=int, default=0)
+    run(parser.parse_args())